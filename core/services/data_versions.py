@@ -0,0 +1,70 @@
+"""
+Data versions that tell report caches when their inputs changed.
+
+Every scope has an opaque token in the report cache. A write replaces the
+tokens of the scopes it touched once its transaction commits, and a cached
+report is keyed by the tokens of the scopes it reads, so a changed token
+simply makes the old entries unreachable.
+
+Tokens are random rather than counters: two writers replacing the same
+token concurrently still both leave a value no reader has seen, which an
+increment on a non-atomic backend such as the file cache cannot promise.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+KEY_PREFIX = 'data-version:'
+
+# Any stock or operation change anywhere.
+ALL = 'all'
+# Names of warehouses, items, stations, suppliers and beneficiaries.
+CATALOG = 'catalog'
+
+
+def warehouse_scope(warehouse_id):
+    return f'warehouse:{warehouse_id}'
+
+
+def _cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def bump(scopes):
+    _cache().set_many({KEY_PREFIX + scope: uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def bump_on_commit(scopes):
+    """
+    Replaces the tokens of `scopes` after the current transaction commits (at once outside one),
+    so no reader can cache data older than the token it was stored under.
+    """
+    scopes = set(scopes)
+    if scopes:
+        transaction.on_commit(lambda: bump(scopes))
+
+
+def bump_warehouses_on_commit(warehouse_ids):
+    scopes = {warehouse_scope(warehouse_id) for warehouse_id in warehouse_ids if warehouse_id}
+    if scopes:
+        bump_on_commit([ALL, *scopes])
+
+
+def current(scopes):
+    """
+    Returns the tokens of `scopes` in order, creating the ones that are missing.
+    """
+    cache = _cache()
+    keys = [KEY_PREFIX + scope for scope in scopes]
+    tokens = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in tokens}
+    if missing:
+        for key, token in missing.items():
+            # add() keeps a token another process created in the meantime.
+            if not cache.add(key, token, timeout=None):
+                missing[key] = cache.get(key, token)
+        tokens.update(missing)
+    return [tokens[key] for key in keys]
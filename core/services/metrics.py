@@ -0,0 +1,45 @@
+"""
+Process-wide counters kept in the default cache.
+
+Configure a shared cache backend (Redis, Memcached, database) for the
+counters to add up across worker processes; with the default local-memory
+cache each process keeps its own numbers.
+"""
+from django.core.cache import cache
+
+
+KEY_PREFIX = 'metrics:'
+
+TRANSACTION_RETRIES = 'stock.transaction_retries'
+TRANSACTION_RETRIES_EXHAUSTED = 'stock.transaction_retries_exhausted'
+
+STOCK_VERSION_CONFLICTS = 'stock.version_conflicts'
+STOCK_VERSION_CONFLICTS_EXHAUSTED = 'stock.version_conflicts_exhausted'
+
+REPORT_CACHE_HITS = 'reports.cache_hits'
+REPORT_CACHE_MISSES = 'reports.cache_misses'
+
+COUNTERS = [
+    TRANSACTION_RETRIES,
+    TRANSACTION_RETRIES_EXHAUSTED,
+    STOCK_VERSION_CONFLICTS,
+    STOCK_VERSION_CONFLICTS_EXHAUSTED,
+    REPORT_CACHE_HITS,
+    REPORT_CACHE_MISSES,
+]
+
+
+def increment(name, value=1):
+    key = KEY_PREFIX + name
+    try:
+        cache.incr(key, value)
+    except ValueError:
+        # incr() does not create missing keys.
+        if not cache.add(key, value, timeout=None):
+            cache.incr(key, value)
+
+
+def snapshot(names=None):
+    names = names or COUNTERS
+    values = cache.get_many([KEY_PREFIX + name for name in names])
+    return {name: values.get(KEY_PREFIX + name, 0) for name in names}
@@ -1,10 +1,30 @@
 # في apps/core/mixins.py
+from inventory.models import WarehouseClosure
+
+
+def managed_warehouse_ids(request):
+    """
+    The ids of the warehouses the user is storekeeper of and of every warehouse under
+    them. Read once per request with one join on the warehouse closure table, and
+    reused by the viewset, its serializers and the report cache. Empty for anonymous users.
+    """
+    if not request.user.is_authenticated:
+        return frozenset()
+    warehouse_ids = getattr(request, '_managed_warehouse_ids', None)
+    if warehouse_ids is None:
+        warehouse_ids = frozenset(
+            WarehouseClosure.objects.filter(ancestor__storekeeper=request.user)
+            .values_list('descendant_id', flat=True)
+        )
+        request._managed_warehouse_ids = warehouse_ids
+    return warehouse_ids
+
 
 class UserPermissionsMixin:
     """
     Mixin to filter querysets based on a hierarchical permission model.
     - Managers see everything.
-    - Employees see data for warehouses they are directly responsible for.
+    - Employees see data for the warehouses they are responsible for and every warehouse under them.
     """
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -18,15 +38,16 @@ class UserPermissionsMixin:
 
 
         if user.user_type == 'Employee':
-            managed_warehouses_qs = user.managed_warehouses.all()
-            
-            if not managed_warehouses_qs.exists():
+            warehouse_ids = managed_warehouse_ids(self.request)
+
+            if not warehouse_ids:
                 return queryset.none()
 
             # اسم حقل البحث عن المخزن (نفس الطريقة السابقة)
             warehouse_field_lookup = getattr(self, 'warehouse_field_lookup', 'warehouse__in')
-            
-            return queryset.filter(**{warehouse_field_lookup: managed_warehouses_qs})
-            
+
+            # A plain IN (...) list rather than a subquery evaluated with every queryset.
+            return queryset.filter(**{warehouse_field_lookup: sorted(warehouse_ids)})
+
         # كإجراء أمني، لا تعرض أي شيء للحالات الأخرى
         return queryset.none()
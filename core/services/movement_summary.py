@@ -0,0 +1,79 @@
+"""
+Upkeep of DailyMovementSummary, the per-day totals behind the summary reports.
+
+record_movements() passes every new ledger row here. Movements built by
+operations.movements carry a SummaryContext with the day of their operation and
+its counterparties; others (opening balances, adjustments) are counted on the
+day of their timestamp without counterparties.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from inventory.models import DailyMovementSummary
+
+
+# `lines` is +1 for a new line and -1 for a removed one, whose movement is dated when it
+# was removed but whose summary is taken off the day of its operation.
+SummaryContext = namedtuple(
+    'SummaryContext', ['date', 'supplier_id', 'stations_id', 'beneficiary_id', 'lines'],
+    defaults=[None, None, None, 1],
+)
+
+KEY_FIELDS = ('date', 'warehouse_id', 'item_id', 'operation_type', 'supplier_id', 'stations_id', 'beneficiary_id')
+
+
+def summary_key(movement):
+    context = getattr(movement, 'summary_context', None)
+    if context is None:
+        context = SummaryContext(timezone.localdate(movement.timestamp))
+    key = (
+        context.date, movement.warehouse_id, movement.item_id, movement.operation_type,
+        context.supplier_id, context.stations_id, context.beneficiary_id,
+    )
+    return key, context.lines
+
+
+def _key_filter(key):
+    return Q(**dict(zip(KEY_FIELDS, key)))
+
+
+def add_movements(movements):
+    """
+    Adds the quantity and line count of `movements` to their summary rows. Runs inside
+    the caller's transaction: missing rows are inserted first, then all of them are
+    updated with one UPDATE ... SET quantity = quantity + CASE ... END.
+    """
+    totals = {}
+    for movement in movements:
+        key, lines = summary_key(movement)
+        quantity, count = totals.get(key, (Decimal('0.00'), 0))
+        totals[key] = (quantity + movement.delta, count + lines)
+    totals = {key: value for key, value in totals.items() if any(value)}
+    if not totals:
+        return
+
+    DailyMovementSummary.objects.bulk_create(
+        [DailyMovementSummary(**dict(zip(KEY_FIELDS, key))) for key in sorted(totals, key=str)],
+        ignore_conflicts=True,
+    )
+    rows = DailyMovementSummary.objects.filter(reduce(or_, (_key_filter(key) for key in totals)))
+    if len(totals) > 1:
+        # Rows are locked in id order, so two writers sharing rows cannot deadlock.
+        list(rows.select_for_update().order_by('pk').values_list('pk', flat=True))
+    rows.update(
+        quantity=Case(
+            *(When(_key_filter(key), then=F('quantity') + Value(quantity)) for key, (quantity, _) in totals.items()),
+            default=F('quantity'),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        ),
+        count=Case(
+            *(When(_key_filter(key), then=F('count') + Value(count)) for key, (_, count) in totals.items()),
+            default=F('count'),
+            output_field=IntegerField(),
+        ),
+    )
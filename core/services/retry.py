@@ -0,0 +1,60 @@
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from core.services import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# PostgreSQL: deadlock_detected, serialization_failure.
+RETRYABLE_SQLSTATES = {'40P01', '40001'}
+
+
+class TransactionRetriesExhausted(APIException):
+    """
+    Answered with 503 when a transaction kept deadlocking or failing to serialize.
+    """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The database is busy. Please try again."
+    default_code = 'transaction_retries_exhausted'
+
+
+def is_retryable(error):
+    cause = error.__cause__
+    sqlstate = getattr(cause, 'pgcode', None) or getattr(cause, 'sqlstate', None)
+    return sqlstate in RETRYABLE_SQLSTATES
+
+
+def atomic_with_retry(func, *args, **kwargs):
+    """
+    Runs `func` in its own transaction and runs it again when the database aborted it
+    because of a deadlock or a serialization failure, waiting a little longer each time.
+
+    A transaction can only be retried from the outside, so inside an enclosing atomic
+    block `func` runs once and the error is left to the outer transaction.
+    """
+    if connection.in_atomic_block:
+        return func(*args, **kwargs)
+
+    max_retries = settings.STOCK_TRANSACTION_MAX_RETRIES
+    backoff = settings.STOCK_TRANSACTION_RETRY_BACKOFF
+    for attempt in range(max_retries + 1):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if not is_retryable(e):
+                raise
+            if attempt == max_retries:
+                metrics.increment(metrics.TRANSACTION_RETRIES_EXHAUSTED)
+                raise
+            metrics.increment(metrics.TRANSACTION_RETRIES)
+            delay = min(backoff * 2 ** attempt, settings.STOCK_TRANSACTION_RETRY_MAX_BACKOFF)
+            logger.warning("Retrying %s after %s (attempt %d).", func.__name__, e.__cause__.__class__.__name__, attempt + 1)
+            time.sleep(delay * random.uniform(0.5, 1))
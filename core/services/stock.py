@@ -0,0 +1,301 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.utils import timezone
+
+from core.services import data_versions, metrics, movement_summary
+from inventory.models import InventoryWarehouseitem, StockCheckpoint, StockMovement
+
+
+PESSIMISTIC = 'pessimistic'
+OPTIMISTIC = 'optimistic'
+
+
+class InsufficientStockError(ValueError):
+    """
+    Raised when a stock row cannot cover a decrease.
+    It subclasses ValueError so the existing `except ValueError` handlers keep working.
+    """
+    def __init__(self, warehouse, item, required, available=None):
+        self.warehouse = warehouse
+        self.item = item
+        self.required = required
+        self.available = available
+        if available is None:
+            message = f"Item '{item.name}' does not exist in warehouse '{warehouse.name}'."
+        else:
+            message = (
+                f"Insufficient stock for item '{item.name}' in warehouse '{warehouse.name}'. "
+                f"Required: {required}, Available: {available}."
+            )
+        super().__init__(message)
+
+
+def _as_decimal(value):
+    if isinstance(value, Decimal):
+        return value
+    return Decimal(str(value))
+
+
+class StockConflictError(ValueError):
+    """
+    Raised in optimistic mode when the stock rows kept changing between the read and the write.
+    """
+    def __init__(self):
+        super().__init__("The stock changed while it was being updated. Please try again.")
+
+
+class _PartialUpdate(Exception):
+    pass
+
+
+def _pair_filter(pairs):
+    return reduce(or_, (Q(warehouse_id=warehouse_id, item_id=item_id) for warehouse_id, item_id in pairs))
+
+
+def apply_movements(movements, stock_defaults=None, before_write=None):
+    """
+    Applies a list of unsaved StockMovement rows to the stock and saves them to the ledger.
+
+    Deltas are summed per (warehouse, item) and written with one statement:
+
+        UPDATE ... SET current_quantity = current_quantity + CASE ... END
+        WHERE (warehouse_id = %s AND item_id = %s AND current_quantity >= %s) OR ...
+
+    so the sufficiency check of every decreased pair and the write are a single
+    round trip. When several rows are involved they are first locked with one
+    SELECT ... FOR UPDATE in a fixed order. When fewer rows than pairs were
+    updated, nothing is kept and InsufficientStockError is raised for the first
+    pair that fell short.
+
+    With STOCK_WRITE_MODE = 'optimistic' no lock is taken before the write;
+    see _write_optimistic().
+
+    `stock_defaults` maps a (warehouse_id, item_id) pair to extra field values
+    for stock rows that have to be created.
+
+    `before_write` is called inside the critical section: after the rows are locked
+    in pessimistic mode, and between the read and the conditional write (on every
+    attempt) in optimistic mode. benchmark_stock_contention uses it to simulate work.
+    """
+    movements = list(movements)
+    if not movements:
+        return movements
+
+    totals = {}
+    first_movement = {}
+    for movement in movements:
+        movement.delta = _as_decimal(movement.delta)
+        if movement.timestamp is None:
+            movement.timestamp = timezone.now()
+        pair = (movement.warehouse_id, movement.item_id)
+        totals[pair] = totals.get(pair, Decimal('0.00')) + movement.delta
+        first_movement.setdefault(pair, movement)
+    totals = {pair: delta for pair, delta in totals.items() if delta}
+
+    with transaction.atomic():
+        if totals:
+            _create_missing_rows(totals, stock_defaults)
+            if settings.STOCK_WRITE_MODE == OPTIMISTIC:
+                _write_optimistic(totals, first_movement, before_write)
+            else:
+                _write_pessimistic(totals, first_movement, before_write)
+        record_movements(movements)
+    return movements
+
+
+def _create_missing_rows(totals, stock_defaults):
+    incoming = [pair for pair in sorted(totals) if totals[pair] > 0]
+    if not incoming:
+        return
+    stock_defaults = stock_defaults or {}
+    InventoryWarehouseitem.objects.bulk_create(
+        [
+            InventoryWarehouseitem(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                **stock_defaults.get((warehouse_id, item_id), {}),
+            )
+            for warehouse_id, item_id in incoming
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def _write_pessimistic(totals, first_movement, before_write=None):
+    # Every writer takes its row locks in (warehouse_id, item_id) order, so two
+    # operations touching the same rows in opposite directions cannot deadlock.
+    # A single row is locked by the UPDATE itself, unless work has to run under the lock.
+    if len(totals) > 1 or before_write:
+        list(
+            InventoryWarehouseitem.objects.select_for_update()
+            .filter(_pair_filter(totals))
+            .order_by('warehouse_id', 'item_id')
+            .values_list('pk', flat=True)
+        )
+    if before_write:
+        before_write()
+
+    conditions = reduce(or_, (
+        Q(warehouse_id=warehouse_id, item_id=item_id, current_quantity__gte=-delta)
+        if delta < 0 else Q(warehouse_id=warehouse_id, item_id=item_id)
+        for (warehouse_id, item_id), delta in totals.items()
+    ))
+    new_quantity = Case(
+        *(
+            When(warehouse_id=warehouse_id, item_id=item_id, then=F('current_quantity') + Value(delta))
+            for (warehouse_id, item_id), delta in totals.items()
+        ),
+        default=F('current_quantity'),
+        output_field=DecimalField(max_digits=20, decimal_places=2),
+    )
+    try:
+        with transaction.atomic():
+            updated = InventoryWarehouseitem.objects.filter(conditions).update(
+                current_quantity=new_quantity,
+                version=F('version') + 1,
+                last_updated=timezone.now(),
+            )
+            if updated != len(totals):
+                raise _PartialUpdate
+    except _PartialUpdate:
+        # The savepoint is rolled back, so the quantities read below are the ones that fell short.
+        _raise_insufficient(totals, first_movement)
+
+
+def _write_optimistic(totals, first_movement, before_write=None):
+    """
+    Reads the rows without locking them and writes each one with
+    UPDATE ... WHERE id = %s AND version = %s, in id order. When another writer
+    got there first, the savepoint is rolled back and the rows are read again.
+    """
+    for attempt in range(settings.STOCK_OPTIMISTIC_MAX_RETRIES + 1):
+        rows = {
+            (warehouse_id, item_id): (pk, current_quantity, version)
+            for pk, warehouse_id, item_id, current_quantity, version in
+            InventoryWarehouseitem.objects.filter(_pair_filter(totals))
+            .values_list('pk', 'warehouse_id', 'item_id', 'current_quantity', 'version')
+        }
+        for pair, delta in totals.items():
+            if pair not in rows or rows[pair][1] + delta < 0:
+                movement = first_movement[pair]
+                available = rows[pair][1] if pair in rows else None
+                raise InsufficientStockError(movement.warehouse, movement.item, -delta, available)
+        if before_write:
+            before_write()
+
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                for pair in sorted(totals, key=lambda pair: rows[pair][0]):
+                    pk, current_quantity, version = rows[pair]
+                    updated = InventoryWarehouseitem.objects.filter(pk=pk, version=version).update(
+                        current_quantity=current_quantity + totals[pair],
+                        version=version + 1,
+                        last_updated=now,
+                    )
+                    if not updated:
+                        raise _PartialUpdate
+            return
+        except _PartialUpdate:
+            metrics.increment(metrics.STOCK_VERSION_CONFLICTS)
+    metrics.increment(metrics.STOCK_VERSION_CONFLICTS_EXHAUSTED)
+    raise StockConflictError()
+
+
+def _raise_insufficient(totals, first_movement):
+    outgoing = [pair for pair, delta in totals.items() if delta < 0]
+    available = {
+        (warehouse_id, item_id): quantity
+        for warehouse_id, item_id, quantity in InventoryWarehouseitem.objects.filter(
+            _pair_filter(outgoing)
+        ).values_list('warehouse_id', 'item_id', 'current_quantity')
+    }
+    for pair in outgoing:
+        if available.get(pair) is None or available[pair] < -totals[pair]:
+            movement = first_movement[pair]
+            raise InsufficientStockError(movement.warehouse, movement.item, -totals[pair], available.get(pair))
+    raise StockConflictError()
+
+
+def record_movements(movements):
+    """
+    Saves movements whose quantities were already written to the stock rows.
+    Callers that set quantities directly (imports) use it to keep the ledger in step.
+    """
+    StockMovement.objects.bulk_create(movements)
+    _shift_checkpoints(movements)
+    movement_summary.add_movements(movements)
+    data_versions.bump_warehouses_on_commit(movement.warehouse_id for movement in movements)
+
+
+def _shift_checkpoints(movements):
+    """
+    A back-dated movement also belongs to every checkpoint taken after it.
+    One query tells whether any checkpoint is affected, which is rarely the case.
+    """
+    if not movements:
+        return
+    shifts = {}
+    for movement in movements:
+        key = (movement.warehouse_id, movement.item_id, movement.timestamp)
+        shifts[key] = shifts.get(key, Decimal('0.00')) + movement.delta
+
+    affected = reduce(or_, (
+        Q(warehouse_id=warehouse_id, item_id=item_id, covers_until__gt=timestamp)
+        for warehouse_id, item_id, timestamp in shifts
+    ))
+    if not StockCheckpoint.objects.filter(affected).exists():
+        return
+    for (warehouse_id, item_id, timestamp), delta in shifts.items():
+        StockCheckpoint.objects.filter(
+            warehouse_id=warehouse_id, item_id=item_id, covers_until__gt=timestamp
+        ).update(balance=F('balance') + delta)
+
+
+def increase_stock(warehouse, item, quantity, operation_type, source_line_id=None, timestamp=None, defaults=None):
+    """
+    Adds `quantity` to the stock of `item` in `warehouse` and records it in the ledger.
+    The stock row is created when the warehouse does not hold the item yet.
+    """
+    apply_movements(
+        [StockMovement(
+            warehouse=warehouse,
+            item=item,
+            delta=_as_decimal(quantity),
+            operation_type=operation_type,
+            source_line_id=source_line_id,
+            timestamp=timestamp,
+        )],
+        stock_defaults={(warehouse.pk, item.pk): defaults} if defaults else None,
+    )
+
+
+def decrease_stock(warehouse, item, quantity, operation_type, source_line_id=None, timestamp=None):
+    """
+    Removes `quantity` from the stock of `item` in `warehouse` and records it in the ledger.
+    Raises InsufficientStockError when the stock cannot cover it.
+    """
+    apply_movements([StockMovement(
+        warehouse=warehouse,
+        item=item,
+        delta=-_as_decimal(quantity),
+        operation_type=operation_type,
+        source_line_id=source_line_id,
+        timestamp=timestamp,
+    )])
+
+
+def adjust_stock(warehouse, item, delta, operation_type, source_line_id=None, timestamp=None):
+    """
+    Applies a signed `delta` to the stock of `item` in `warehouse`.
+    """
+    delta = _as_decimal(delta)
+    if delta > 0:
+        increase_stock(warehouse, item, delta, operation_type, source_line_id, timestamp)
+    elif delta < 0:
+        decrease_stock(warehouse, item, -delta, operation_type, source_line_id, timestamp)
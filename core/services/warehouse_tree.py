@@ -0,0 +1,34 @@
+"""
+Subtree filters over the warehouse tree, read through inventory.models.WarehouseClosure.
+
+With ?include_descendants=1 a warehouse filter also matches every warehouse under
+it. The closure table holds one row per (ancestor, descendant) pair, so the subtree
+is a single join on an indexed column instead of a walk down `parent`.
+"""
+from inventory.models import WarehouseClosure
+
+
+INCLUDE_DESCENDANTS_PARAM = 'include_descendants'
+
+
+def include_descendants(request):
+    return request.query_params.get(INCLUDE_DESCENDANTS_PARAM) in ('1', 'true')
+
+
+def warehouse_filter(field, warehouse_id, descendants=False):
+    """
+    Keyword arguments for .filter() matching the warehouse at `field`; with
+    `descendants`, matching it or any warehouse under it.
+    """
+    if descendants:
+        return {f'{field}__ancestor_links__ancestor': warehouse_id}
+    return {field: warehouse_id}
+
+
+def warehouse_ids(warehouse_id, descendants=False):
+    """
+    The warehouse and, with `descendants`, the ids of every warehouse under it.
+    """
+    if descendants:
+        return WarehouseClosure.objects.subtree_ids([warehouse_id])
+    return {warehouse_id}
@@ -85,6 +85,7 @@ CORS_ALLOW_HEADERS = [
     'accept-encoding',
     'authorization',  
     'content-type',
+    'idempotency-key',
 ]
 
 
@@ -222,4 +223,91 @@ SIMPLE_JWT = {
     "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
-}
\ No newline at end of file
+}
+
+
+# Bulk operation endpoint (api/operations/bulk/)
+BULK_OPERATIONS_MAX_ROWS = config('BULK_OPERATIONS_MAX_ROWS', default=1000, cast=int)
+BULK_OPERATIONS_CHUNK_SIZE = config('BULK_OPERATIONS_CHUNK_SIZE', default=100, cast=int)
+
+
+# Opening balance import (api/inventory/warehouse-item/import/ and import_opening_balances)
+IMPORT_CHUNK_SIZE = config('IMPORT_CHUNK_SIZE', default=2000, cast=int)
+IMPORT_REJECTED_ROWS_LIMIT = config('IMPORT_REJECTED_ROWS_LIMIT', default=1000, cast=int)
+
+
+# Deadlocks and serialization failures in stock transactions are retried with exponential backoff (seconds).
+STOCK_TRANSACTION_MAX_RETRIES = config('STOCK_TRANSACTION_MAX_RETRIES', default=3, cast=int)
+STOCK_TRANSACTION_RETRY_BACKOFF = config('STOCK_TRANSACTION_RETRY_BACKOFF', default=0.05, cast=float)
+STOCK_TRANSACTION_RETRY_MAX_BACKOFF = config('STOCK_TRANSACTION_RETRY_MAX_BACKOFF', default=1.0, cast=float)
+
+# 'pessimistic' locks the stock rows before writing them; 'optimistic' writes
+# UPDATE ... WHERE version = <read version> and re-reads on conflict.
+STOCK_WRITE_MODE = config('STOCK_WRITE_MODE', default='pessimistic')
+STOCK_OPTIMISTIC_MAX_RETRIES = config('STOCK_OPTIMISTIC_MAX_RETRIES', default=5, cast=int)
+
+
+# Responses of create requests sent with an Idempotency-Key header are kept this long.
+IDEMPOTENCY_KEY_TTL_HOURS = config('IDEMPOTENCY_KEY_TTL_HOURS', default=24, cast=int)
+
+# A key still processing after this many seconds is treated as abandoned (e.g. the worker
+# crashed) and the next request with it is processed again. Keep it above the slowest create.
+IDEMPOTENCY_PROCESSING_TIMEOUT = config('IDEMPOTENCY_PROCESSING_TIMEOUT', default=300, cast=int)
+
+
+# 'dated' stores every attachment upload again under operation_attachments/<type>/<date>/;
+# 'content' stores each distinct file once, named after its SHA-256, and shares it between operations.
+ATTACHMENT_STORAGE_MODE = config('ATTACHMENT_STORAGE_MODE', default='dated')
+# Unreferenced blobs younger than this are kept, so uploads that are still being linked are not collected.
+ATTACHMENT_BLOB_GC_GRACE_HOURS = config('ATTACHMENT_BLOB_GC_GRACE_HOURS', default=24, cast=int)
+
+# Chunked attachment uploads (api/operations/uploads/). The staging directory must be shared by all app servers.
+ATTACHMENT_UPLOAD_DIR = config('ATTACHMENT_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'attachment_uploads'))
+ATTACHMENT_UPLOAD_MAX_SIZE = config('ATTACHMENT_UPLOAD_MAX_SIZE', default=200 * 1024 * 1024, cast=int)
+ATTACHMENT_UPLOAD_TTL_HOURS = config('ATTACHMENT_UPLOAD_TTL_HOURS', default=24, cast=int)
+
+
+# Report exports read their querysets in chunks of this many rows.
+REPORT_ITERATOR_CHUNK_SIZE = config('REPORT_ITERATOR_CHUNK_SIZE', default=2000, cast=int)
+# Parquet and Arrow exports are written in row groups (record batches) of this many rows.
+REPORT_ARROW_BATCH_ROWS = config('REPORT_ARROW_BATCH_ROWS', default=50000, cast=int)
+
+# JSON reports requested with ?page_size= or ?cursor= are sent in pages of REPORT_PAGE_SIZE
+# rows per section by default; clients may ask for up to REPORT_MAX_PAGE_SIZE.
+REPORT_PAGE_SIZE = config('REPORT_PAGE_SIZE', default=500, cast=int)
+REPORT_MAX_PAGE_SIZE = config('REPORT_MAX_PAGE_SIZE', default=5000, cast=int)
+
+
+# Rendered reports (JSON, XLSX, PDF, Parquet, Arrow) are cached here until the data they read changes. The default
+# file cache is shared by all worker processes on a host; point REPORT_CACHE_BACKEND at Redis or
+# Memcached when several hosts serve reports. A per-process local-memory cache would miss the
+# invalidations made by other processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': config('REPORT_CACHE_BACKEND', default='django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': config('REPORT_CACHE_LOCATION', default=os.path.join(BASE_DIR, 'report_cache')),
+        'TIMEOUT': config('REPORT_CACHE_TIMEOUT', default=600, cast=int),
+    },
+}
+REPORT_CACHE_ALIAS = 'reports'
+REPORT_CACHE_MAX_BYTES = config('REPORT_CACHE_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+
+
+# Reports requested with ?async=1 are rendered by REPORT_JOB_WORKERS threads per web process
+# (0 leaves them to `manage.py run_report_jobs`). At most REPORT_JOB_MAX_PENDING jobs may wait
+# or run at once; finished jobs and their files are kept for REPORT_JOB_TTL_HOURS.
+REPORT_JOB_WORKERS = config('REPORT_JOB_WORKERS', default=2, cast=int)
+REPORT_JOB_MAX_PENDING = config('REPORT_JOB_MAX_PENDING', default=20, cast=int)
+REPORT_JOB_TTL_HOURS = config('REPORT_JOB_TTL_HOURS', default=24, cast=int)
+
+
+# PDF reports are rendered by PDF_RENDER_WORKERS long-lived processes (0 renders them in the
+# web process). Up to PDF_RENDER_QUEUE_SIZE requests may wait for a worker; beyond that, or
+# when a PDF takes longer than PDF_RENDER_TIMEOUT seconds, the answer is 503 with Retry-After.
+PDF_RENDER_WORKERS = config('PDF_RENDER_WORKERS', default=2, cast=int)
+PDF_RENDER_QUEUE_SIZE = config('PDF_RENDER_QUEUE_SIZE', default=8, cast=int)
+PDF_RENDER_TIMEOUT = config('PDF_RENDER_TIMEOUT', default=60, cast=int)
+PDF_RENDER_RETRY_AFTER = config('PDF_RENDER_RETRY_AFTER', default=10, cast=int)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Item, InventoryWarehouse, InventoryWarehouseitem, Stations
+from .models import Item, InventoryWarehouse, InventoryWarehouseitem, Stations, StockMovement
 
 
 
@@ -23,7 +23,21 @@ class CustomInventoryWarehouse(admin.ModelAdmin):
     search_fields=  ['name', 'storekeeper']
 
 
+class CustomStockMovement(admin.ModelAdmin):
+    list_display = ['id', 'timestamp', 'warehouse', 'item', 'operation_type', 'delta', 'source_line_id']
+    list_filter = ['operation_type', 'warehouse']
+    search_fields = ['item__name', 'warehouse__name']
+    list_select_related = ['warehouse', 'item']
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Item)
 admin.site.register(InventoryWarehouse , CustomInventoryWarehouse)
 admin.site.register(InventoryWarehouseitem, CustomInventoryWarehouseitem) 
 admin.site.register(Stations)
+admin.site.register(StockMovement, CustomStockMovement)
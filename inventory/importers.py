@@ -0,0 +1,228 @@
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.services import data_versions
+from core.services.stock import record_movements
+from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Item, StockMovement
+
+
+REQUIRED_COLUMNS = ('warehouse', 'item', 'opening_balance')
+UNITS = {value.lower(): value for value in InventoryWarehouseitem.UnitofMeasure.values}
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised when the file itself cannot be read, as opposed to a single bad row.
+    """
+
+
+def detect_format(file_name):
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if extension in ('csv', 'xlsx'):
+        return extension
+    raise ImportFormatError("Only .csv and .xlsx files can be imported.")
+
+
+def _csv_rows(file):
+    reader = csv.reader(io.TextIOWrapper(file, encoding='utf-8-sig', newline=''))
+    yield from reader
+
+
+def _xlsx_rows(file):
+    from openpyxl import load_workbook
+
+    try:
+        workbook = load_workbook(file, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFormatError(f"The file is not a valid .xlsx workbook: {e}")
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(file, file_format):
+    """
+    Yields (row_number, {column: value}) one row at a time.
+    The header row is row 1; blank rows are skipped.
+    """
+    rows = _xlsx_rows(file) if file_format == 'xlsx' else _csv_rows(file)
+    header = next(rows, None)
+    if header is None:
+        raise ImportFormatError("The file is empty.")
+    header = [str(column).strip().lower() if column is not None else '' for column in header]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ImportFormatError(f"Missing required columns: {', '.join(missing)}.")
+
+    for row_number, values in enumerate(rows, start=2):
+        if not any(value not in (None, '') for value in values):
+            continue
+        yield row_number, dict(zip(header, values))
+
+
+def _clean(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _quantity(value, field, errors):
+    value = _clean(value)
+    if not value:
+        return None
+    try:
+        quantity = Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        errors[field] = "A valid number is required."
+        return None
+    if quantity < 0:
+        errors[field] = "Ensure this value is greater than or equal to 0."
+        return None
+    return quantity
+
+
+class _NameCache:
+    """
+    Maps names to ids for one model, loading the unknown names of a chunk in one query.
+    """
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self.ids = {}
+
+    def load(self, names):
+        unknown = {name for name in names if name and name not in self.ids}
+        if unknown:
+            found = dict(self.queryset.filter(name__in=unknown).values_list('name', 'pk'))
+            for name in unknown:
+                self.ids[name] = found.get(name)
+
+    def get(self, name):
+        return self.ids.get(name)
+
+
+def import_warehouse_items(file, file_format, allowed_warehouse_ids=None, chunk_size=None):
+    """
+    Creates or updates stock rows from a CSV or XLSX file.
+
+    Columns: warehouse and item (names), opening_balance, and optionally current_quantity and
+    unit_of_measure. A new row starts with current_quantity = opening_balance unless the file
+    says otherwise; an existing row keeps its current_quantity unless the file sets it.
+
+    The file is read one row at a time and written in chunks with one upsert per chunk, so memory
+    does not grow with the file. Each change of current_quantity is written to the ledger as an
+    opening movement. `allowed_warehouse_ids` limits the warehouses a caller may touch
+    (None means all).
+
+    Returns counters and the rejected rows, of which at most IMPORT_REJECTED_ROWS_LIMIT are listed.
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    rejected_limit = settings.IMPORT_REJECTED_ROWS_LIMIT
+    warehouses = _NameCache(InventoryWarehouse.active.all())
+    items = _NameCache(Item.active.all())
+    result = {'processed': 0, 'created': 0, 'updated': 0, 'rejected': 0, 'rejected_rows': []}
+
+    def reject(row_number, errors):
+        result['rejected'] += 1
+        if len(result['rejected_rows']) < rejected_limit:
+            result['rejected_rows'].append({'row': row_number, 'errors': errors})
+
+    rows = read_rows(file, file_format)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        result['processed'] += len(chunk)
+        warehouses.load(_clean(values.get('warehouse')) for _, values in chunk)
+        items.load(_clean(values.get('item')) for _, values in chunk)
+
+        parsed = {}
+        accepted = 0
+        for row_number, values in chunk:
+            errors = {}
+            warehouse_name, item_name = _clean(values.get('warehouse')), _clean(values.get('item'))
+            warehouse_id, item_id = warehouses.get(warehouse_name), items.get(item_name)
+            if warehouse_id is None:
+                errors['warehouse'] = f"Unknown warehouse '{warehouse_name}'."
+            elif allowed_warehouse_ids is not None and warehouse_id not in allowed_warehouse_ids:
+                errors['warehouse'] = "You do not have permission to perform operations on this warehouse."
+            if item_id is None:
+                errors['item'] = f"Unknown item '{item_name}'."
+            opening_balance = _quantity(values.get('opening_balance'), 'opening_balance', errors)
+            if opening_balance is None and 'opening_balance' not in errors:
+                errors['opening_balance'] = "This field is required."
+            current_quantity = _quantity(values.get('current_quantity'), 'current_quantity', errors)
+            unit_of_measure = _clean(values.get('unit_of_measure'))
+            if unit_of_measure:
+                unit_of_measure = UNITS.get(unit_of_measure.lower())
+                if unit_of_measure is None:
+                    errors['unit_of_measure'] = f"Expected one of: {', '.join(UNITS.values())}."
+            if errors:
+                reject(row_number, errors)
+                continue
+            # A pair repeated inside one chunk keeps its last row, as it would row by row.
+            parsed[(warehouse_id, item_id)] = (opening_balance, current_quantity, unit_of_measure)
+            accepted += 1
+
+        if parsed:
+            created = _write_chunk(parsed)
+            result['created'] += created
+            result['updated'] += accepted - created
+    return result
+
+
+def _write_chunk(parsed):
+    now = timezone.now()
+    with transaction.atomic():
+        existing = {
+            (warehouse_id, item_id): (current_quantity, unit_of_measure, version)
+            for warehouse_id, item_id, current_quantity, unit_of_measure, version in
+            InventoryWarehouseitem.objects.select_for_update()
+            .filter(warehouse_id__in={pair[0] for pair in parsed}, item_id__in={pair[1] for pair in parsed})
+            .order_by('warehouse_id', 'item_id')
+            .values_list('warehouse_id', 'item_id', 'current_quantity', 'unit_of_measure', 'version')
+        }
+
+        stock_rows = []
+        movements = []
+        for (warehouse_id, item_id), (opening_balance, current_quantity, unit_of_measure) in parsed.items():
+            previous_quantity, previous_unit, previous_version = existing.get(
+                (warehouse_id, item_id), (Decimal('0.00'), InventoryWarehouseitem.UnitofMeasure.LITERS, -1)
+            )
+            if current_quantity is None:
+                current_quantity = previous_quantity if (warehouse_id, item_id) in existing else opening_balance
+            stock_rows.append(InventoryWarehouseitem(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                opening_balance=opening_balance,
+                current_quantity=current_quantity,
+                unit_of_measure=unit_of_measure or previous_unit,
+                last_updated=now,
+                version=previous_version + 1,
+            ))
+            if current_quantity != previous_quantity:
+                movements.append(StockMovement(
+                    warehouse_id=warehouse_id,
+                    item_id=item_id,
+                    delta=current_quantity - previous_quantity,
+                    timestamp=now,
+                    operation_type=StockMovement.OperationType.OPENING,
+                ))
+
+        InventoryWarehouseitem.objects.bulk_create(
+            stock_rows,
+            update_conflicts=True,
+            unique_fields=['warehouse', 'item'],
+            update_fields=['opening_balance', 'current_quantity', 'unit_of_measure', 'last_updated', 'version'],
+        )
+        record_movements(movements)
+        # Opening balances and units change the status reports even without a movement.
+        data_versions.bump_warehouses_on_commit(pair[0] for pair in parsed)
+
+    return sum(1 for pair in parsed if pair not in existing)
@@ -0,0 +1,154 @@
+import random
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from core.services import metrics
+from core.services.retry import atomic_with_retry
+from core.services.stock import OPTIMISTIC, PESSIMISTIC, apply_movements
+from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Item, StockMovement
+
+
+BENCHMARK_WAREHOUSE = '__stock_benchmark__'
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the pessimistic and optimistic stock write modes under contention. "
+        "Worker threads add and remove stock on a few shared rows of an inactive "
+        f"'{BENCHMARK_WAREHOUSE}' warehouse; every run nets out to zero but leaves its "
+        "movements in the ledger. Run it against PostgreSQL, not in production."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=[PESSIMISTIC, OPTIMISTIC, 'both'], default='both')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help="Add-and-remove pairs per thread.")
+        parser.add_argument('--items', type=int, default=2, help="Shared stock rows; fewer rows means more contention.")
+        parser.add_argument('--lines', type=int, default=2, help="Stock rows changed by each operation.")
+        parser.add_argument(
+            '--work-ms', type=float, default=5.0,
+            help=(
+                "Work simulated inside each operation's critical section: while the rows are "
+                "locked (pessimistic), or between the version read and the write (optimistic)."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['operations'] < 1 or options['items'] < 1:
+            raise CommandError("threads, operations and items must be positive.")
+        if connection.vendor == 'sqlite' and options['threads'] > 1:
+            self.stdout.write(self.style.WARNING("SQLite serialises all writers; the numbers will not mean much."))
+
+        warehouse, items = self.prepare(options)
+        modes = [PESSIMISTIC, OPTIMISTIC] if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            with override_settings(STOCK_WRITE_MODE=mode):
+                self.run_mode(mode, warehouse, items, options)
+
+    def prepare(self, options):
+        warehouse, _ = InventoryWarehouse.objects.get_or_create(
+            name=BENCHMARK_WAREHOUSE, defaults={'phone_warehouse': '-', 'is_active': False},
+        )
+        items = [
+            Item.objects.get_or_create(name=f'{BENCHMARK_WAREHOUSE}item_{n}', defaults={'is_active': False})[0]
+            for n in range(options['items'])
+        ]
+        # Enough stock that no removal can fail, whatever the interleaving.
+        floor = options['threads'] * options['lines']
+        for item in items:
+            row = InventoryWarehouseitem.objects.filter(warehouse=warehouse, item=item).first()
+            missing = floor - (row.current_quantity if row else 0)
+            if missing > 0:
+                apply_movements([StockMovement(
+                    warehouse=warehouse, item=item, delta=missing,
+                    operation_type=StockMovement.OperationType.OPENING,
+                )])
+        return warehouse, items
+
+    def run_mode(self, mode, warehouse, items, options):
+        before = dict(
+            InventoryWarehouseitem.objects.filter(warehouse=warehouse, item__in=items)
+            .values_list('item_id', 'current_quantity')
+        )
+        counters_before = metrics.snapshot()
+        latencies = []
+        failures = []
+        lock = threading.Lock()
+        work = options['work_ms'] / 1000
+        lines = min(options['lines'], len(items))
+
+        def operation(picked, sign):
+            apply_movements(
+                [
+                    StockMovement(
+                        warehouse=warehouse, item=item, delta=sign,
+                        operation_type=StockMovement.OperationType.ADJUSTMENT,
+                    )
+                    for item in picked
+                ],
+                before_write=lambda: time.sleep(work),
+            )
+
+        def worker(seed):
+            rng = random.Random(seed)
+            own = []
+            try:
+                for _ in range(options['operations']):
+                    picked = rng.sample(items, lines)
+                    # An addition followed by the matching removal, so a run nets out to zero.
+                    for sign in (1, -1):
+                        started = time.perf_counter()
+                        try:
+                            atomic_with_retry(operation, picked, sign)
+                        except Exception as e:
+                            with lock:
+                                failures.append(repr(e))
+                            break
+                        own.append(time.perf_counter() - started)
+            finally:
+                with lock:
+                    latencies.extend(own)
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        after = dict(
+            InventoryWarehouseitem.objects.filter(warehouse=warehouse, item__in=items)
+            .values_list('item_id', 'current_quantity')
+        )
+        counters = {
+            name: value - counters_before[name] for name, value in metrics.snapshot().items()
+        }
+        latencies.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{mode}:"))
+        self.stdout.write(
+            f"  {len(latencies)} operations in {elapsed:.2f}s = {len(latencies) / elapsed:.1f} ops/s, "
+            f"{len(failures)} failed"
+        )
+        if latencies:
+            self.stdout.write(
+                f"  latency p50 {statistics.median(latencies) * 1000:.1f} ms, "
+                f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, "
+                f"max {latencies[-1] * 1000:.1f} ms"
+            )
+        self.stdout.write(
+            f"  version conflicts {counters[metrics.STOCK_VERSION_CONFLICTS]}, "
+            f"deadlock/serialization retries {counters[metrics.TRANSACTION_RETRIES]}"
+        )
+        for failure in sorted(set(failures))[:5]:
+            self.stdout.write(self.style.ERROR(f"  {failure}"))
+        if before == after:
+            self.stdout.write(self.style.SUCCESS("  Stock is back to its starting balance."))
+        else:
+            self.stdout.write(self.style.ERROR(f"  Stock drifted: {before} -> {after}"))
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.services.stock_history import build_checkpoints
+from inventory.models import StockCheckpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Stores the end-of-day balance of every stock row. "
+        "Run it daily (default: yesterday) or monthly (default: last day of the previous month)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period',
+            choices=StockCheckpoint.Period.values,
+            default=StockCheckpoint.Period.DAILY,
+        )
+        parser.add_argument('--date', help="Checkpoint date as YYYY-MM-DD.")
+
+    def handle(self, *args, **options):
+        period = options['period']
+        today = timezone.localdate()
+        if options['date']:
+            try:
+                checkpoint_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("date must be in YYYY-MM-DD format.")
+        elif period == StockCheckpoint.Period.MONTHLY:
+            checkpoint_date = today.replace(day=1) - timedelta(days=1)
+        else:
+            checkpoint_date = today - timedelta(days=1)
+
+        count = build_checkpoints(checkpoint_date, period)
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} {period} checkpoints for {checkpoint_date}."))
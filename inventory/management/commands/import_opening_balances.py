@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.importers import ImportFormatError, detect_format, import_warehouse_items
+
+
+class Command(BaseCommand):
+    help = (
+        "Creates or updates stock rows from a .csv or .xlsx file with the columns "
+        "warehouse, item, opening_balance and optionally current_quantity and unit_of_measure."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'xlsx'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, help="Rows per upsert (default: IMPORT_CHUNK_SIZE).")
+
+    def handle(self, *args, **options):
+        try:
+            file_format = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'rb') as file:
+                result = import_warehouse_items(file, file_format, chunk_size=options['chunk_size'])
+        except (ImportFormatError, OSError) as e:
+            raise CommandError(str(e))
+
+        for rejected in result['rejected_rows']:
+            self.stdout.write(self.style.WARNING(f"Row {rejected['row']}: {rejected['errors']}"))
+        if result['rejected'] > len(result['rejected_rows']):
+            self.stdout.write(self.style.WARNING(
+                f"... {result['rejected'] - len(result['rejected_rows'])} more rejected rows not listed."
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {result['processed']} rows: {result['created']} created, "
+            f"{result['updated']} updated, {result['rejected']} rejected."
+        ))
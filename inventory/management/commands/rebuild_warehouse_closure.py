@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.models import WarehouseClosure
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the warehouse tree links from each warehouse's parent. Run it after "
+        "changing parents without InventoryWarehouse.save(), e.g. with queryset.update()."
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created = WarehouseClosure.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Stored {created} warehouse closure rows."))
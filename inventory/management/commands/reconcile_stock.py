@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from inventory.models import InventoryWarehouseitem, StockMovement
+
+
+class Command(BaseCommand):
+    help = "Compares every stock row with the sum of its ledger movements and lists the differences."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warehouse', type=int, help="Only check this warehouse id.")
+
+    def handle(self, *args, **options):
+        ledger_balance = (
+            StockMovement.objects.filter(warehouse=OuterRef('warehouse'), item=OuterRef('item'))
+            .values('warehouse', 'item')
+            .annotate(balance=Sum('delta'))
+            .values('balance')
+        )
+        stock = InventoryWarehouseitem.objects.annotate(
+            ledger_balance=Coalesce(Subquery(ledger_balance), Decimal('0.00'))
+        ).select_related('warehouse', 'item')
+        if options['warehouse']:
+            stock = stock.filter(warehouse_id=options['warehouse'])
+
+        mismatches = 0
+        for row in stock.iterator(chunk_size=2000):
+            if row.current_quantity != row.ledger_balance:
+                mismatches += 1
+                self.stdout.write(
+                    f"{row.warehouse.name} / {row.item.name}: "
+                    f"stock={row.current_quantity} ledger={row.ledger_balance}"
+                )
+
+        if mismatches:
+            self.stdout.write(self.style.WARNING(f"{mismatches} stock rows differ from the ledger."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Stock matches the ledger."))
@@ -0,0 +1,70 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:30
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+logger = logging.getLogger(__name__)
+
+
+def merge_duplicate_stock_rows(apps, schema_editor):
+    """
+    Folds duplicate (warehouse, item) stock rows into the oldest one
+    so the unique constraint can be created.
+    """
+    InventoryWarehouseitem = apps.get_model('inventory', 'InventoryWarehouseitem')
+    duplicates = (
+        InventoryWarehouseitem.objects.values('warehouse_id', 'item_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for pair in duplicates:
+        rows = list(
+            InventoryWarehouseitem.objects.filter(
+                warehouse_id=pair['warehouse_id'], item_id=pair['item_id']
+            ).order_by('id')
+        )
+        keeper = rows[0]
+        for row in rows[1:]:
+            keeper.opening_balance += row.opening_balance
+            keeper.current_quantity += row.current_quantity
+            row.delete()
+        keeper.save()
+
+
+def clamp_negative_stock(apps, schema_editor):
+    """
+    Sets negative stock rows to zero so the check constraint can be created. Deleting
+    a dispatch used to subtract its quantity again, which could leave rows below zero.
+    The ledger does not exist yet: 0007_backfill_stock_movements records the change
+    as an adjustment movement, since the replayed history no longer matches the row.
+    """
+    InventoryWarehouseitem = apps.get_model('inventory', 'InventoryWarehouseitem')
+    negative = InventoryWarehouseitem.objects.filter(current_quantity__lt=0)
+    for warehouse_id, item_id, current_quantity in negative.values_list('warehouse_id', 'item_id', 'current_quantity'):
+        logger.warning(
+            "Stock of item %s in warehouse %s was %s; set to 0.", item_id, warehouse_id, current_quantity,
+        )
+    negative.update(current_quantity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_alter_inventorywarehouse_storekeeper'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stock_rows, migrations.RunPython.noop),
+        migrations.RunPython(clamp_negative_stock, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='inventorywarehouseitem',
+            constraint=models.UniqueConstraint(fields=('warehouse', 'item'), name='unique_stock_per_warehouse_item'),
+        ),
+        migrations.AddConstraint(
+            model_name='inventorywarehouseitem',
+            constraint=models.CheckConstraint(condition=models.Q(('current_quantity__gte', 0)), name='stock_current_quantity_non_negative'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_stock_constraints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('timestamp', models.DateTimeField()),
+                ('operation_type', models.CharField(choices=[('opening', 'Opening Balance'), ('adjustment', 'Adjustment'), ('supply', 'Supply'), ('export', 'Export'), ('return_supply', 'Return Supply'), ('return_dispatch', 'Return Dispatch'), ('damage', 'Damage'), ('transfer_out', 'Transfer Out'), ('transfer_in', 'Transfer In'), ('modify_supply', 'Modify Supply'), ('modify_export', 'Modify Export')], max_length=20)),
+                ('source_line_id', models.PositiveBigIntegerField(blank=True, help_text='Primary key of the operation line (or modification) that caused the movement.', null=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_movements', to='inventory.item')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='stock_movements', to='inventory.inventorywarehouse')),
+            ],
+            options={
+                'verbose_name': 'Stock Movement',
+                'verbose_name_plural': 'Stock Movements',
+                'ordering': ['timestamp', 'id'],
+                'indexes': [models.Index(fields=['warehouse', 'item', 'timestamp'], name='stock_movement_kardex_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,130 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+from django.utils import timezone
+
+
+BATCH_SIZE = 2000
+
+
+def backfill_stock_movements(apps, schema_editor):
+    """
+    Replays the existing operation lines into the ledger, then writes one
+    adjustment row per stock row whose current_quantity differs from the
+    replayed history, so that the ledger sums match the stock on day one.
+    """
+    StockMovement = apps.get_model('inventory', 'StockMovement')
+    InventoryWarehouseitem = apps.get_model('inventory', 'InventoryWarehouseitem')
+    SupplyOperationItem = apps.get_model('operations', 'SupplyOperationItem')
+    ExportOperationItem = apps.get_model('operations', 'ExportOperationItem')
+    ReturnSupplyOperationItem = apps.get_model('operations', 'ReturnSupplyOperationItem')
+    ReturnDispatchOperationItem = apps.get_model('operations', 'ReturnDispatchOperationItem')
+    DamageOperationItem = apps.get_model('operations', 'DamageOperationItem')
+    TransferOperationItem = apps.get_model('operations', 'TransferOperationItem')
+    ModifySupplyOperation = apps.get_model('operations', 'ModifySupplyOperation')
+    ModifyExportOperation = apps.get_model('operations', 'ModifyExportOperation')
+
+    sources = [
+        # (queryset, warehouse path, timestamp path, quantity expression, sign, operation type)
+        (SupplyOperationItem.objects.all(), 'operation__warehouse_id', 'operation__operation_date', 'quantity', 1, 'supply'),
+        (ExportOperationItem.objects.all(), 'operation__warehouse_id', 'operation__operation_date', 'quantity', -1, 'export'),
+        (ReturnSupplyOperationItem.objects.all(), 'return_operation__original_operation__warehouse_id',
+         'return_operation__operation_date', 'returned_quantity', -1, 'return_supply'),
+        (ReturnDispatchOperationItem.objects.all(), 'return_operation__original_operation__warehouse_id',
+         'return_operation__operation_date', 'returned_quantity', 1, 'return_dispatch'),
+        (DamageOperationItem.objects.all(), 'operation__warehouse_id', 'operation__operation_date', 'quantity', -1, 'damage'),
+        (TransferOperationItem.objects.all(), 'operation__from_warehouse_id', 'operation__operation_date', 'quantity', -1, 'transfer_out'),
+        (TransferOperationItem.objects.all(), 'operation__to_warehouse_id', 'operation__operation_date', 'quantity', 1, 'transfer_in'),
+    ]
+
+    batch = []
+
+    def flush():
+        StockMovement.objects.bulk_create(batch)
+        batch.clear()
+
+    for queryset, warehouse_path, timestamp_path, quantity_field, sign, operation_type in sources:
+        rows = queryset.values_list('pk', warehouse_path, 'item_id', timestamp_path, quantity_field)
+        for pk, warehouse_id, item_id, timestamp, quantity in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append(StockMovement(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                delta=sign * quantity,
+                timestamp=timestamp,
+                operation_type=operation_type,
+                source_line_id=pk,
+            ))
+            if len(batch) >= BATCH_SIZE:
+                flush()
+
+    modifications = [
+        (ModifySupplyOperation.objects.all(), 1, 'modify_supply'),
+        (ModifyExportOperation.objects.all(), -1, 'modify_export'),
+    ]
+    for queryset, sign, operation_type in modifications:
+        rows = queryset.values_list(
+            'pk', 'original_item_line__operation__warehouse_id', 'original_item_line__item_id',
+            'operation_date', 'old_quantity', 'new_quantity',
+        )
+        for pk, warehouse_id, item_id, timestamp, old_quantity, new_quantity in rows.iterator(chunk_size=BATCH_SIZE):
+            if new_quantity == old_quantity:
+                continue
+            batch.append(StockMovement(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                delta=sign * (new_quantity - old_quantity),
+                timestamp=timestamp,
+                operation_type=operation_type,
+                source_line_id=pk,
+            ))
+            if len(batch) >= BATCH_SIZE:
+                flush()
+    flush()
+
+    replayed = {
+        (row['warehouse_id'], row['item_id']): row['balance']
+        for row in StockMovement.objects.values('warehouse_id', 'item_id').annotate(balance=Sum('delta'))
+    }
+    now = timezone.now()
+    for warehouse_id, item_id, current_quantity in InventoryWarehouseitem.objects.values_list(
+        'warehouse_id', 'item_id', 'current_quantity'
+    ).iterator(chunk_size=BATCH_SIZE):
+        difference = current_quantity - replayed.pop((warehouse_id, item_id), Decimal('0.00'))
+        if difference:
+            batch.append(StockMovement(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                delta=difference,
+                timestamp=now,
+                operation_type='adjustment',
+            ))
+            if len(batch) >= BATCH_SIZE:
+                flush()
+    # History for pairs that no longer have a stock row nets out to zero stock.
+    for (warehouse_id, item_id), balance in replayed.items():
+        if balance:
+            batch.append(StockMovement(
+                warehouse_id=warehouse_id,
+                item_id=item_id,
+                delta=-balance,
+                timestamp=now,
+                operation_type='adjustment',
+            ))
+    flush()
+
+
+def clear_stock_movements(apps, schema_editor):
+    apps.get_model('inventory', 'StockMovement').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_stockmovement'),
+        ('operations', '0010_alter_operationattachment_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_stock_movements, clear_stock_movements),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_backfill_stock_movements'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkpoint_date', models.DateField()),
+                ('covers_until', models.DateTimeField(help_text='Movements before this moment are included in the balance.')),
+                ('period', models.CharField(choices=[('daily', 'Daily'), ('monthly', 'Monthly')], default='daily', max_length=10)),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_checkpoints', to='inventory.item')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_checkpoints', to='inventory.inventorywarehouse')),
+            ],
+            options={
+                'verbose_name': 'Stock Checkpoint',
+                'verbose_name_plural': 'Stock Checkpoints',
+                'ordering': ['warehouse', 'item', '-checkpoint_date'],
+                'indexes': [models.Index(fields=['warehouse', 'item', 'covers_until'], name='stock_checkpoint_lookup_idx')],
+                'constraints': [models.UniqueConstraint(fields=('warehouse', 'item', 'checkpoint_date'), name='unique_stock_checkpoint_per_day')],
+            },
+        ),
+    ]
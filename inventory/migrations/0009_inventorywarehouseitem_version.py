@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_stockcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventorywarehouseitem',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, help_text='Incremented by every stock change; optimistic writers only update the version they read.'),
+        ),
+    ]
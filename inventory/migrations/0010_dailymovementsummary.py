@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:18
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_alter_user_managers'),
+        ('inventory', '0009_inventorywarehouseitem_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyMovementSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('operation_type', models.CharField(choices=[('opening', 'Opening Balance'), ('adjustment', 'Adjustment'), ('supply', 'Supply'), ('export', 'Export'), ('return_supply', 'Return Supply'), ('return_dispatch', 'Return Dispatch'), ('damage', 'Damage'), ('transfer_out', 'Transfer Out'), ('transfer_in', 'Transfer In'), ('modify_supply', 'Modify Supply'), ('modify_export', 'Modify Export')], max_length=20)),
+                ('quantity', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=20)),
+                ('count', models.IntegerField(default=0, help_text='Number of operation lines (or modifications).')),
+                ('beneficiary', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='movement_summaries', to='accounts.beneficiary')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movement_summaries', to='inventory.item')),
+                ('stations', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='movement_summaries', to='inventory.stations')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='movement_summaries', to='accounts.supplier')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movement_summaries', to='inventory.inventorywarehouse')),
+            ],
+            options={
+                'verbose_name': 'Daily Movement Summary',
+                'verbose_name_plural': 'Daily Movement Summaries',
+                'ordering': ['date', 'warehouse', 'item'],
+                'indexes': [models.Index(fields=['warehouse', 'date'], name='movement_summary_wh_idx'), models.Index(fields=['supplier', 'date'], name='movement_summary_supplier_idx'), models.Index(fields=['stations', 'date'], name='movement_summary_station_idx'), models.Index(fields=['beneficiary', 'date'], name='movement_summary_benef_idx')],
+                'constraints': [models.UniqueConstraint(models.F('date'), models.F('warehouse'), models.F('item'), models.F('operation_type'), django.db.models.functions.comparison.Coalesce('supplier', 0), django.db.models.functions.comparison.Coalesce('stations', 0), django.db.models.functions.comparison.Coalesce('beneficiary', 0), name='unique_daily_movement_summary')],
+            },
+        ),
+    ]
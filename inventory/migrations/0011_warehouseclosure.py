@@ -0,0 +1,47 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_warehouse_closure(apps, schema_editor):
+    """
+    Links every existing warehouse to itself and to each of its ancestors.
+    """
+    InventoryWarehouse = apps.get_model('inventory', 'InventoryWarehouse')
+    WarehouseClosure = apps.get_model('inventory', 'WarehouseClosure')
+    parents = dict(InventoryWarehouse.objects.values_list('pk', 'parent_id'))
+    rows = []
+    for warehouse_id in parents:
+        ancestor_id, depth, seen = warehouse_id, 0, set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            rows.append(WarehouseClosure(ancestor_id=ancestor_id, descendant_id=warehouse_id, depth=depth))
+            seen.add(ancestor_id)
+            ancestor_id, depth = parents.get(ancestor_id), depth + 1
+    WarehouseClosure.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_dailymovementsummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WarehouseClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='inventory.inventorywarehouse')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='inventory.inventorywarehouse')),
+            ],
+            options={
+                'verbose_name': 'Warehouse Closure',
+                'verbose_name_plural': 'Warehouse Closures',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='warehouse_closure_desc_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_warehouse_closure')],
+            },
+        ),
+        migrations.RunPython(build_warehouse_closure, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,10 @@
+from decimal import Decimal
+
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import Coalesce
 from django.utils.translation import gettext_lazy as _
 
 from core.services.managers import ActiveManager
@@ -62,16 +67,154 @@ class InventoryWarehouse(models.Model):
     objects = models.Manager() 
     active = ActiveManager()
 
+    CYCLE_ERROR = _("A warehouse cannot be placed under itself or one of its sub-warehouses.")
+
 
     def __str__(self):
         return self.name
 
+    def parent_creates_cycle(self, parent_id=None):
+        """
+        True when `parent_id` (by default the current parent) is this warehouse or one under it.
+        """
+        parent_id = self.parent_id if parent_id is None else parent_id
+        if self.pk is None or parent_id is None:
+            return False
+        return parent_id in WarehouseClosure.objects.subtree_ids([self.pk])
+
+    def clean(self):
+        super().clean()
+        if self.parent_creates_cycle():
+            raise ValidationError({'parent': self.CYCLE_ERROR})
+
+    def save(self, *args, **kwargs):
+        """
+        Keeps WarehouseClosure in step with `parent`: a new warehouse is linked to the
+        ancestors of its parent, and a reparented one moves with its whole subtree.
+        clean() and WarehouseSerializer refuse cycles; the check here only guards other callers.
+        """
+        adding = self._state.adding
+        with transaction.atomic():
+            if not adding:
+                saved_parent_id = WarehouseClosure.objects.parent_id(self.pk)
+                if self.parent_id != saved_parent_id and self.parent_creates_cycle():
+                    raise ValidationError({'parent': self.CYCLE_ERROR})
+            super().save(*args, **kwargs)
+            if adding:
+                WarehouseClosure.objects.add_warehouse(self)
+            elif self.parent_id != saved_parent_id:
+                WarehouseClosure.objects.move_warehouse(self)
+
+    def delete(self, *args, **kwargs):
+        # The children are left without a parent (SET_NULL) and become roots.
+        with transaction.atomic():
+            WarehouseClosure.objects.detach_descendants(self)
+            return super().delete(*args, **kwargs)
+
     class Meta:
         verbose_name =_("Fuel Inventory Warehouse")
         verbose_name_plural = _("Fuel Inventory Warehouses")
         ordering = ['name']
 
 
+class WarehouseClosureManager(models.Manager):
+    """
+    Upkeep and lookups of the warehouse tree. InventoryWarehouse.save() and delete()
+    call the upkeep methods; `manage.py rebuild_warehouse_closure` recomputes the
+    table from `parent` after changes that bypassed them, such as queryset.update().
+    """
+
+    def parent_id(self, warehouse_id):
+        return self.filter(descendant=warehouse_id, depth=1).values_list('ancestor_id', flat=True).first()
+
+    def subtree_ids(self, warehouse_ids):
+        """
+        The ids of the warehouses and of all their descendants.
+        """
+        return set(self.filter(ancestor__in=warehouse_ids).values_list('descendant_id', flat=True))
+
+    def add_warehouse(self, warehouse):
+        self.create(ancestor=warehouse, descendant=warehouse, depth=0)
+        self._link(warehouse.parent_id, {warehouse.pk: 0})
+
+    def move_warehouse(self, warehouse):
+        """
+        Moves the subtree of `warehouse` under its current parent: the links from the
+        subtree to its old ancestors are dropped and links to the new ones added.
+        """
+        subtree = dict(self.filter(ancestor=warehouse).values_list('descendant_id', 'depth'))
+        self.filter(descendant__in=subtree).exclude(ancestor__in=subtree).delete()
+        self._link(warehouse.parent_id, subtree)
+
+    def detach_descendants(self, warehouse):
+        """
+        Drops the links from the descendants of `warehouse` to it and its ancestors,
+        before it is deleted.
+        """
+        descendants = self.filter(ancestor=warehouse, depth__gt=0).values_list('descendant_id', flat=True)
+        ancestors = self.filter(descendant=warehouse).values_list('ancestor_id', flat=True)
+        self.filter(descendant__in=list(descendants), ancestor__in=list(ancestors)).delete()
+
+    def rebuild(self):
+        """
+        Recomputes every link from InventoryWarehouse.parent. Returns the number of rows.
+        """
+        parents = dict(InventoryWarehouse.objects.values_list('pk', 'parent_id'))
+        rows = []
+        for warehouse_id in parents:
+            ancestor_id, depth, seen = warehouse_id, 0, set()
+            while ancestor_id is not None and ancestor_id not in seen:
+                rows.append(self.model(ancestor_id=ancestor_id, descendant_id=warehouse_id, depth=depth))
+                seen.add(ancestor_id)
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+        self.all().delete()
+        self.bulk_create(rows, batch_size=5000)
+        return len(rows)
+
+    def _link(self, parent_id, subtree):
+        """
+        Links every (descendant, depth) of `subtree`, whose root is a child of
+        `parent_id`, to the parent and its ancestors.
+        """
+        if parent_id is None:
+            return
+        ancestors = self.filter(descendant=parent_id).values_list('ancestor_id', 'depth')
+        self.bulk_create([
+            self.model(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + descendant_depth + 1)
+            for ancestor_id, ancestor_depth in ancestors
+            for descendant_id, descendant_depth in subtree.items()
+        ])
+
+
+class WarehouseClosure(models.Model):
+    """
+    One row per (ancestor, descendant) pair of the warehouse tree, including each
+    warehouse as its own ancestor at depth 0.
+
+    A subtree is a single indexed lookup on `ancestor`, so data for a warehouse and
+    everything under it is read with one join, e.g.
+    InventoryWarehouseitem.objects.filter(warehouse__ancestor_links__ancestor=hub).
+    """
+    ancestor = models.ForeignKey(InventoryWarehouse, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(InventoryWarehouse, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    objects = WarehouseClosureManager()
+
+    def __str__(self):
+        return f"{self.ancestor_id} > {self.descendant_id} ({self.depth})"
+
+    class Meta:
+        verbose_name = _("Warehouse Closure")
+        verbose_name_plural = _("Warehouse Closures")
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_warehouse_closure'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='warehouse_closure_desc_idx'),
+        ]
+
+
 
 class InventoryWarehouseitem(models.Model):
     """
@@ -95,6 +238,10 @@ class InventoryWarehouseitem(models.Model):
     current_quantity = models.DecimalField(max_digits=20, decimal_places=2, default=0.00, )
     last_updated = models.DateTimeField(auto_now=True)
     unit_of_measure = models.CharField(max_length=50, choices= UnitofMeasure.choices, default=UnitofMeasure.LITERS)
+    version = models.PositiveBigIntegerField(
+        default=0,
+        help_text=_("Incremented by every stock change; optimistic writers only update the version they read."),
+    )
 
     def __str__(self):
         return f"{self.item.name} in {self.warehouse.name}"
@@ -108,16 +255,16 @@ class InventoryWarehouseitem(models.Model):
             - operation_type the process only sum or sub.
             - value the value rect on current_quantity.
         """
-        if operation_type =="sum":
-            self.current_quantity += value
-        if operation_type =="sub":
-            self.current_quantity -= value
-
+        from core.services.stock import decrease_stock, increase_stock
 
+        if operation_type =="sum":
+            increase_stock(self.warehouse, self.item, value, StockMovement.OperationType.ADJUSTMENT)
+        elif operation_type =="sub":
+            decrease_stock(self.warehouse, self.item, value, StockMovement.OperationType.ADJUSTMENT)
         else :
             return SyntaxError()
-        
-        self.save()
+
+        self.refresh_from_db(fields=['current_quantity', 'last_updated'])
 
 
     def check_type(self, obj):
@@ -130,8 +277,192 @@ class InventoryWarehouseitem(models.Model):
         verbose_name = _("Inventory Warehouse Item")
         verbose_name_plural = _("Inventory Warehouse Items")
         ordering = ['warehouse', 'item']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['warehouse', 'item'],
+                name='unique_stock_per_warehouse_item',
+            ),
+            models.CheckConstraint(
+                condition=models.Q(current_quantity__gte=0),
+                name='stock_current_quantity_non_negative',
+            ),
+        ]
+
+
 
 
+class StockMovementQuerySet(models.QuerySet):
+    """
+    The ledger is append-only: rows can be added and read, never changed.
+    """
+
+    def update(self, **kwargs):
+        raise TypeError("Stock movements are append-only and cannot be updated.")
+
+    def delete(self):
+        raise TypeError("Stock movements are append-only and cannot be deleted.")
+
+    def for_stock(self, warehouse, item):
+        return self.filter(warehouse=warehouse, item=item)
+
+    def until(self, timestamp):
+        return self.filter(timestamp__lte=timestamp)
+
+    def balance(self):
+        """
+        Sum of the signed deltas in the queryset.
+        """
+        return self.aggregate(balance=Coalesce(Sum('delta'), Decimal('0.00')))['balance']
+
+    def kardex(self):
+        """
+        Movements in time order with the running balance after each one.
+        """
+        return self.order_by('timestamp', 'id').annotate(
+            running_balance=Window(
+                expression=Sum('delta'),
+                partition_by=[F('warehouse'), F('item')],
+                order_by=[F('timestamp').asc(), F('id').asc()],
+            )
+        )
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of every stock change.
+
+    Each supply, export, return, damage, transfer or modification line writes
+    one signed row here in the same transaction that changes
+    InventoryWarehouseitem.current_quantity, so the sum of the deltas of a
+    (warehouse, item) pair is its stock.
+    """
+
+    class OperationType(models.TextChoices):
+        OPENING = 'opening', _('Opening Balance')
+        ADJUSTMENT = 'adjustment', _('Adjustment')
+        SUPPLY = 'supply', _('Supply')
+        EXPORT = 'export', _('Export')
+        RETURN_SUPPLY = 'return_supply', _('Return Supply')
+        RETURN_DISPATCH = 'return_dispatch', _('Return Dispatch')
+        DAMAGE = 'damage', _('Damage')
+        TRANSFER_OUT = 'transfer_out', _('Transfer Out')
+        TRANSFER_IN = 'transfer_in', _('Transfer In')
+        MODIFY_SUPPLY = 'modify_supply', _('Modify Supply')
+        MODIFY_EXPORT = 'modify_export', _('Modify Export')
+
+    warehouse = models.ForeignKey(InventoryWarehouse, on_delete=models.PROTECT, related_name='stock_movements')
+    item = models.ForeignKey(Item, on_delete=models.PROTECT, related_name='stock_movements')
+    delta = models.DecimalField(max_digits=20, decimal_places=2)
+    timestamp = models.DateTimeField()
+    operation_type = models.CharField(max_length=20, choices=OperationType.choices)
+    source_line_id = models.PositiveBigIntegerField(
+        null=True,
+        blank=True,
+        help_text=_("Primary key of the operation line (or modification) that caused the movement."),
+    )
+
+    objects = StockMovementQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.operation_type} {self.delta} of {self.item_id} in {self.warehouse_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Stock movements are append-only and cannot be updated.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Stock movements are append-only and cannot be deleted.")
+
+    class Meta:
+        verbose_name = _("Stock Movement")
+        verbose_name_plural = _("Stock Movements")
+        ordering = ['timestamp', 'id']
+        indexes = [
+            models.Index(fields=['warehouse', 'item', 'timestamp'], name='stock_movement_kardex_idx'),
+        ]
+
+
+class StockCheckpoint(models.Model):
+    """
+    Balance of a (warehouse, item) pair at the end of a day or a month.
+
+    An as-of query starts from the latest checkpoint and only replays the
+    ledger movements after `covers_until`, instead of the whole history.
+    """
+
+    class Period(models.TextChoices):
+        DAILY = 'daily', _('Daily')
+        MONTHLY = 'monthly', _('Monthly')
+
+    warehouse = models.ForeignKey(InventoryWarehouse, on_delete=models.CASCADE, related_name='stock_checkpoints')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='stock_checkpoints')
+    checkpoint_date = models.DateField()
+    covers_until = models.DateTimeField(help_text=_("Movements before this moment are included in the balance."))
+    period = models.CharField(max_length=10, choices=Period.choices, default=Period.DAILY)
+    balance = models.DecimalField(max_digits=20, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.item_id} in {self.warehouse_id} on {self.checkpoint_date}: {self.balance}"
+
+    class Meta:
+        verbose_name = _("Stock Checkpoint")
+        verbose_name_plural = _("Stock Checkpoints")
+        ordering = ['warehouse', 'item', '-checkpoint_date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['warehouse', 'item', 'checkpoint_date'],
+                name='unique_stock_checkpoint_per_day',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['warehouse', 'item', 'covers_until'], name='stock_checkpoint_lookup_idx'),
+        ]
+
+
+class DailyMovementSummary(models.Model):
+    """
+    Quantity and number of lines moved per day, warehouse, item, movement type and
+    counterparty (supplier and station of a supply, beneficiary of an export).
+
+    Kept in step with the ledger by core.services.movement_summary in the same
+    transaction as each movement, so totals over a date range are read from here
+    instead of from the operations. A removed line is taken off the day of its
+    operation. `manage.py rebuild_movement_summary` recomputes it from the operations.
+    """
+
+    date = models.DateField()
+    warehouse = models.ForeignKey(InventoryWarehouse, on_delete=models.CASCADE, related_name='movement_summaries')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='movement_summaries')
+    operation_type = models.CharField(max_length=20, choices=StockMovement.OperationType.choices)
+    supplier = models.ForeignKey('accounts.Supplier', on_delete=models.CASCADE, null=True, blank=True, related_name='movement_summaries')
+    stations = models.ForeignKey('Stations', on_delete=models.CASCADE, null=True, blank=True, related_name='movement_summaries')
+    beneficiary = models.ForeignKey('accounts.Beneficiary', on_delete=models.CASCADE, null=True, blank=True, related_name='movement_summaries')
+    quantity = models.DecimalField(max_digits=20, decimal_places=2, default=Decimal('0.00'))
+    count = models.IntegerField(default=0, help_text=_("Number of operation lines (or modifications)."))
+
+    def __str__(self):
+        return f"{self.operation_type} {self.quantity} of {self.item_id} in {self.warehouse_id} on {self.date}"
+
+    class Meta:
+        verbose_name = _("Daily Movement Summary")
+        verbose_name_plural = _("Daily Movement Summaries")
+        ordering = ['date', 'warehouse', 'item']
+        constraints = [
+            # Counterparties are often NULL, which a plain unique constraint treats as distinct.
+            models.UniqueConstraint(
+                'date', 'warehouse', 'item', 'operation_type',
+                Coalesce('supplier', 0), Coalesce('stations', 0), Coalesce('beneficiary', 0),
+                name='unique_daily_movement_summary',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['warehouse', 'date'], name='movement_summary_wh_idx'),
+            models.Index(fields=['supplier', 'date'], name='movement_summary_supplier_idx'),
+            models.Index(fields=['stations', 'date'], name='movement_summary_station_idx'),
+            models.Index(fields=['beneficiary', 'date'], name='movement_summary_benef_idx'),
+        ]
 
 
 class Stations(models.Model):
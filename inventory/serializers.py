@@ -39,9 +39,15 @@ class WarehouseSerializer(serializers.ModelSerializer):
     def get_children_names(self, obj):
         """
         Custom method to get a list of names of the child warehouses.
+        WarehouseViewSet prefetches `children`, so a list does not query per warehouse.
         """
         return [child.name for child in obj.children.all()]
 
+    def validate_parent(self, value):
+        if value is not None and self.instance is not None and self.instance.parent_creates_cycle(value.pk):
+            raise serializers.ValidationError(InventoryWarehouse.CYCLE_ERROR)
+        return value
+
 class WarehouseItemSerializer(serializers.ModelSerializer):
     """
     Serializer for the InventoryWarehouseitem model, which represents the stock.
@@ -76,6 +82,15 @@ class WarehouseItemSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['current_quantity', 'last_updated']
 
+class WarehouseItemTotalsSerializer(serializers.Serializer):
+    """
+    Stock of one item summed over several warehouses.
+    """
+    item = serializers.IntegerField()
+    item_name = serializers.CharField(source='item__name')
+    opening_balance = serializers.DecimalField(max_digits=20, decimal_places=2)
+    current_quantity = serializers.DecimalField(max_digits=20, decimal_places=2)
+
 class ItemSerializer(serializers.ModelSerializer):
     """
     Serializer for the Item model. Handles creation, validation, and representation.
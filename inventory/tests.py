@@ -1,3 +1,287 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+
+from core.services.stock import (
+    OPTIMISTIC, PESSIMISTIC, InsufficientStockError, StockConflictError, apply_movements,
+)
+from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Item, StockMovement
+from inventory.serializers import WarehouseSerializer
+
+
+Type = StockMovement.OperationType
+
+
+class ApplyMovementsTests:
+    """
+    Behaviour of core.services.stock.apply_movements shared by both write modes.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = InventoryWarehouse.objects.create(name='Main', phone_warehouse='1')
+        cls.other_warehouse = InventoryWarehouse.objects.create(name='Annex', phone_warehouse='2')
+        cls.diesel = Item.objects.create(name='Diesel')
+        cls.petrol = Item.objects.create(name='Petrol')
+
+    def movement(self, delta, item=None, warehouse=None, operation_type=Type.ADJUSTMENT):
+        return StockMovement(
+            warehouse=warehouse or self.warehouse,
+            item=item or self.diesel,
+            delta=delta,
+            operation_type=operation_type,
+        )
+
+    def quantity(self, item=None, warehouse=None):
+        row = InventoryWarehouseitem.objects.filter(
+            warehouse=warehouse or self.warehouse, item=item or self.diesel,
+        ).first()
+        return row and row.current_quantity
+
+    def stock(self, quantity, item=None, warehouse=None):
+        apply_movements([self.movement(Decimal(quantity), item, warehouse, Type.OPENING)])
+
+    def test_increase_creates_the_stock_row_and_ledger_entry(self):
+        apply_movements([self.movement(Decimal('12.50'), operation_type=Type.SUPPLY)])
+
+        self.assertEqual(self.quantity(), Decimal('12.50'))
+        movement = StockMovement.objects.get()
+        self.assertEqual((movement.delta, movement.operation_type), (Decimal('12.50'), Type.SUPPLY))
+        self.assertIsNotNone(movement.timestamp)
+
+    def test_stock_defaults_apply_to_created_rows(self):
+        apply_movements(
+            [self.movement(Decimal('1'))],
+            stock_defaults={(self.warehouse.pk, self.diesel.pk): {'opening_balance': Decimal('7')}},
+        )
+
+        row = InventoryWarehouseitem.objects.get(warehouse=self.warehouse, item=self.diesel)
+        self.assertEqual(row.opening_balance, Decimal('7'))
+
+    def test_decrease_within_stock(self):
+        self.stock('10')
+
+        apply_movements([self.movement(Decimal('-4.25'), operation_type=Type.EXPORT)])
+
+        self.assertEqual(self.quantity(), Decimal('5.75'))
+        self.assertEqual(StockMovement.objects.filter(operation_type=Type.EXPORT).count(), 1)
+
+    def test_decrease_to_exactly_zero(self):
+        self.stock('10')
+
+        apply_movements([self.movement(Decimal('-10'))])
+
+        self.assertEqual(self.quantity(), Decimal('0'))
+
+    def test_insufficient_stock_changes_nothing(self):
+        self.stock('10')
+
+        with self.assertRaises(InsufficientStockError) as raised:
+            apply_movements([self.movement(Decimal('-10.01'))])
+
+        self.assertEqual(raised.exception.required, Decimal('10.01'))
+        self.assertEqual(raised.exception.available, Decimal('10'))
+        self.assertEqual(self.quantity(), Decimal('10'))
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def test_decrease_without_stock_row(self):
+        with self.assertRaises(InsufficientStockError) as raised:
+            apply_movements([self.movement(Decimal('-1'))])
+
+        self.assertIsNone(raised.exception.available)
+        self.assertFalse(InventoryWarehouseitem.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_mixed_sign_batch_is_all_or_nothing(self):
+        self.stock('10')
+        self.stock('3', item=self.petrol)
+
+        with self.assertRaises(InsufficientStockError) as raised:
+            apply_movements([
+                self.movement(Decimal('-5')),
+                self.movement(Decimal('8'), warehouse=self.other_warehouse),
+                self.movement(Decimal('-4'), item=self.petrol),
+            ])
+
+        self.assertEqual(raised.exception.item, self.petrol)
+        self.assertEqual(self.quantity(), Decimal('10'))
+        self.assertEqual(self.quantity(item=self.petrol), Decimal('3'))
+        self.assertIsNone(self.quantity(warehouse=self.other_warehouse))
+        self.assertEqual(StockMovement.objects.count(), 2)
+
+    def test_mixed_sign_batch_applies_every_pair(self):
+        self.stock('10')
+        self.stock('3', item=self.petrol)
+
+        apply_movements([
+            self.movement(Decimal('-5')),
+            self.movement(Decimal('8'), warehouse=self.other_warehouse),
+            self.movement(Decimal('-3'), item=self.petrol),
+        ])
+
+        self.assertEqual(self.quantity(), Decimal('5'))
+        self.assertEqual(self.quantity(item=self.petrol), Decimal('0'))
+        self.assertEqual(self.quantity(warehouse=self.other_warehouse), Decimal('8'))
+
+    def test_deltas_of_one_pair_are_netted(self):
+        # The decrease alone would fall short, but the batch as a whole does not.
+        self.stock('2')
+
+        apply_movements([self.movement(Decimal('-5')), self.movement(Decimal('4'))])
+
+        self.assertEqual(self.quantity(), Decimal('1'))
+        self.assertEqual(StockMovement.objects.count(), 3)
+
+    def test_zero_net_batch_records_the_ledger_only(self):
+        self.stock('2')
+        version = InventoryWarehouseitem.objects.get().version
+
+        apply_movements([self.movement(Decimal('-3')), self.movement(Decimal('3'))])
+
+        row = InventoryWarehouseitem.objects.get()
+        self.assertEqual((row.current_quantity, row.version), (Decimal('2'), version))
+        self.assertEqual(StockMovement.objects.count(), 3)
+
+    def test_every_write_bumps_the_version(self):
+        self.stock('2')
+        version = InventoryWarehouseitem.objects.get().version
+
+        apply_movements([self.movement(Decimal('-1'))])
+
+        self.assertEqual(InventoryWarehouseitem.objects.get().version, version + 1)
+
+    def test_before_write_runs_once_per_write(self):
+        self.stock('2')
+        calls = []
+
+        apply_movements([self.movement(Decimal('-1'))], before_write=lambda: calls.append(1))
+
+        self.assertEqual(calls, [1])
+
+    def test_ledger_replays_to_the_stock(self):
+        self.stock('10')
+        apply_movements([self.movement(Decimal('-2.5')), self.movement(Decimal('1'), item=self.petrol)])
+        apply_movements([self.movement(Decimal('0.75'))])
+
+        for row in InventoryWarehouseitem.objects.all():
+            ledger = sum(
+                StockMovement.objects.filter(warehouse=row.warehouse, item=row.item).values_list('delta', flat=True),
+                Decimal('0'),
+            )
+            self.assertEqual(ledger, row.current_quantity)
+
+
+@override_settings(STOCK_WRITE_MODE=PESSIMISTIC)
+class PessimisticApplyMovementsTests(ApplyMovementsTests, TestCase):
+    pass
+
+
+@override_settings(STOCK_WRITE_MODE=OPTIMISTIC, STOCK_OPTIMISTIC_MAX_RETRIES=2)
+class OptimisticApplyMovementsTests(ApplyMovementsTests, TestCase):
+
+    def concurrent_write(self, delta):
+        """Changes the row behind the writer's back, as a concurrent writer would."""
+        row = InventoryWarehouseitem.objects.get(warehouse=self.warehouse, item=self.diesel)
+        row.current_quantity += Decimal(delta)
+        row.version += 1
+        row.save(update_fields=['current_quantity', 'version'])
+
+    def test_conflicting_write_is_retried_on_fresh_values(self):
+        self.stock('10')
+        conflicts = iter([True])
+
+        def before_write():
+            if next(conflicts, False):
+                self.concurrent_write('5')
+
+        apply_movements([self.movement(Decimal('-3'))], before_write=before_write)
+
+        self.assertEqual(self.quantity(), Decimal('12'))
+
+    def test_retry_rechecks_the_stock(self):
+        self.stock('10')
+        conflicts = iter([True])
+
+        def before_write():
+            if next(conflicts, False):
+                self.concurrent_write('-8')
+
+        with self.assertRaises(InsufficientStockError) as raised:
+            apply_movements([self.movement(Decimal('-3'))], before_write=before_write)
+
+        self.assertEqual(raised.exception.available, Decimal('2'))
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+    def test_gives_up_after_the_configured_retries(self):
+        self.stock('10')
+        calls = []
+
+        def before_write():
+            calls.append(1)
+            self.concurrent_write('1')
+
+        with self.assertRaises(StockConflictError):
+            apply_movements([self.movement(Decimal('-3'))], before_write=before_write)
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+
+class StockConstraintTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = InventoryWarehouse.objects.create(name='Main', phone_warehouse='1')
+        cls.item = Item.objects.create(name='Diesel')
+
+    def test_stock_cannot_go_negative(self):
+        row = InventoryWarehouseitem.objects.create(warehouse=self.warehouse, item=self.item)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            InventoryWarehouseitem.objects.filter(pk=row.pk).update(current_quantity=Decimal('-0.01'))
+
+    def test_one_stock_row_per_warehouse_and_item(self):
+        InventoryWarehouseitem.objects.create(warehouse=self.warehouse, item=self.item)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            InventoryWarehouseitem.objects.create(warehouse=self.warehouse, item=self.item)
+
+
+class WarehouseCycleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = InventoryWarehouse.objects.create(name='Root', phone_warehouse='1')
+        cls.child = InventoryWarehouse.objects.create(name='Child', phone_warehouse='2', parent=cls.root)
+        cls.grandchild = InventoryWarehouse.objects.create(name='Grandchild', phone_warehouse='3', parent=cls.child)
+
+    def test_clean_refuses_a_parent_inside_the_subtree(self):
+        for parent in (self.root, self.grandchild):
+            with self.subTest(parent=parent.name):
+                self.root.parent = parent
+                with self.assertRaises(ValidationError) as raised:
+                    self.root.clean()
+                self.assertIn('parent', raised.exception.message_dict)
+
+    def test_clean_accepts_a_parent_outside_the_subtree(self):
+        self.child.parent = None
+        self.child.clean()
+        self.grandchild.parent = self.root
+        self.grandchild.clean()
+
+    def test_serializer_refuses_a_parent_inside_the_subtree(self):
+        serializer = WarehouseSerializer(self.root, data={'parent': self.grandchild.pk}, partial=True)
+
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('parent', serializer.errors)
+
+    def test_save_refuses_a_cycle(self):
+        self.root.parent = self.grandchild
+
+        with self.assertRaises(ValidationError):
+            self.root.save()
+
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_id)
@@ -1,9 +1,14 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from django.db.models import Sum
+from inventory.importers import ImportFormatError, detect_format, import_warehouse_items
 from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Item, Stations
-from .serializers import ItemSerializer, StationSerializer,   WarehouseItemSerializer, WarehouseSerializer
-from core.services.mixins import UserPermissionsMixin
+from .serializers import ItemSerializer, StationSerializer,   WarehouseItemSerializer, WarehouseItemTotalsSerializer, WarehouseSerializer
+from core.services.mixins import UserPermissionsMixin, managed_warehouse_ids
+from core.services.warehouse_tree import include_descendants, warehouse_filter
 from rest_framework.permissions import IsAuthenticated
 
 
@@ -12,6 +17,8 @@ class WarehouseViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     """
     API endpoint that allows warehouses to be viewed or edited.
     Supports creating hierarchical warehouses.
+    The list accepts ?parent=<id> for its children, or with include_descendants=1
+    for every warehouse under it.
     """
     queryset = InventoryWarehouse.objects.all()
     warehouse_field_lookup = 'pk__in'
@@ -33,7 +40,13 @@ class WarehouseViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
-        base_queryset = super().get_queryset()
+        base_queryset = super().get_queryset().select_related('parent', 'storekeeper').prefetch_related('children')
+        if self.action == 'list':
+            parent = self.request.query_params.get('parent')
+            if parent and include_descendants(self.request):
+                base_queryset = base_queryset.filter(ancestor_links__ancestor=parent, ancestor_links__depth__gt=0)
+            elif parent:
+                base_queryset = base_queryset.filter(parent=parent)
         if user.is_superuser or user.user_type == 'Manager':
             return base_queryset
         return base_queryset.filter(is_active=True)
@@ -55,6 +68,9 @@ class WarehouseItemViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     This endpoint is READ-ONLY because stock levels should only be
     modified automatically through creating new operations (Supply, Dispatch, etc.),
     not directly via the API.
+
+    The list accepts ?warehouse=<id> (with include_descendants=1 for the warehouses
+    under it too) and ?item=<id>.
     """
     queryset = InventoryWarehouseitem.objects.all()
     warehouse_field_lookup = 'warehouse__in'
@@ -62,6 +78,55 @@ class WarehouseItemViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     filterset_fields = ['warehouse', 'item']
     permission_classes  = [IsAuthenticated]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'totals'):
+            warehouse = self.request.query_params.get('warehouse')
+            item = self.request.query_params.get('item')
+            if warehouse:
+                queryset = queryset.filter(**warehouse_filter('warehouse', warehouse, include_descendants(self.request)))
+            if item:
+                queryset = queryset.filter(item=item)
+        return queryset.select_related('warehouse', 'item')
+
+    @action(detail=False, methods=['get'], url_path='totals')
+    def totals(self, request):
+        """
+        Stock per item summed over the listed rows, e.g. a hub and its sub-depots with
+        ?warehouse=<id>&include_descendants=1.
+        """
+        rows = (
+            self.get_queryset()
+            .values('item', 'item__name')
+            .annotate(opening_balance=Sum('opening_balance'), current_quantity=Sum('current_quantity'))
+            .order_by('item__name')
+        )
+        return Response(WarehouseItemTotalsSerializer(rows, many=True).data)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """
+        Creates or updates opening balances from an uploaded .csv or .xlsx `file`.
+        Columns: warehouse, item, opening_balance, current_quantity (optional), unit_of_measure (optional).
+        Employees can only import rows for the warehouses they manage.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': 'This field is required.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = request.user
+        allowed_warehouse_ids = None
+        if not (user.is_superuser or user.user_type == 'Manager'):
+            if user.user_type != 'Employee':
+                return Response(status=status.HTTP_403_FORBIDDEN)
+            allowed_warehouse_ids = managed_warehouse_ids(request)
+
+        try:
+            result = import_warehouse_items(upload, detect_format(upload.name), allowed_warehouse_ids)
+        except ImportFormatError as e:
+            return Response({'file': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
 class ItemViewSet(viewsets.ModelViewSet):
     """
     ViewSet for viewing and editing inventory items.
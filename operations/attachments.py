@@ -0,0 +1,284 @@
+"""
+Attachment handling for the operation serializers.
+
+Uploaded files are written to storage before the operation's transaction starts,
+and the OperationAttachment rows are inserted once it has committed. The stock
+rows locked by the transaction are therefore never held while files are copied.
+
+With ATTACHMENT_STORAGE_MODE = 'content' an upload is hashed while it is copied and
+stored once per distinct content as an AttachmentBlob; attachments with the same
+content share the blob and its ref_count says how many of them there are.
+
+Large files can be sent beforehand in byte ranges as an AttachmentUpload; the operation
+then lists the upload's token instead of the file.
+"""
+import hashlib
+import logging
+import os
+from collections import Counter, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+from rest_framework import serializers
+
+from operations.models import AttachmentBlob, AttachmentUpload, OperationAttachment
+
+
+logger = logging.getLogger(__name__)
+
+DATED = 'dated'
+CONTENT = 'content'
+
+# `name` is the stored file; `blob_id` is set when the file is a shared blob and
+# `upload_id` when it came from a chunked upload.
+StagedAttachment = namedtuple('StagedAttachment', ['name', 'blob_id', 'upload_id'], defaults=[None])
+
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class UploadRangeError(ValueError):
+    """
+    Raised when a byte range does not continue an upload where it stopped.
+    `offset` is where the next range has to start.
+    """
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def _storage():
+    return OperationAttachment._meta.get_field('file').storage
+
+
+class _HashingFile(File):
+    """
+    Hands the chunks of `file` to storage.save() and hashes them on the way, so a file
+    is read once to be both stored and hashed.
+    """
+    def __init__(self, file, name):
+        super().__init__(file, name)
+        self.digest = hashlib.sha256()
+        self.hashed_size = 0
+
+    def chunks(self, chunk_size=None):
+        chunks = self.file.chunks(chunk_size) if hasattr(self.file, 'chunks') else super().chunks(chunk_size)
+        for chunk in chunks:
+            self.digest.update(chunk)
+            self.hashed_size += len(chunk)
+            yield chunk
+
+
+def _move_stored_file(name, target):
+    """
+    Renames a stored file to `target`, or to a free variant of it when `target` is taken,
+    and returns the new name. Storages without local paths keep the file under `name`.
+    """
+    storage = _storage()
+    try:
+        source = storage.path(name)
+    except NotImplementedError:
+        return name
+    target = storage.get_available_name(target)
+    os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+    os.replace(source, storage.path(target))
+    return target
+
+
+def store_blob(file, filename):
+    """
+    Returns the AttachmentBlob holding the content of `file`, keeping the file only when no
+    blob has that content yet. The file is hashed while it is copied under a temporary name,
+    then renamed to its digest path. The blob's ref_count is not changed.
+    """
+    storage = _storage()
+    file.seek(0)
+    hashing = _HashingFile(file, filename)
+    incoming = storage.save(AttachmentBlob.incoming_path_for(filename), hashing)
+    sha256, size = hashing.digest.hexdigest(), hashing.hashed_size
+    now = timezone.now()
+    # Touching the blob keeps gc_attachment_blobs away from it until it is linked.
+    blob = AttachmentBlob.objects.filter(sha256=sha256).first()
+    if blob is not None and AttachmentBlob.objects.filter(pk=blob.pk).update(last_staged_at=now):
+        storage.delete(incoming)
+        return blob
+
+    try:
+        name = _move_stored_file(incoming, AttachmentBlob.path_for(sha256, filename))
+    except Exception:
+        storage.delete(incoming)
+        raise
+    try:
+        with transaction.atomic():
+            return AttachmentBlob.objects.create(sha256=sha256, file=name, size=size, last_staged_at=now)
+    except IntegrityError:
+        # Another upload of the same content created the blob first.
+        storage.delete(name)
+        blob = AttachmentBlob.objects.get(sha256=sha256)
+        AttachmentBlob.objects.filter(pk=blob.pk).update(last_staged_at=now)
+        return blob
+
+
+def upload_expiry():
+    return timezone.now() + timedelta(hours=settings.ATTACHMENT_UPLOAD_TTL_HOURS)
+
+
+def write_upload_range(upload, start, length, stream):
+    """
+    Appends `length` bytes read from `stream` to the staging file of `upload`, starting at `start`.
+
+    Ranges must arrive in order: `start` has to equal the bytes received so far, otherwise
+    UploadRangeError says where to resume. When the stream ends early (a dropped connection)
+    the bytes that did arrive are kept, so the client can ask for the offset and carry on.
+    The upload row is locked while the range is written, so two requests cannot interleave.
+    """
+    with transaction.atomic():
+        upload = AttachmentUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != AttachmentUpload.Status.UPLOADING:
+            raise UploadRangeError("This upload is already complete.", upload.received)
+        if start != upload.received:
+            raise UploadRangeError(f"The next range must start at byte {upload.received}.", upload.received)
+        if start + length > upload.size:
+            raise UploadRangeError(f"The range ends past the declared size of {upload.size} bytes.", upload.received)
+
+        os.makedirs(settings.ATTACHMENT_UPLOAD_DIR, exist_ok=True)
+        written = 0
+        with open(upload.staging_path, 'r+b' if os.path.exists(upload.staging_path) else 'wb') as staging:
+            # Anything past `received` is left over from a range that was never acknowledged.
+            staging.seek(start)
+            staging.truncate()
+            while written < length:
+                chunk = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                if not chunk:
+                    break
+                staging.write(chunk)
+                written += len(chunk)
+
+        upload.received = start + written
+        if upload.received == upload.size:
+            upload.status = AttachmentUpload.Status.COMPLETE
+        upload.expires_at = upload_expiry()
+        upload.save(update_fields=['received', 'status', 'expires_at'])
+    return upload
+
+
+def delete_upload_file(upload):
+    try:
+        os.remove(upload.staging_path)
+    except FileNotFoundError:
+        pass
+
+
+def _stage_upload(upload, operation_field, content_mode):
+    """
+    Claims a completed chunked upload and copies its staging file into attachment storage.
+    """
+    claimed = AttachmentUpload.objects.filter(pk=upload.pk, status=AttachmentUpload.Status.COMPLETE).update(
+        status=AttachmentUpload.Status.CLAIMED,
+    )
+    if not claimed:
+        raise serializers.ValidationError(
+            {'uploaded_attachments': [f"Upload {upload.token} is not complete or is already used by another operation."]}
+        )
+    try:
+        with open(upload.staging_path, 'rb') as staging:
+            file = File(staging, name=upload.filename)
+            if content_mode:
+                blob = store_blob(file, upload.filename)
+                return StagedAttachment(blob.file.name, blob.pk, upload.pk)
+            name = _storage().save(OperationAttachment.path_for(operation_field, upload.filename), file)
+            return StagedAttachment(name, None, upload.pk)
+    except Exception:
+        _release_uploads([upload.pk])
+        raise
+
+
+def _release_uploads(upload_ids):
+    AttachmentUpload.objects.filter(pk__in=upload_ids, status=AttachmentUpload.Status.CLAIMED).update(
+        status=AttachmentUpload.Status.COMPLETE,
+    )
+
+
+def stage_attachments(uploaded_files, operation_field):
+    """
+    Saves the uploads to storage and returns them as StagedAttachment tuples. An entry may be
+    an uploaded file or a completed AttachmentUpload, which is claimed so no other operation
+    can use it. Call it before transaction.atomic(); nothing points at the files until they are linked.
+    """
+    content_mode = settings.ATTACHMENT_STORAGE_MODE == CONTENT
+    staged = []
+    try:
+        for upload in uploaded_files:
+            if isinstance(upload, AttachmentUpload):
+                staged.append(_stage_upload(upload, operation_field, content_mode))
+            elif content_mode:
+                blob = store_blob(upload, upload.name)
+                staged.append(StagedAttachment(blob.file.name, blob.pk))
+            else:
+                name = _storage().save(OperationAttachment.path_for(operation_field, upload.name), upload)
+                staged.append(StagedAttachment(name, None))
+    except Exception:
+        discard_staged_attachments(staged)
+        raise
+    return staged
+
+
+def add_blob_references(blob_ids, step=1):
+    """
+    Adds `step` to the ref_count of each blob once per occurrence in `blob_ids`, in one UPDATE.
+    """
+    counts = Counter(blob_id for blob_id in blob_ids if blob_id is not None)
+    if counts:
+        AttachmentBlob.objects.filter(pk__in=counts).update(
+            ref_count=Case(
+                *[When(pk=blob_id, then=F('ref_count') + count * step) for blob_id, count in counts.items()],
+            )
+        )
+
+
+def link_attachments_on_commit(staged, operation_field, operation):
+    """
+    Inserts the attachment rows for `operation` after the current transaction commits.
+    If the transaction rolls back the callback is dropped; the caller discards the files.
+    """
+    if not staged:
+        return
+
+    def link():
+        try:
+            with transaction.atomic():
+                OperationAttachment.objects.bulk_create([
+                    OperationAttachment(**{operation_field: operation}, file=attachment.name, blob_id=attachment.blob_id)
+                    for attachment in staged
+                ])
+                add_blob_references(attachment.blob_id for attachment in staged)
+        except Exception:
+            logger.exception("Could not link attachments to %s %s.", operation_field, operation.pk)
+            discard_staged_attachments(staged)
+            return
+        uploads = list(AttachmentUpload.objects.filter(pk__in=[a.upload_id for a in staged if a.upload_id]))
+        AttachmentUpload.objects.filter(pk__in=[upload.pk for upload in uploads]).delete()
+        for upload in uploads:
+            delete_upload_file(upload)
+
+    transaction.on_commit(link)
+
+
+def discard_staged_attachments(staged):
+    """
+    Deletes staged files that were never linked and hands claimed chunked uploads back, so
+    the operation can be sent again with the same tokens. Blobs are left to gc_attachment_blobs,
+    since another upload may resolve to the same blob in the meantime.
+    """
+    _release_uploads([attachment.upload_id for attachment in staged if attachment.upload_id])
+    storage = _storage()
+    for attachment in staged:
+        if attachment.blob_id is not None:
+            continue
+        try:
+            storage.delete(attachment.name)
+        except Exception:
+            logger.exception("Could not delete staged attachment %s.", attachment.name)
@@ -0,0 +1,136 @@
+"""
+Idempotency-Key support for the operation endpoints.
+
+The first request with a given key is processed normally and its successful
+response is stored. A retry with the same key and payload gets the stored
+response back without running validation, stock updates or attachment writes
+again. Failed requests are not stored, so the client can retry them with the
+same key. A key left processing longer than IDEMPOTENCY_PROCESSING_TIMEOUT
+seconds, e.g. by a worker that died mid-request, is taken over by the next retry.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.status import is_success
+
+from operations.models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _payload_value(value):
+    if isinstance(value, UploadedFile):
+        return f'{value.name}:{value.size}'
+    return value
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        payload = sorted((key, [_payload_value(value) for value in values]) for key, values in data.lists())
+    else:
+        payload = data
+    body = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def idempotent_response(request, handler):
+    """
+    Runs `handler` once per (user, Idempotency-Key) and replays its stored response afterwards.
+    Requests without the header are passed straight to `handler`.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key or not request.user.is_authenticated:
+        return handler()
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return Response(
+            {'detail': f'{IDEMPOTENCY_HEADER} must be at most 255 characters.'},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    fingerprint = request_fingerprint(request)
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+    if record is not None and (record.expires_at <= now or _is_abandoned(record, now)):
+        # Deleted only while unchanged, so a request that has just finished keeps its response.
+        IdempotencyKey.objects.filter(pk=record.pk, status=record.status).delete()
+        record = None
+    if record is not None:
+        return _replay(record, fingerprint)
+
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=request.user,
+                key=key,
+                method=request.method,
+                path=request.path,
+                request_fingerprint=fingerprint,
+                expires_at=now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS),
+            )
+    except IntegrityError:
+        # Another request with the same key got there first.
+        return _in_progress()
+
+    try:
+        response = handler()
+    except Exception:
+        record.delete()
+        raise
+    if not is_success(response.status_code):
+        record.delete()
+        return response
+
+    # An update rather than save(): the key may have been taken over by a retry meanwhile.
+    IdempotencyKey.objects.filter(pk=record.pk).update(
+        status=IdempotencyKey.Status.COMPLETED,
+        response_status=response.status_code,
+        response_body=json.loads(JSONRenderer().render(response.data) or 'null'),
+    )
+    return response
+
+
+def _is_abandoned(record, now):
+    return (
+        record.status == IdempotencyKey.Status.PROCESSING
+        and record.created_at <= now - timedelta(seconds=settings.IDEMPOTENCY_PROCESSING_TIMEOUT)
+    )
+
+
+def _replay(record, fingerprint):
+    if record.request_fingerprint != fingerprint:
+        return Response(
+            {'detail': f'This {IDEMPOTENCY_HEADER} was already used for a different request.'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    if record.status == IdempotencyKey.Status.PROCESSING:
+        return _in_progress()
+    return Response(record.response_body, status=record.response_status, headers={REPLAYED_HEADER: 'true'})
+
+
+def _in_progress():
+    return Response(
+        {'detail': f'A request with this {IDEMPOTENCY_HEADER} is still being processed.'},
+        status=status.HTTP_409_CONFLICT,
+    )
+
+
+class IdempotentCreateMixin:
+    """
+    Makes `create` honour the Idempotency-Key header.
+    """
+    def create(self, request, *args, **kwargs):
+        return idempotent_response(
+            request,
+            lambda: super(IdempotentCreateMixin, self).create(request, *args, **kwargs),
+        )
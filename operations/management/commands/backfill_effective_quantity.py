@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from operations.models import ExportOperationItem, SupplyOperationItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the stored effective_quantity of supply and export lines from their "
+        "latest modification. Run it after loading data that bypassed the model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Lines per UPDATE.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for line_model in (SupplyOperationItem, ExportOperationItem):
+            updated = 0
+            last_pk = 0
+            while True:
+                pks = list(
+                    line_model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+                )
+                if not pks:
+                    break
+                updated += line_model.objects.filter(pk__in=pks).refresh_effective_quantity()
+                last_pk = pks[-1]
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {updated} {line_model._meta.verbose_name_plural}."))
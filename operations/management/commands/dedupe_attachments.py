@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from operations.attachments import add_blob_references, store_blob
+from operations.models import AttachmentBlob, OperationAttachment
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves attachments stored under dated folders into content-addressed blobs, so identical "
+        "files are kept once. The old files are deleted after their attachment points at the blob."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help="Convert at most this many attachments.")
+
+    def handle(self, *args, **options):
+        attachments = OperationAttachment.objects.filter(blob__isnull=True).exclude(file='').order_by('pk')
+        if options['limit']:
+            attachments = attachments[:options['limit']]
+
+        converted = 0
+        missing = 0
+        for attachment in attachments.iterator():
+            storage = attachment.file.storage
+            old_name = attachment.file.name
+            if not storage.exists(old_name):
+                missing += 1
+                self.stdout.write(self.style.WARNING(f"Attachment {attachment.pk}: {old_name} is missing, skipped."))
+                continue
+            with storage.open(old_name, 'rb') as file:
+                blob = store_blob(file, old_name)
+            with transaction.atomic():
+                # Saving through update() skips the post_save signal, so the reference is added here.
+                OperationAttachment.objects.filter(pk=attachment.pk).update(file=blob.file.name, blob=blob)
+                add_blob_references([blob.pk])
+            storage.delete(old_name)
+            converted += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {converted} attachments into {AttachmentBlob.objects.count()} blobs; {missing} files were missing."
+        ))
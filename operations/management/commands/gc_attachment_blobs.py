@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from operations.models import AttachmentBlob
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes attachment blobs that no attachment references any more, with their files. "
+        "Blobs staged within the last ATTACHMENT_BLOB_GC_GRACE_HOURS are kept. Run it periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=None)
+        parser.add_argument('--dry-run', action='store_true', help="List what would be deleted without deleting it.")
+
+    def handle(self, *args, **options):
+        grace_hours = options['grace_hours']
+        if grace_hours is None:
+            grace_hours = settings.ATTACHMENT_BLOB_GC_GRACE_HOURS
+        cutoff = timezone.now() - timedelta(hours=grace_hours)
+        candidates = AttachmentBlob.objects.filter(ref_count=0, last_staged_at__lt=cutoff)
+
+        deleted = 0
+        freed = 0
+        for blob in candidates.iterator():
+            if options['dry_run']:
+                self.stdout.write(f"{blob.file.name} ({blob.size} bytes)")
+                deleted += 1
+                freed += blob.size
+                continue
+            # The filter is repeated so a blob staged or linked since it was listed survives.
+            removed, _ = AttachmentBlob.objects.filter(
+                pk=blob.pk, ref_count=0, last_staged_at__lt=cutoff,
+            ).delete()
+            if not removed:
+                continue
+            blob.file.storage.delete(blob.file.name)
+            deleted += 1
+            freed += blob.size
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {deleted} unreferenced blobs ({freed} bytes)."))
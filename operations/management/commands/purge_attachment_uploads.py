@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from operations.attachments import delete_upload_file
+from operations.models import AttachmentUpload
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes chunked attachment uploads that were not used within ATTACHMENT_UPLOAD_TTL_HOURS "
+        "of their last range, with their staging files. Run it periodically."
+    )
+
+    def handle(self, *args, **options):
+        expired = list(AttachmentUpload.objects.filter(expires_at__lte=timezone.now()))
+        AttachmentUpload.objects.filter(pk__in=[upload.pk for upload in expired]).delete()
+        for upload in expired:
+            delete_upload_file(upload)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {len(expired)} expired uploads."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from operations.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Deletes stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL_HOURS. Run it periodically."
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
@@ -0,0 +1,91 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, Sum, Value
+from django.db.models.functions import TruncDate
+
+from inventory.models import DailyMovementSummary, StockMovement
+from operations.movements import LINE_SOURCES, LineSource
+
+
+Type = StockMovement.OperationType
+
+# The operation lines, plus the movements that only exist in the ledger.
+SOURCES = LINE_SOURCES + [
+    LineSource(Type.OPENING, StockMovement, 'timestamp', 'warehouse', 'item', F('delta'), 1, None, None, None),
+    LineSource(Type.ADJUSTMENT, StockMovement, 'timestamp', 'warehouse', 'item', F('delta'), 1, None, None, None),
+]
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f"{name} must be in YYYY-MM-DD format.")
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the daily movement summary from the operations. Run it once after "
+        "upgrading, and after loading data that bypassed the stock services."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', help="First day to rebuild, as YYYY-MM-DD (default: all).")
+        parser.add_argument('--end-date', help="Last day to rebuild, as YYYY-MM-DD (default: all).")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows per INSERT.")
+
+    def handle(self, *args, **options):
+        start_date = options['start_date'] and _parse_date(options['start_date'], 'start-date')
+        end_date = options['end_date'] and _parse_date(options['end_date'], 'end-date')
+
+        with transaction.atomic():
+            existing = DailyMovementSummary.objects.all()
+            if start_date:
+                existing = existing.filter(date__gte=start_date)
+            if end_date:
+                existing = existing.filter(date__lte=end_date)
+            existing.delete()
+
+            created = 0
+            for source in SOURCES:
+                rows = list(self.summarize(source, start_date, end_date))
+                DailyMovementSummary.objects.bulk_create(rows, batch_size=options['batch_size'])
+                created += len(rows)
+        self.stdout.write(self.style.SUCCESS(f"Stored {created} daily movement summary rows."))
+
+    def summarize(self, source, start_date, end_date):
+        operation_type, model, date, warehouse, item, quantity, sign, supplier, stations, beneficiary, condition = source
+        rows = model.objects.all()
+        if condition is not None:
+            rows = rows.filter(condition)
+        if model is StockMovement:
+            rows = rows.filter(operation_type=operation_type)
+        if start_date:
+            rows = rows.filter(**{f'{date}__date__gte': start_date})
+        if end_date:
+            rows = rows.filter(**{f'{date}__date__lte': end_date})
+        none = Value(None, output_field=IntegerField())
+        grouped = rows.values(
+            summary_date=TruncDate(date),
+            summary_warehouse=F(warehouse),
+            summary_item=F(item),
+            summary_supplier=F(supplier) if supplier else none,
+            summary_stations=F(stations) if stations else none,
+            summary_beneficiary=F(beneficiary) if beneficiary else none,
+        ).annotate(summary_quantity=Sum(quantity), summary_count=Count('pk')).order_by()
+
+        for row in grouped.iterator(chunk_size=2000):
+            yield DailyMovementSummary(
+                date=row['summary_date'],
+                warehouse_id=row['summary_warehouse'],
+                item_id=row['summary_item'],
+                operation_type=operation_type,
+                supplier_id=row['summary_supplier'],
+                stations_id=row['summary_stations'],
+                beneficiary_id=row['summary_beneficiary'],
+                quantity=(row['summary_quantity'] or Decimal('0.00')) * sign,
+                count=row['summary_count'],
+            )
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_effective_quantity(apps, schema_editor):
+    for line_model_name, modification_model_name in (
+        ('SupplyOperationItem', 'ModifySupplyOperation'),
+        ('ExportOperationItem', 'ModifyExportOperation'),
+    ):
+        line_model = apps.get_model('operations', line_model_name)
+        modification_model = apps.get_model('operations', modification_model_name)
+        latest = modification_model.objects.filter(
+            original_item_line=OuterRef('pk')
+        ).order_by('-operation_date', '-id').values('new_quantity')[:1]
+        line_model.objects.update(effective_quantity=Coalesce(Subquery(latest), F('quantity')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0010_alter_operationattachment_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportoperationitem',
+            name='effective_quantity',
+            field=models.DecimalField(decimal_places=2, max_digits=15, null=True, verbose_name='Effective Quantity'),
+        ),
+        migrations.AddField(
+            model_name='supplyoperationitem',
+            name='effective_quantity',
+            field=models.DecimalField(decimal_places=2, max_digits=15, null=True, verbose_name='Effective Quantity'),
+        ),
+        migrations.RunPython(backfill_effective_quantity, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='exportoperationitem',
+            name='effective_quantity',
+            field=models.DecimalField(decimal_places=2, help_text='The quantity after the latest modification; equals quantity until the line is modified.', max_digits=15, verbose_name='Effective Quantity'),
+        ),
+        migrations.AlterField(
+            model_name='supplyoperationitem',
+            name='effective_quantity',
+            field=models.DecimalField(decimal_places=2, help_text='The quantity after the latest modification; equals quantity until the line is modified.', max_digits=15, verbose_name='Effective Quantity'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0012_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to='', verbose_name='File')),
+                ('size', models.PositiveBigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('last_staged_at', models.DateTimeField(help_text='Last time an upload resolved to this blob; unreferenced blobs are kept for a grace period after it.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Attachment Blob',
+                'verbose_name_plural': 'Attachment Blobs',
+                'indexes': [models.Index(fields=['ref_count', 'last_staged_at'], name='attachment_blob_gc_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='operationattachment',
+            name='blob',
+            field=models.ForeignKey(blank=True, help_text='The shared content of the file; empty for files stored under a dated folder.', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='attachments', to='operations.attachmentblob'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 16:54
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('operations', '0013_attachmentblob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField(help_text='Total size of the file in bytes.')),
+                ('received', models.PositiveBigIntegerField(default=0, help_text='Bytes stored so far; the next range starts here.')),
+                ('status', models.CharField(choices=[('uploading', 'Uploading'), ('complete', 'Complete'), ('claimed', 'Claimed')], default='uploading', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachment_uploads', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Attachment Upload',
+                'verbose_name_plural': 'Attachment Uploads',
+                'indexes': [models.Index(fields=['expires_at'], name='attachment_upload_expiry_idx')],
+            },
+        ),
+    ]
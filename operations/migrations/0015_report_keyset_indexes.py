@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_alter_user_managers'),
+        ('inventory', '0010_dailymovementsummary'),
+        ('operations', '0014_attachmentupload'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='damageoperation',
+            index=models.Index(fields=['warehouse', 'operation_date', 'id'], name='damage_warehouse_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportoperation',
+            index=models.Index(fields=['warehouse', 'operation_date', 'id'], name='export_warehouse_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exportoperation',
+            index=models.Index(fields=['beneficiary', 'operation_date', 'id'], name='export_beneficiary_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplyoperation',
+            index=models.Index(fields=['warehouse', 'operation_date', 'id'], name='supply_warehouse_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplyoperation',
+            index=models.Index(fields=['supplier', 'operation_date', 'id'], name='supply_supplier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supplyoperation',
+            index=models.Index(fields=['stations', 'operation_date', 'id'], name='supply_stations_date_idx'),
+        ),
+    ]
@@ -1,13 +1,30 @@
 from datetime import datetime
 import os
+import uuid
 from django.conf import settings
 from django.db import models
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from marshmallow import ValidationError
 from inventory.models import InventoryWarehouseitem , Item ,Stations , InventoryWarehouse
 from accounts.models import User , Supplier  , Beneficiary
 from django.utils.translation import gettext_lazy as _
 
 
+class OperationLineQuerySet(models.QuerySet):
+
+    def refresh_effective_quantity(self):
+        """
+        Recomputes effective_quantity of the lines in one UPDATE: the new_quantity of the
+        latest modification (by operation_date, then id), or the line quantity when there is none.
+        """
+        modification_model = self.model._meta.get_field('modifications').related_model
+        latest = modification_model.objects.filter(
+            original_item_line=OuterRef('pk')
+        ).order_by('-operation_date', '-id').values('new_quantity')[:1]
+        return self.update(effective_quantity=Coalesce(Subquery(latest), F('quantity')))
+
+
 class SupplyOperation(models.Model):
     warehouse = models.ForeignKey(InventoryWarehouse ,on_delete=models.PROTECT, related_name = 'warehouse_main_operations' )
     supplier = models.ForeignKey(Supplier, on_delete=models.PROTECT , related_name= "reletions_to_supplier_model")
@@ -32,6 +49,14 @@ class SupplyOperation(models.Model):
     def __str__(self):
         return f"{self.warehouse.name} -supplier : {self.supplier} - {self.operation_date}"
 
+    class Meta:
+        # Report pages are read in (operation_date, id) order per subject; see reports.pagination.
+        indexes = [
+            models.Index(fields=['warehouse', 'operation_date', 'id'], name='supply_warehouse_date_idx'),
+            models.Index(fields=['supplier', 'operation_date', 'id'], name='supply_supplier_date_idx'),
+            models.Index(fields=['stations', 'operation_date', 'id'], name='supply_stations_date_idx'),
+        ]
+
 class SupplyOperationItem(models.Model):
 
     operation = models.ForeignKey(SupplyOperation, related_name='items', on_delete=models.PROTECT)
@@ -44,6 +69,14 @@ class SupplyOperationItem(models.Model):
         default=0.00,
         help_text="Total quantity of this item returned against this dispatch line."
     )
+    effective_quantity = models.DecimalField(
+        _("Effective Quantity"),
+        max_digits=15,
+        decimal_places=2,
+        help_text="The quantity after the latest modification; equals quantity until the line is modified."
+    )
+
+    objects = OperationLineQuerySet.as_manager()
 
     @property
     def returnable_quantity(self):
@@ -54,15 +87,10 @@ class SupplyOperationItem(models.Model):
     def __str__(self):
         return f"{self.operation }in {self.operation.warehouse.name} with item {self.item.name} quantity= {self.quantity}"
     
-    @property
-    def effective_quantity(self):
-        """
-        Returns the most up-to-date quantity after all modifications.
-        """
-        last_modification = self.modifications.order_by('-operation_date').first()
-        if last_modification:
-            return last_modification.new_quantity
-        return self.quantity
+    def save(self, *args, **kwargs):
+        if self.effective_quantity is None:
+            self.effective_quantity = self.quantity
+        super().save(*args, **kwargs)
 
     class Meta:
         unique_together = ('operation', 'item')
@@ -92,6 +120,12 @@ class ExportOperation(models.Model):
     def __str__(self):
         return f"{self.warehouse.name} -beneficiary : {self.beneficiary} - {self.operation_date}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['warehouse', 'operation_date', 'id'], name='export_warehouse_date_idx'),
+            models.Index(fields=['beneficiary', 'operation_date', 'id'], name='export_beneficiary_date_idx'),
+        ]
+
 class ExportOperationItem(models.Model):
 
     operation = models.ForeignKey(ExportOperation, related_name='items', on_delete=models.PROTECT)
@@ -105,21 +139,25 @@ class ExportOperationItem(models.Model):
         default=0.00,
         help_text="Total quantity of this item returned against this dispatch line."
     )
+    effective_quantity = models.DecimalField(
+        _("Effective Quantity"),
+        max_digits=15,
+        decimal_places=2,
+        help_text="The quantity after the latest modification; equals quantity until the line is modified."
+    )
+
+    objects = OperationLineQuerySet.as_manager()
 
     @property
     def returnable_quantity(self):
         """Calculates the remaining quantity that can be returned."""
         return self.quantity - self.returned_quantity
 
-    @property
-    def effective_quantity(self):
-        """
-        Returns the most up-to-date quantity after all modifications.
-        """
-        last_modification = self.modifications.order_by('-operation_date').first()
-        if last_modification:
-            return last_modification.new_quantity
-        return self.quantity
+    def save(self, *args, **kwargs):
+        if self.effective_quantity is None:
+            self.effective_quantity = self.quantity
+        super().save(*args, **kwargs)
+
     class Meta:
         unique_together = ('operation', 'item')
 
@@ -247,6 +285,11 @@ class DamageOperation(models.Model):
     def __str__(self):
         return f"{self.warehouse.name} - {self.operation_date}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['warehouse', 'operation_date', 'id'], name='damage_warehouse_date_idx'),
+        ]
+
 class DamageOperationItem(models.Model):
     operation = models.ForeignKey(DamageOperation, related_name='items', on_delete=models.PROTECT)
     item = models.ForeignKey(Item, on_delete=models.PROTECT, verbose_name=_("item"))
@@ -293,27 +336,110 @@ class TransferOperationItem(models.Model):
     class Meta:
         unique_together = ('operation', 'item')
 
+class AttachmentBlob(models.Model):
+    """
+    One stored copy of an attachment's content, named after its SHA-256 digest.
+
+    In the 'content' attachment storage mode every OperationAttachment with the same
+    content points at the same blob. ref_count is the number of those attachments;
+    blobs that drop to zero are removed by the gc_attachment_blobs command.
+    """
+
+    @staticmethod
+    def path_for(sha256, filename):
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join("operation_attachments", "blobs", sha256[:2], sha256[2:4], f"{sha256}{extension}")
+
+    @staticmethod
+    def incoming_path_for(filename):
+        """Where an upload is copied while it is hashed, before it is renamed by its digest."""
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join("operation_attachments", "blobs", "incoming", f"{uuid.uuid4().hex}{extension}")
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(_("File"), max_length=255)
+    size = models.PositiveBigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    last_staged_at = models.DateTimeField(
+        help_text=_("Last time an upload resolved to this blob; unreferenced blobs are kept for a grace period after it."),
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+    class Meta:
+        verbose_name = _("Attachment Blob")
+        verbose_name_plural = _("Attachment Blobs")
+        indexes = [
+            models.Index(fields=['ref_count', 'last_staged_at'], name='attachment_blob_gc_idx'),
+        ]
+
+
+class AttachmentUpload(models.Model):
+    """
+    A file sent in byte ranges before the operation it belongs to is created.
+
+    The ranges are appended to a staging file under ATTACHMENT_UPLOAD_DIR. Once every byte
+    has arrived, the token can be listed in uploaded_attachments of any operation, which
+    claims the upload and moves the file into attachment storage.
+    """
+
+    class Status(models.TextChoices):
+        UPLOADING = 'uploading', _('Uploading')
+        COMPLETE = 'complete', _('Complete')
+        CLAIMED = 'claimed', _('Claimed')
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='attachment_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField(help_text=_("Total size of the file in bytes."))
+    received = models.PositiveBigIntegerField(default=0, help_text=_("Bytes stored so far; the next range starts here."))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.UPLOADING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    @property
+    def staging_path(self):
+        return os.path.join(settings.ATTACHMENT_UPLOAD_DIR, f"{self.token}.part")
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
+
+    class Meta:
+        verbose_name = _("Attachment Upload")
+        verbose_name_plural = _("Attachment Uploads")
+        indexes = [
+            models.Index(fields=['expires_at'], name='attachment_upload_expiry_idx'),
+        ]
+
+
 class OperationAttachment(models.Model):
 
-    def operation_attachment_path(instance, filename):
-        if instance.supply_operation_id:
-            operation_type = "supply"
-        elif instance.export_operation_id:
-            operation_type = "export"
-        elif instance.return_supply_operation_id:
-            operation_type = "return_supply"
-        elif instance.return_dispatch_operation_id:
-            operation_type = "return_dispatch"
-        elif instance.damage_operation_id:
-            operation_type = "damage"
-        elif instance.transfer_operation_id:
-            operation_type = "transfer"
-        else:
-            operation_type = "unknown"
+    # The operation foreign key of an attachment and the folder its files go to.
+    OPERATION_TYPES = {
+        'supply_operation': "supply",
+        'export_operation': "export",
+        'return_supply_operation': "return_supply",
+        'return_dispatch_operation': "return_dispatch",
+        'damage_operation': "damage",
+        'transfer_operation': "transfer",
+    }
+
+    @classmethod
+    def path_for(cls, operation_field, filename):
+        operation_type = cls.OPERATION_TYPES.get(operation_field, "unknown")
         today = datetime.now().strftime("%Y/%m/%d")
 
         return os.path.join("operation_attachments", operation_type, today, filename)
 
+    def operation_attachment_path(instance, filename):
+        operation_field = next(
+            (field for field in instance.OPERATION_TYPES if getattr(instance, f'{field}_id')),
+            None,
+        )
+        return OperationAttachment.path_for(operation_field, filename)
+
     supply_operation = models.ForeignKey(SupplyOperation, on_delete=models.CASCADE, related_name='attachments', null=True, blank=True)
     export_operation = models.ForeignKey(ExportOperation, on_delete=models.CASCADE, related_name='attachments', null=True, blank=True)
     return_supply_operation = models.ForeignKey(ReturnSupplyOperation, on_delete=models.CASCADE, related_name='attachments', null=True, blank=True)
@@ -325,6 +451,14 @@ class OperationAttachment(models.Model):
         _("File"),
         upload_to=operation_attachment_path
     )
+    blob = models.ForeignKey(
+        AttachmentBlob,
+        on_delete=models.PROTECT,
+        related_name='attachments',
+        null=True,
+        blank=True,
+        help_text=_("The shared content of the file; empty for files stored under a dated folder."),
+    )
     description = models.CharField(_("Description"), max_length=255, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -386,3 +520,36 @@ class ModifyExportOperation(models.Model):
     @property
     def difference(self):
         return self.new_quantity - self.old_quantity
+
+
+class IdempotencyKey(models.Model):
+    """
+    The response of a create request sent with an Idempotency-Key header.
+    A retry with the same key gets this response back instead of creating the operation again.
+    """
+
+    class Status(models.TextChoices):
+        PROCESSING = 'processing', _('Processing')
+        COMPLETED = 'completed', _('Completed')
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=255)
+    request_fingerprint = models.CharField(max_length=64, help_text=_("SHA-256 of the request payload."))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PROCESSING)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.key} ({self.method} {self.path})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_key_expiry_idx'),
+        ]
@@ -0,0 +1,173 @@
+"""
+Stock movements caused by each kind of operation line.
+
+The signal receivers (one line at a time) and the bulk create paths of the
+serializers build their ledger rows here, so both apply the same signs.
+A `reverse` movement undoes a deleted line and is dated now.
+
+Each movement also carries the SummaryContext of its line (the operation's day and
+counterparties) for the daily movement summary.
+
+LINE_SOURCES describes the same movements as lookups on the line tables, for
+queries that total them in the database.
+"""
+from collections import namedtuple
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.services.movement_summary import SummaryContext
+from inventory.models import StockMovement
+from operations.models import (
+    DamageOperationItem, ExportOperationItem, ModifyExportOperation, ModifySupplyOperation,
+    ReturnDispatchOperationItem, ReturnSupplyOperationItem, SupplyOperationItem, TransferOperationItem,
+)
+
+
+def _movement(warehouse, item, delta, operation_type, source_line_id, timestamp, reverse, **counterparties):
+    context = SummaryContext(timezone.localdate(timestamp), lines=-1 if reverse else 1, **counterparties)
+    if reverse:
+        delta = -delta
+        timestamp = None
+    movement = StockMovement(
+        warehouse=warehouse,
+        item=item,
+        delta=delta,
+        operation_type=operation_type,
+        source_line_id=source_line_id,
+        timestamp=timestamp,
+    )
+    movement.summary_context = context
+    return movement
+
+
+def supply_line_movement(line, reverse=False):
+    operation = line.operation
+    return _movement(
+        operation.warehouse, line.item, line.quantity,
+        StockMovement.OperationType.SUPPLY, line.pk, operation.operation_date, reverse,
+        supplier_id=operation.supplier_id, stations_id=operation.stations_id,
+    )
+
+
+def export_line_movement(line, reverse=False):
+    operation = line.operation
+    return _movement(
+        operation.warehouse, line.item, -line.quantity,
+        StockMovement.OperationType.EXPORT, line.pk, operation.operation_date, reverse,
+        beneficiary_id=operation.beneficiary_id,
+    )
+
+
+def damage_line_movement(line, reverse=False):
+    operation = line.operation
+    return _movement(
+        operation.warehouse, line.item, -line.quantity,
+        StockMovement.OperationType.DAMAGE, line.pk, operation.operation_date, reverse,
+    )
+
+
+def return_supply_line_movement(line, reverse=False):
+    """Goods are returned TO the supplier, so they leave our warehouse."""
+    operation = line.return_operation
+    return _movement(
+        operation.original_operation.warehouse, line.item, -line.returned_quantity,
+        StockMovement.OperationType.RETURN_SUPPLY, line.pk, operation.operation_date, reverse,
+        supplier_id=operation.original_operation.supplier_id, stations_id=operation.original_operation.stations_id,
+    )
+
+
+def return_dispatch_line_movement(line, reverse=False):
+    """Goods are returned FROM the beneficiary, so they come back to our warehouse."""
+    operation = line.return_operation
+    return _movement(
+        operation.original_operation.warehouse, line.item, line.returned_quantity,
+        StockMovement.OperationType.RETURN_DISPATCH, line.pk, operation.operation_date, reverse,
+        beneficiary_id=operation.original_operation.beneficiary_id,
+    )
+
+
+def transfer_line_movements(line, reverse=False):
+    operation = line.operation
+    return [
+        _movement(
+            operation.from_warehouse, line.item, -line.quantity,
+            StockMovement.OperationType.TRANSFER_OUT, line.pk, operation.operation_date, reverse,
+        ),
+        _movement(
+            operation.to_warehouse, line.item, line.quantity,
+            StockMovement.OperationType.TRANSFER_IN, line.pk, operation.operation_date, reverse,
+        ),
+    ]
+
+
+def modification_moves_stock(modification):
+    """
+    A modification that leaves the quantity unchanged records no movement; it is
+    left out of the ledger, the stock and the summaries alike. MODIFICATION_MOVES_STOCK
+    is the same rule as a filter on the modification tables.
+    """
+    return modification.new_quantity != modification.old_quantity
+
+
+MODIFICATION_MOVES_STOCK = ~Q(new_quantity=F('old_quantity'))
+
+
+def supply_modification_movement(modification):
+    """A larger supply quantity adds stock, a smaller one removes it."""
+    line = modification.original_item_line
+    return _movement(
+        line.operation.warehouse, line.item, modification.difference,
+        StockMovement.OperationType.MODIFY_SUPPLY, modification.pk, modification.operation_date, False,
+        supplier_id=line.operation.supplier_id, stations_id=line.operation.stations_id,
+    )
+
+
+def export_modification_movement(modification):
+    """A larger dispatch quantity removes stock, a smaller one gives it back."""
+    line = modification.original_item_line
+    return _movement(
+        line.operation.warehouse, line.item, -modification.difference,
+        StockMovement.OperationType.MODIFY_EXPORT, modification.pk, modification.operation_date, False,
+        beneficiary_id=line.operation.beneficiary_id,
+    )
+
+
+Type = StockMovement.OperationType
+
+# The lookups of each kind of line, relative to its model: its day, warehouse, item and
+# counterparties (None when it has none), its quantity with the sign of its movement, and
+# the filter its rows must match to have a movement at all (None when all of them do).
+LineSource = namedtuple(
+    'LineSource',
+    ['operation_type', 'model', 'date', 'warehouse', 'item', 'quantity', 'sign', 'supplier', 'stations', 'beneficiary',
+     'condition'],
+    defaults=[None],
+)
+
+LINE_SOURCES = [
+    LineSource(Type.SUPPLY, SupplyOperationItem, 'operation__operation_date', 'operation__warehouse', 'item',
+               F('quantity'), 1, 'operation__supplier', 'operation__stations', None),
+    LineSource(Type.EXPORT, ExportOperationItem, 'operation__operation_date', 'operation__warehouse', 'item',
+               F('quantity'), -1, None, None, 'operation__beneficiary'),
+    LineSource(Type.DAMAGE, DamageOperationItem, 'operation__operation_date', 'operation__warehouse', 'item',
+               F('quantity'), -1, None, None, None),
+    LineSource(Type.RETURN_SUPPLY, ReturnSupplyOperationItem, 'return_operation__operation_date',
+               'return_operation__original_operation__warehouse', 'item', F('returned_quantity'), -1,
+               'return_operation__original_operation__supplier', 'return_operation__original_operation__stations',
+               None),
+    LineSource(Type.RETURN_DISPATCH, ReturnDispatchOperationItem, 'return_operation__operation_date',
+               'return_operation__original_operation__warehouse', 'item', F('returned_quantity'), 1,
+               None, None, 'return_operation__original_operation__beneficiary'),
+    LineSource(Type.TRANSFER_OUT, TransferOperationItem, 'operation__operation_date', 'operation__from_warehouse',
+               'item', F('quantity'), -1, None, None, None),
+    LineSource(Type.TRANSFER_IN, TransferOperationItem, 'operation__operation_date', 'operation__to_warehouse',
+               'item', F('quantity'), 1, None, None, None),
+    LineSource(Type.MODIFY_SUPPLY, ModifySupplyOperation, 'operation_date', 'original_item_line__operation__warehouse',
+               'original_item_line__item', F('new_quantity') - F('old_quantity'), 1,
+               'original_item_line__operation__supplier', 'original_item_line__operation__stations', None,
+               MODIFICATION_MOVES_STOCK),
+    LineSource(Type.MODIFY_EXPORT, ModifyExportOperation, 'operation_date', 'original_item_line__operation__warehouse',
+               'original_item_line__item', F('new_quantity') - F('old_quantity'), -1,
+               None, None, 'original_item_line__operation__beneficiary', MODIFICATION_MOVES_STOCK),
+]
@@ -1,11 +1,20 @@
 import json
+import uuid
 from marshmallow import ValidationError
 from rest_framework import serializers
-from django.db import transaction
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
 from accounts.models import Supplier
 from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Stations
+from core.services.mixins import managed_warehouse_ids
+from core.services.retry import TransactionRetriesExhausted, atomic_with_retry, is_retryable
+from operations.attachments import discard_staged_attachments, link_attachments_on_commit, stage_attachments
+from core.services.stock import OPTIMISTIC, apply_movements
+from operations.movements import (
+    damage_line_movement, export_line_movement, supply_line_movement, transfer_line_movements)
 from operations.models import (
-    DamageOperation, DamageOperationItem, ExportOperation,
+    AttachmentUpload, DamageOperation, DamageOperationItem, ExportOperation,
     ExportOperationItem, ModifyExportOperation, ModifySupplyOperation, OperationAttachment, ReturnSupplyOperation,
     ReturnSupplyOperationItem, SupplyOperation, SupplyOperationItem ,
     ReturnDispatchOperation,ReturnDispatchOperationItem,
@@ -17,6 +26,41 @@ class OperationAttachmentSerializer(serializers.ModelSerializer):
         fields = ['id', 'file', 'description', 'uploaded_at']
         read_only_fields = ['id', 'uploaded_at']
 
+class AttachmentUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AttachmentUpload
+        fields = ['token', 'filename', 'size', 'received', 'status', 'expires_at']
+        read_only_fields = ['token', 'received', 'status', 'expires_at']
+
+    def validate_size(self, value):
+        if value < 1:
+            raise serializers.ValidationError("The file must not be empty.")
+        if value > settings.ATTACHMENT_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(f"Files larger than {settings.ATTACHMENT_UPLOAD_MAX_SIZE} bytes are not accepted.")
+        return value
+
+
+class AttachmentField(serializers.FileField):
+    """
+    An uploaded file, or the token of a completed chunked upload (api/operations/uploads/)
+    of the requesting user, which is returned as its AttachmentUpload.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            return super().to_internal_value(data)
+        try:
+            token = uuid.UUID(data)
+        except ValueError:
+            raise serializers.ValidationError("Expected a file or an upload token.")
+        upload = AttachmentUpload.objects.filter(
+            token=token, user=self.context['request'].user, status=AttachmentUpload.Status.COMPLETE,
+        ).first()
+        if upload is None:
+            raise serializers.ValidationError(f"No completed upload with token {data}.")
+        return upload
+
+
 class SupplyOperationItemSerializer(serializers.ModelSerializer):
     item_name = serializers.CharField(source='item.name', read_only=True)
     effective_quantity = serializers.DecimalField(
@@ -44,7 +88,7 @@ class SupplyOperationSerializer(serializers.ModelSerializer):
         queryset=Stations.active.all(),
     )
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(allow_empty_file=False, use_url=False),
+        child=AttachmentField(allow_empty_file=False, use_url=False),
         write_only=True,
         required=False )
     
@@ -97,7 +141,7 @@ class SupplyOperationSerializer(serializers.ModelSerializer):
             return value 
         if user.user_type == 'Employee':
 
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -123,21 +167,26 @@ class SupplyOperationSerializer(serializers.ModelSerializer):
         if not item_serializer.is_valid():
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'supply_operation')
         try:
             user = self.context['request'].user
             print(f"validated_data::: {user}")
             with transaction.atomic():
                 supply_operation = SupplyOperation.objects.create(**validated_data)
                 supply_operation.recipient_user = user
-                for item_data in validated_items:
-                    SupplyOperationItem.objects.create(operation=supply_operation, **item_data)
-                for file in uploaded_files:
-                    OperationAttachment.objects.create(
-                        supply_operation=supply_operation, 
-                        file=file
+                lines = SupplyOperationItem.objects.bulk_create([
+                    SupplyOperationItem(
+                        operation=supply_operation,
+                        effective_quantity=item_data['quantity'],
+                        **item_data
                     )
+                    for item_data in validated_items
+                ])
+                apply_movements([supply_line_movement(line) for line in lines])
+                link_attachments_on_commit(staged, 'supply_operation', supply_operation)
                 return supply_operation
         except Exception as e:
+            discard_staged_attachments(staged)
             raise serializers.ValidationError(str(e))
 
 class ExportOperationItemSerializer(serializers.ModelSerializer):
@@ -162,7 +211,7 @@ class ExportOperationSerializer(serializers.ModelSerializer):
     show_attachments = OperationAttachmentSerializer(many=True, read_only=True)
     delivere_user_name =serializers.CharField(source='delivere_user.full_name', read_only=True)
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(allow_empty_file=False, use_url=False),
+        child=AttachmentField(allow_empty_file=False, use_url=False),
         write_only=True,
         required=False )
     beneficiary_name = serializers.CharField(source='beneficiary.name', read_only=True)
@@ -198,7 +247,7 @@ class ExportOperationSerializer(serializers.ModelSerializer):
             return value 
         if user.user_type == 'Employee':
 
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -224,26 +273,65 @@ class ExportOperationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
         
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'export_operation')
         try:
             with transaction.atomic():
                 user = self.context['request'].user
                 export_operation = ExportOperation.objects.create(**validated_data)
                 export_operation.delivere_user = user
 
-                for item_data in validated_items:
-                    ExportOperationItem.objects.create(operation=export_operation, **item_data)
+                lines = ExportOperationItem.objects.bulk_create([
+                    ExportOperationItem(
+                        operation=export_operation,
+                        effective_quantity=item_data['quantity'],
+                        **item_data
+                    )
+                    for item_data in validated_items
+                ])
+                apply_movements([export_line_movement(line) for line in lines])
             
-                for file in uploaded_files:
-                    OperationAttachment.objects.create(export_operation=export_operation, file=file)
+                link_attachments_on_commit(staged, 'export_operation', export_operation)
                 
                 return export_operation
         
         except ValueError as e:
+            discard_staged_attachments(staged)
             raise serializers.ValidationError({'stock_error': str(e)})
         
         except Exception as e:
+            discard_staged_attachments(staged)
             raise serializers.ValidationError(str(e))
 
+def claim_returned_quantity(line_model, original_operation, item, quantity):
+    """
+    Adds `quantity` to the returned_quantity of the original line, refusing more than is returnable.
+    In optimistic mode this is one guarded UPDATE instead of a locked read followed by a save.
+    """
+    lines = line_model.objects.filter(operation=original_operation, item=item)
+    optimistic = settings.STOCK_WRITE_MODE == OPTIMISTIC
+    if optimistic:
+        claimed = lines.filter(returned_quantity__lte=F('quantity') - quantity).update(
+            returned_quantity=F('returned_quantity') + quantity
+        )
+        if claimed:
+            return
+        original_item_line = lines.first()
+    else:
+        original_item_line = lines.select_for_update().first()
+
+    if original_item_line is None:
+        raise serializers.ValidationError(
+            f"Item '{item.name}' was not part of the original supply operation."
+        )
+    if optimistic or quantity > original_item_line.returnable_quantity:
+        raise serializers.ValidationError(
+            f"Cannot return {quantity} of '{item.name}'. "
+            f"Only {original_item_line.returnable_quantity} is available to be returned."
+        )
+    original_item_line.returned_quantity += quantity
+    original_item_line.save()
+
+
 class ReturnSupplyItemSerializer(serializers.ModelSerializer):
     """
     Serializer for the items within a Return Supply operation.
@@ -275,7 +363,7 @@ class ReturnSupplyOperationSerializer(serializers.ModelSerializer):
     
     show_attachments = OperationAttachmentSerializer(many=True, read_only=True)
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(allow_empty_file=False, use_url=False),
+        child=AttachmentField(allow_empty_file=False, use_url=False),
         write_only=True,
         required=False )
         
@@ -311,7 +399,7 @@ class ReturnSupplyOperationSerializer(serializers.ModelSerializer):
             return value 
         if user.user_type == 'Employee':
 
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -338,6 +426,7 @@ class ReturnSupplyOperationSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
 
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'return_supply_operation')
         try:
             with transaction.atomic():
                 user = self.context['request'].user
@@ -351,37 +440,19 @@ class ReturnSupplyOperationSerializer(serializers.ModelSerializer):
                     item_to_return = item_data['item']
                     quantity_to_return = item_data['returned_quantity']
 
-                    try:
-                        original_item_line = SupplyOperationItem.objects.select_for_update().get(
-                            operation=original_operation,
-                            item=item_to_return
-                        )
-
-                    except SupplyOperationItem.DoesNotExist:
-                        raise serializers.ValidationError(
-                            f"Item '{item_to_return.name}' was not part of the original supply operation."
-                        )
-
-                    if quantity_to_return > original_item_line.returnable_quantity:
-                        raise serializers.ValidationError(
-                            f"Cannot return {quantity_to_return} of '{item_to_return.name}'. "
-                            f"Only {original_item_line.returnable_quantity} is available to be returned."
-                        )
+                    claim_returned_quantity(SupplyOperationItem, original_operation, item_to_return, quantity_to_return)
 
                     ReturnSupplyOperationItem.objects.create(
                         return_operation=return_operation,
                         **item_data
                     )
 
-                    original_item_line.returned_quantity += quantity_to_return
-                    original_item_line.save()
-
-                for file in uploaded_files:
-                    OperationAttachment.objects.create(return_supply_operation=return_operation, file=file)
+                link_attachments_on_commit(staged, 'return_supply_operation', return_operation)
                 
                 return return_operation
         
         except Exception as e:
+            discard_staged_attachments(staged)
             raise serializers.ValidationError(str(e))
 
 class ReturnDispatchItemSerializer(serializers.ModelSerializer):
@@ -413,7 +484,7 @@ class ReturnDispatchOperationSerializer(serializers.ModelSerializer):
     original_operation_date = serializers.DateTimeField(source='original_operation.operation_date', read_only=True)
     show_attachments = OperationAttachmentSerializer(many=True, read_only=True)
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(allow_empty_file=False, use_url=False),
+        child=AttachmentField(allow_empty_file=False, use_url=False),
         write_only=True,
         required=False )
     
@@ -448,7 +519,7 @@ class ReturnDispatchOperationSerializer(serializers.ModelSerializer):
             return value 
         if user.user_type == 'Employee':
 
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -473,6 +544,7 @@ class ReturnDispatchOperationSerializer(serializers.ModelSerializer):
         if not item_serializer.is_valid():
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'return_dispatch_operation')
         try:
             with transaction.atomic():
                 user = self.context['request'].user
@@ -487,37 +559,19 @@ class ReturnDispatchOperationSerializer(serializers.ModelSerializer):
                     item_to_return = item_data['item']
                     quantity_to_return = item_data['returned_quantity']
 
-                    try:
-                        original_item_line = ExportOperationItem.objects.select_for_update().get(
-                            operation=original_operation,
-                            item=item_to_return
-                        )
-                    except ExportOperationItem.DoesNotExist:
-                        raise serializers.ValidationError(
-                            f"Item '{item_to_return.name}' was not part of the original supply operation."
-                        )
-
-
-                    if quantity_to_return > original_item_line.returnable_quantity:
-                        raise serializers.ValidationError(
-                            f"Cannot return {quantity_to_return} of '{item_to_return.name}'. "
-                            f"Only {original_item_line.returnable_quantity} is available to be returned."
-                        )
+                    claim_returned_quantity(ExportOperationItem, original_operation, item_to_return, quantity_to_return)
 
                     ReturnDispatchOperationItem.objects.create(
                         return_operation=return_operation,
                         **item_data
                     )
 
-                    original_item_line.returned_quantity += quantity_to_return
-                    original_item_line.save()
-
-                for file in uploaded_files:
-                    OperationAttachment.objects.create(return_dispatch_operation=return_operation, file=file)
+                link_attachments_on_commit(staged, 'return_dispatch_operation', return_operation)
 
                 return return_operation
         
         except Exception as e:
+            discard_staged_attachments(staged)
             print(e)
             raise serializers.ValidationError(str(e))
 
@@ -553,7 +607,7 @@ class DamageOperationSerializer(serializers.ModelSerializer):
 
     show_attachments = OperationAttachmentSerializer(many=True, read_only=True)
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(allow_empty_file=False, use_url=False),
+        child=AttachmentField(allow_empty_file=False, use_url=False),
         write_only=True,
         required=False 
         )
@@ -591,7 +645,7 @@ class DamageOperationSerializer(serializers.ModelSerializer):
             return value 
         if user.user_type == 'Employee':
 
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -619,23 +673,28 @@ class DamageOperationSerializer(serializers.ModelSerializer):
         if not item_serializer.is_valid():
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'damage_operation')
         try:
             with transaction.atomic():
                 user = self.context['request'].user
 
                 damage_operation = DamageOperation.objects.create(**validated_data)
                 damage_operation.recipient_user =user
-                for item_data in validated_items:
-                    DamageOperationItem.objects.create(operation=damage_operation, **item_data)
+                lines = DamageOperationItem.objects.bulk_create([
+                    DamageOperationItem(operation=damage_operation, **item_data)
+                    for item_data in validated_items
+                ])
+                apply_movements([damage_line_movement(line) for line in lines])
 
-                for file in uploaded_files :
-                    OperationAttachment.objects.create(damage_operation = damage_operation, file= file , )
+                link_attachments_on_commit(staged, 'damage_operation', damage_operation)
                 return damage_operation
         
         except ValidationError as e:
+            discard_staged_attachments(staged)
             raise e 
         
         except Exception as e:
+            discard_staged_attachments(staged)
             raise serializers.ValidationError(str(e))
 
 class TransferOperationItemSerializer(serializers.ModelSerializer):
@@ -653,7 +712,7 @@ class TransferOperationSerializer(serializers.ModelSerializer):
     to_warehouse_name = serializers.CharField(source='to_warehouse.name', read_only=True)
     show_attachments = OperationAttachmentSerializer(many=True, read_only=True)
     uploaded_attachments = serializers.ListField(
-        child=serializers.FileField(max_length=100000, allow_empty_file=False, use_url=False),
+        child=AttachmentField(max_length=100000, allow_empty_file=False, use_url=False),
         write_only=True,
         required=False 
     )
@@ -715,57 +774,52 @@ class TransferOperationSerializer(serializers.ModelSerializer):
         if not item_serializer.is_valid():
             raise serializers.ValidationError({'items': item_serializer.errors})
         validated_items = item_serializer.validated_data
+        staged = self.staged_attachments = stage_attachments(uploaded_files, 'transfer_operation')
         try:
-            with transaction.atomic():
-
-                transfer_operation = TransferOperation.objects.create(**validated_data)
-
-                for item_data in validated_items:
-                    item_instance = item_data['item']
-                    quantity_to_transfer = item_data['quantity']
-
-                    try:
-                        source_stock = InventoryWarehouseitem.objects.select_for_update().get(
-                            warehouse=transfer_operation.from_warehouse,
-                            item=item_instance
-                        )
-                    except InventoryWarehouseitem.DoesNotExist:
-                        raise serializers.ValidationError(
-                            f"Item '{item_instance.name}' does not exist in the source warehouse."
-                        )
-
-                    if source_stock.current_quantity < quantity_to_transfer:
-                        raise serializers.ValidationError(
-                            f"Insufficient stock for item '{item_instance.name}' in the source warehouse. "
-                            f"Required: {quantity_to_transfer}, Available: {source_stock.current_quantity}."
-                        )
-                    
-                    source_stock.current_quantity = float(source_stock.current_quantity) - float(quantity_to_transfer)
-                    source_stock.save()
-
-                    destination_stock, created = InventoryWarehouseitem.objects.select_for_update().get_or_create(
-                        warehouse=transfer_operation.to_warehouse,
-                        item=item_instance,
-                        defaults={'opening_balance': 0, 'unit_of_measure': source_stock.unit_of_measure}
-                    )
-                    
-                    
-                    destination_stock.current_quantity = float(destination_stock.current_quantity) + float(quantity_to_transfer)
-                    destination_stock.save()
-
-                    TransferOperationItem.objects.create(
-                        operation=transfer_operation,
-                        item=item_instance,
-                        quantity=quantity_to_transfer
-                    )
-
-                    for file in uploaded_files: 
-                        OperationAttachment.objects.create(transfer_operation=transfer_operation, file = file)
+            return atomic_with_retry(self._create_transfer, validated_data, validated_items, staged)
+        except ValueError as e:
+            discard_staged_attachments(staged)
+            raise serializers.ValidationError(str(e))
+        except OperationalError as e:
+            discard_staged_attachments(staged)
+            # Inside an enclosing transaction the error is left for the outer retry.
+            if is_retryable(e) and not connection.in_atomic_block:
+                raise TransactionRetriesExhausted() from e
+            raise
+        except Exception:
+            discard_staged_attachments(staged)
+            raise
+
+    def _create_transfer(self, validated_data, validated_items, staged):
+        """
+        Both sides of every line are applied together: the affected stock rows of the
+        source and the destination are locked in one ordered SELECT ... FOR UPDATE, so
+        opposite transfers between the same warehouses cannot deadlock each other.
+        """
+        transfer_operation = TransferOperation.objects.create(**validated_data)
+        lines = TransferOperationItem.objects.bulk_create([
+            TransferOperationItem(operation=transfer_operation, **item_data)
+            for item_data in validated_items
+        ])
+
+        # Rows created in the destination take the unit of measure of the source.
+        units = dict(
+            InventoryWarehouseitem.objects.filter(
+                warehouse=transfer_operation.from_warehouse,
+                item__in=[line.item for line in lines],
+            ).values_list('item_id', 'unit_of_measure')
+        )
+        apply_movements(
+            [movement for line in lines for movement in transfer_line_movements(line)],
+            stock_defaults={
+                (transfer_operation.to_warehouse.pk, item_id): {'opening_balance': 0, 'unit_of_measure': unit}
+                for item_id, unit in units.items()
+            },
+        )
 
-                return transfer_operation
+        link_attachments_on_commit(staged, 'transfer_operation', transfer_operation)
 
-        except Exception as e:
-            raise serializers.ValidationError(str(e))
+        return transfer_operation
 
 class ModifySupplyOperationSerializer(serializers.ModelSerializer):
     user_name =serializers.CharField(source='user.name', read_only=True)
@@ -1,20 +1,37 @@
-
-from decimal import Decimal
-from django.db import transaction
-from django.db.models.signals import post_save, post_delete , pre_migrate
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from .models import (
+    DamageOperation,
     DamageOperationItem,
+    ExportOperation,
     ModifyExportOperation,
     ModifySupplyOperation,
+    OperationAttachment,
     SupplyOperationItem, 
     ExportOperationItem,
+    ReturnSupplyOperation,
     ReturnSupplyOperationItem, 
+    ReturnDispatchOperation,
     ReturnDispatchOperationItem,
-    TransferOperationItem 
+    SupplyOperation,
+    TransferOperation,
+)
+from .movements import (
+    damage_line_movement,
+    export_line_movement,
+    export_modification_movement,
+    modification_moves_stock,
+    return_dispatch_line_movement,
+    return_supply_line_movement,
+    supply_line_movement,
+    supply_modification_movement,
 )
-from inventory.models import InventoryWarehouseitem
+from .attachments import add_blob_references
+from accounts.models import Beneficiary, Supplier
+from core.services import data_versions
+from core.services.stock import apply_movements
+from inventory.models import InventoryWarehouse, InventoryWarehouseitem, Item, Stations
 
 
 @receiver(post_save, sender=SupplyOperationItem)
@@ -22,18 +39,8 @@ def add_stock_on_supply(sender, instance, created, **kwargs):
     """
     Signal to INCREASE stock quantity after a SupplyOperationItem is created.
     """
-    try:
-        if created:
-                with transaction.atomic():
-                    stock, _ = InventoryWarehouseitem.objects.get_or_create(
-                        warehouse=instance.operation.warehouse,
-                        item=instance.item
-                    ) 
-                    stock.current_quantity = float(stock.current_quantity) + float(instance.quantity)
-                    stock.save()
-    except Exception as e :
-        raise e
-    
+    if created:
+        apply_movements([supply_line_movement(instance)])
 
 
 @receiver(post_delete, sender=SupplyOperationItem)
@@ -42,16 +49,7 @@ def remove_stock_on_supply_delete(sender, instance, **kwargs):
     Signal to DECREASE stock quantity if a SupplyOperationItem is deleted.
     (This corrects the stock if an operation is undone).
     """
-    try :
-        with transaction.atomic():
-            stock = InventoryWarehouseitem.objects.get(
-                warehouse=instance.operation.warehouse,
-                item=instance.item
-            )
-            stock.current_quantity = float(stock.current_quantity) - float(instance.quantity)
-            stock.save()
-    except Exception as e :
-        raise e
+    apply_movements([supply_line_movement(instance, reverse=True)])
 
 @receiver(post_save, sender=ExportOperationItem)
 def remove_stock_on_dispatch(sender, instance, created, **kwargs):
@@ -59,16 +57,7 @@ def remove_stock_on_dispatch(sender, instance, created, **kwargs):
     Signal to DECREASE stock quantity after an ExportOperationItem is created.
     """
     if created:
-        with transaction.atomic():
-            stock, _ = InventoryWarehouseitem.objects.get_or_create(
-                warehouse=instance.operation.warehouse,
-                item=instance.item
-            )
-            if stock.current_quantity < instance.quantity:
-                raise ValueError(f"Insufficient stock for item '{instance.item.name}'. Cannot export.")
-            
-            stock.current_quantity = float(stock.current_quantity) - float(instance.quantity)
-            stock.save()
+        apply_movements([export_line_movement(instance)])
 
 @receiver(post_delete, sender=ExportOperationItem)
 def add_stock_on_dispatch_delete(sender, instance, **kwargs):
@@ -76,13 +65,7 @@ def add_stock_on_dispatch_delete(sender, instance, **kwargs):
     Signal to INCREASE stock quantity if an ExportOperationItem is deleted.
     (This corrects the stock if an operation is undone).
     """
-    with transaction.atomic():
-        stock = InventoryWarehouseitem.objects.get(
-            warehouse=instance.operation.warehouse,
-            item=instance.item
-        )
-        stock.current_quantity = float(stock.current_quantity) - float(instance.quantity)
-        stock.save()
+    apply_movements([export_line_movement(instance, reverse=True)])
 
 
 @receiver(post_save, sender=ReturnSupplyOperationItem)
@@ -92,18 +75,7 @@ def remove_stock_on_return_supply(sender, instance, created, **kwargs):
     (Goods are returned TO the supplier, so they leave our warehouse).
     """
     if created:
-        with transaction.atomic():
-            warehouse = instance.return_operation.original_operation.warehouse
-            stock = InventoryWarehouseitem.objects.get(
-                warehouse=warehouse,
-                item=instance.item
-            )
-            
-            if stock.current_quantity < instance.returned_quantity:
-                raise ValueError(f"Insufficient stock for item '{instance.item.name}' to return.")
-
-            stock.current_quantity = float(stock.current_quantity) - float(instance.returned_quantity)
-            stock.save()
+        apply_movements([return_supply_line_movement(instance)])
 
 @receiver(post_delete, sender=ReturnSupplyOperationItem)
 def add_stock_on_return_supply_delete(sender, instance, **kwargs):
@@ -111,14 +83,7 @@ def add_stock_on_return_supply_delete(sender, instance, **kwargs):
     Signal to INCREASE stock quantity if a ReturnSupplyOperationItem is deleted.
     (Undoes the return).
     """
-    with transaction.atomic():
-        warehouse = instance.return_operation.original_operation.warehouse
-        stock = InventoryWarehouseitem.objects.get(
-            warehouse=warehouse,
-            item=instance.item
-        )
-        stock.current_quantity = float(stock.current_quantity) + float(instance.returned_quantity)
-        stock.save()
+    apply_movements([return_supply_line_movement(instance, reverse=True)])
 
 
 @receiver(post_save, sender=ReturnDispatchOperationItem)
@@ -128,14 +93,7 @@ def add_stock_on_return_dispatch(sender, instance, created, **kwargs):
     (Goods are returned FROM the beneficiary, so they come back to our warehouse).
     """
     if created:
-        with transaction.atomic():
-            warehouse = instance.return_operation.original_operation.warehouse
-            stock, _ = InventoryWarehouseitem.objects.get_or_create(
-                warehouse=warehouse,
-                item=instance.item
-            )
-            stock.current_quantity = float(stock.current_quantity) + float(instance.returned_quantity)
-            stock.save()
+        apply_movements([return_dispatch_line_movement(instance)])
 
 @receiver(post_delete, sender=ReturnDispatchOperationItem)
 def remove_stock_on_return_dispatch_delete(sender, instance, **kwargs):
@@ -143,31 +101,16 @@ def remove_stock_on_return_dispatch_delete(sender, instance, **kwargs):
     Signal to DECREASE stock quantity if a ReturnDispatchOperationItem is deleted.
     (Undoes the return).
     """
-    with transaction.atomic():
-        warehouse = instance.return_operation.original_operation.warehouse
-        stock = InventoryWarehouseitem.objects.get(
-            warehouse=warehouse,
-            item=instance.item
-        )
-        stock.current_quantity = float(stock.current_quantity) - float(instance.returned_quantity)
-        stock.save()
+    apply_movements([return_dispatch_line_movement(instance, reverse=True)])
 
 
 @receiver(post_save, sender=DamageOperationItem)
-def remove_stock_on_damage(sender, instance, **kwargs):
+def remove_stock_on_damage(sender, instance, created, **kwargs):
     """
-    Signal to DECREASE stock quantity if a item is damage.
-    (This corrects the stock if an operation is undone).
+    Signal to DECREASE stock quantity after a DamageOperationItem is created.
     """
-    with transaction.atomic():
-        stock = InventoryWarehouseitem.objects.get(
-            warehouse=instance.operation.warehouse,
-            item=instance.item
-        )
-        if stock.current_quantity < instance.quantity:
-            raise ValueError(f"Insufficient stock for item '{instance.item.name}' to mark as damaged.")
-        stock.current_quantity = float(stock.current_quantity) - float(instance.quantity)
-        stock.save()
+    if created:
+        apply_movements([damage_line_movement(instance)])
 
 
 
@@ -175,40 +118,78 @@ def remove_stock_on_damage(sender, instance, **kwargs):
 
 @receiver(post_save, sender=ModifySupplyOperation)
 def update_stock_on_supply_modification(sender, instance, created, **kwargs):
-    if created:
+    if created and modification_moves_stock(instance):
+        apply_movements([supply_modification_movement(instance)])
 
-        try: 
-            with transaction.atomic() :
-                warehouse = instance.original_item_line.operation.warehouse
-                item = instance.original_item_line.item
-                
-                stock, _ = InventoryWarehouseitem.objects.get_or_create(
-                    warehouse=warehouse,
-                    item=item
-                )
-                if stock.current_quantity < instance.new_quantity:
-                    raise ValueError(f"Insufficient stock for item '{instance.original_item_line.item.name}' to return.")
-
-                stock.current_quantity = float(stock.current_quantity) + float(instance.difference)
-                stock.save()
-        except Exception as e:
-            raise e
 @receiver(post_save, sender=ModifyExportOperation)
 def update_stock_on_export_modification(sender, instance, created, **kwargs):
-    if created:
-        try: 
-            with transaction.atomic() :
-                warehouse = instance.original_item_line.operation.warehouse
-                item = instance.original_item_line.item
-                
-                stock, _ = InventoryWarehouseitem.objects.get_or_create(
-                    warehouse=warehouse,
-                    item=item
-                )
-                if stock.current_quantity < instance.new_quantity:
-                    raise ValueError(f"Insufficient stock for item '{instance.original_item_line.item.name}' to return.")
-
-                stock.current_quantity = float(stock.current_quantity) + float(instance.difference)
-                stock.save()
-        except Exception as e:
-            raise e
\ No newline at end of file
+    if created and modification_moves_stock(instance):
+        apply_movements([export_modification_movement(instance)])
+
+
+@receiver([post_save, post_delete], sender=ModifySupplyOperation)
+@receiver([post_save, post_delete], sender=ModifyExportOperation)
+def refresh_line_effective_quantity(sender, instance, **kwargs):
+    """
+    Keeps the stored effective_quantity of the modified line equal to its latest modification.
+    """
+    line_model = sender._meta.get_field('original_item_line').related_model
+    line_model.objects.filter(pk=instance.original_item_line_id).refresh_effective_quantity()
+
+
+@receiver(post_save, sender=OperationAttachment)
+def reference_attachment_blob(sender, instance, created, **kwargs):
+    """
+    Counts an attachment saved one by one against its blob; bulk linking counts its own.
+    """
+    if created and instance.blob_id:
+        add_blob_references([instance.blob_id])
+
+
+@receiver(post_delete, sender=OperationAttachment)
+def release_attachment_blob(sender, instance, **kwargs):
+    """
+    Drops the reference of a deleted attachment, including one deleted with its operation.
+    """
+    if instance.blob_id:
+        add_blob_references([instance.blob_id], step=-1)
+
+
+@receiver([post_save, post_delete], sender=SupplyOperation)
+@receiver([post_save, post_delete], sender=ExportOperation)
+@receiver([post_save, post_delete], sender=DamageOperation)
+@receiver([post_save, post_delete], sender=TransferOperation)
+@receiver([post_save, post_delete], sender=ReturnSupplyOperation)
+@receiver([post_save, post_delete], sender=ReturnDispatchOperation)
+def bump_report_versions_on_operation_change(sender, instance, **kwargs):
+    """
+    Invalidates the cached reports of the warehouses an operation belongs to.
+    Stock changes of its lines are covered by record_movements; this catches edits such as a new date.
+    """
+    if sender is TransferOperation:
+        warehouse_ids = [instance.from_warehouse_id, instance.to_warehouse_id]
+    elif sender in (ReturnSupplyOperation, ReturnDispatchOperation):
+        warehouse_ids = [instance.original_operation.warehouse_id]
+    else:
+        warehouse_ids = [instance.warehouse_id]
+    data_versions.bump_warehouses_on_commit(warehouse_ids)
+
+
+@receiver(post_save, sender=InventoryWarehouseitem)
+def bump_report_versions_on_stock_row_change(sender, instance, **kwargs):
+    """
+    Opening balances and units are shown by the status reports without going through the ledger.
+    """
+    data_versions.bump_warehouses_on_commit([instance.warehouse_id])
+
+
+@receiver([post_save, post_delete], sender=InventoryWarehouse)
+@receiver([post_save, post_delete], sender=Item)
+@receiver([post_save, post_delete], sender=Stations)
+@receiver([post_save, post_delete], sender=Supplier)
+@receiver([post_save, post_delete], sender=Beneficiary)
+def bump_report_versions_on_catalog_change(sender, instance, **kwargs):
+    """
+    Reports show these names, so renaming one invalidates every cached report.
+    """
+    data_versions.bump_on_commit([data_versions.ALL, data_versions.CATALOG])
@@ -1,3 +1,202 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import Beneficiary, Supplier, User
+from core.services.stock import InsufficientStockError
+from inventory.models import (
+    DailyMovementSummary, InventoryWarehouse, InventoryWarehouseitem, Item, Stations, StockMovement,
+)
+from operations.models import (
+    DamageOperation, DamageOperationItem, ExportOperation, ExportOperationItem, ModifyExportOperation,
+    ModifySupplyOperation, SupplyOperation, SupplyOperationItem,
+)
+from operations.serializers import SupplyOperationSerializer
+
+
+Type = StockMovement.OperationType
+
+
+class StockSignalTests(TestCase):
+    """
+    The operation line signals apply their movements through core.services.stock.apply_movements.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = InventoryWarehouse.objects.create(name='Main', phone_warehouse='1')
+        cls.item = Item.objects.create(name='Diesel')
+        cls.supplier = Supplier.objects.create(name='Supplier')
+        cls.beneficiary = Beneficiary.objects.create(name='Beneficiary')
+        cls.stations = Stations.objects.create(name='Station', location='North')
+
+    def setUp(self):
+        self.now = timezone.now()
+
+    def quantity(self):
+        row = InventoryWarehouseitem.objects.filter(warehouse=self.warehouse, item=self.item).first()
+        return row and row.current_quantity
+
+    def supply(self, quantity):
+        operation = SupplyOperation.objects.create(
+            warehouse=self.warehouse, supplier=self.supplier, stations=self.stations,
+            operation_date=self.now, delivere_job_name='Driver',
+        )
+        return SupplyOperationItem.objects.create(operation=operation, item=self.item, quantity=Decimal(quantity))
+
+    def export(self, quantity):
+        operation = ExportOperation.objects.create(
+            warehouse=self.warehouse, beneficiary=self.beneficiary, operation_date=self.now,
+            recipient_name='Recipient', recipient_job_number='1',
+            date_transfer=self.now, date_actual_transfer=self.now,
+        )
+        return ExportOperationItem.objects.create(operation=operation, item=self.item, quantity=Decimal(quantity))
+
+    def test_supply_line_adds_stock(self):
+        line = self.supply('40.50')
+
+        self.assertEqual(self.quantity(), Decimal('40.50'))
+        movement = StockMovement.objects.get()
+        self.assertEqual(
+            (movement.operation_type, movement.delta, movement.source_line_id),
+            (Type.SUPPLY, Decimal('40.50'), line.pk),
+        )
+
+    def test_deleting_a_supply_line_reverses_it(self):
+        line = self.supply('40')
+
+        line.delete()
+
+        self.assertEqual(self.quantity(), Decimal('0'))
+        self.assertEqual(
+            sorted(StockMovement.objects.values_list('delta', flat=True)), [Decimal('-40'), Decimal('40')],
+        )
+
+    def test_export_line_removes_stock(self):
+        self.supply('40')
+
+        self.export('15')
+
+        self.assertEqual(self.quantity(), Decimal('25'))
+
+    def test_export_beyond_stock_is_refused(self):
+        self.supply('10')
+
+        with self.assertRaises(InsufficientStockError):
+            self.export('10.01')
+
+        self.assertEqual(self.quantity(), Decimal('10'))
+        self.assertFalse(StockMovement.objects.filter(operation_type=Type.EXPORT).exists())
+
+    def test_deleting_an_export_line_gives_the_stock_back(self):
+        self.supply('10')
+        line = self.export('4')
+
+        line.delete()
+
+        self.assertEqual(self.quantity(), Decimal('10'))
+
+    def test_damage_line_removes_stock(self):
+        self.supply('10')
+        operation = DamageOperation.objects.create(
+            warehouse=self.warehouse, operation_date=self.now, delivere_job_name='Driver',
+        )
+
+        DamageOperationItem.objects.create(operation=operation, item=self.item, quantity=Decimal('3'))
+
+        self.assertEqual(self.quantity(), Decimal('7'))
+
+    def test_supply_modification_applies_the_difference(self):
+        line = self.supply('10')
+
+        ModifySupplyOperation.objects.create(
+            original_item_line=line, operation_date=self.now, reason='Recount',
+            old_quantity=Decimal('10'), new_quantity=Decimal('12.50'),
+        )
+
+        self.assertEqual(self.quantity(), Decimal('12.50'))
+        self.assertEqual(StockMovement.objects.filter(operation_type=Type.MODIFY_SUPPLY).get().delta, Decimal('2.50'))
+
+    def test_export_modification_applies_the_difference(self):
+        self.supply('10')
+        line = self.export('4')
+
+        ModifyExportOperation.objects.create(
+            original_item_line=line, operation_date=self.now, reason='Recount',
+            old_quantity=Decimal('4'), new_quantity=Decimal('7'),
+        )
+
+        self.assertEqual(self.quantity(), Decimal('3'))
+
+    def test_unchanged_modification_records_no_movement(self):
+        line = self.supply('10')
+
+        ModifySupplyOperation.objects.create(
+            original_item_line=line, operation_date=self.now, reason='Recount',
+            old_quantity=Decimal('10'), new_quantity=Decimal('10'),
+        )
+
+        self.assertFalse(StockMovement.objects.filter(operation_type=Type.MODIFY_SUPPLY).exists())
+        self.assertFalse(DailyMovementSummary.objects.filter(operation_type=Type.MODIFY_SUPPLY).exists())
+
+    def test_lines_are_counted_in_the_daily_summary(self):
+        self.supply('10')
+        self.supply('5')
+        self.export('3')
+
+        summary = {
+            row.operation_type: (row.quantity, row.count)
+            for row in DailyMovementSummary.objects.filter(warehouse=self.warehouse, item=self.item)
+        }
+        self.assertEqual(summary[Type.SUPPLY], (Decimal('15'), 2))
+        self.assertEqual(summary[Type.EXPORT], (Decimal('-3'), 1))
+
+
+@override_settings(BULK_OPERATIONS_CHUNK_SIZE=1)
+class BulkOperationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'x', first_name='A', last_name='B')
+        cls.warehouse = InventoryWarehouse.objects.create(name='Main', phone_warehouse='1')
+        cls.item = Item.objects.create(name='Diesel')
+        cls.supplier = Supplier.objects.create(name='Supplier')
+        cls.stations = Stations.objects.create(name='Station', location='North')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def supply_row(self, quantity):
+        return {'type': 'supply', 'data': {
+            'warehouse': self.warehouse.pk, 'supplier': self.supplier.pk, 'stations': self.stations.pk,
+            'operation_date': '2025-01-05T10:00:00Z', 'delivere_job_name': 'Driver',
+            'operation_statement': 's', 'operation_descrabtion': 'd',
+            'items': [{'item': self.item.pk, 'quantity': quantity}],
+        }}
+
+    def test_database_error_is_reported_on_its_row(self):
+        create = SupplyOperationSerializer.create
+        calls = []
+
+        def failing_second_create(serializer, validated_data):
+            calls.append(1)
+            if len(calls) == 2:
+                raise IntegrityError('simulated')
+            return create(serializer, validated_data)
+
+        rows = [self.supply_row('1'), self.supply_row('2'), self.supply_row('3')]
+        with mock.patch.object(SupplyOperationSerializer, 'create', failing_second_create):
+            response = self.client.post('/api/operations/bulk/', {'operations': rows}, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertIn('errors', response.data['results'][1])
+        self.assertEqual(
+            [result.get('id') for result in response.data['results'] if 'id' in result],
+            list(SupplyOperation.objects.order_by('pk').values_list('pk', flat=True)),
+        )
@@ -14,5 +14,9 @@ router.register(r'damage', views.DamageOperationViewSet, basename='damages')
 router.register(r'transfer', views.TransferOperationViewSet, basename='transfers')
 
 urlpatterns = [
+    path('api/operations/metrics/', views.OperationMetricsView.as_view(), name='operation_metrics'),
+    path('api/operations/uploads/', views.AttachmentUploadView.as_view(), name='attachment_uploads'),
+    path('api/operations/uploads/<uuid:token>/', views.AttachmentUploadDetailView.as_view(), name='attachment_upload_detail'),
+    path('api/operations/bulk/', views.BulkOperationView.as_view(), name='bulk_operations'),
     path('api/operations/', include(router.urls)),
 ]
@@ -1,17 +1,36 @@
 from .models import (
-    DamageOperation, ModifyExportOperation, ModifySupplyOperation, ReturnDispatchOperation, ReturnSupplyOperation,
+    AttachmentUpload, DamageOperation, ModifyExportOperation, ModifySupplyOperation, ReturnDispatchOperation, ReturnSupplyOperation,
     SupplyOperation , ExportOperation, TransferOperation)
-from .serializers import (  DamageOperationSerializer, ModifyExportOperationSerializer, ModifySupplyOperationSerializer, ReturnDispatchOperationSerializer,
+from .serializers import (  AttachmentUploadSerializer, DamageOperationSerializer, ModifyExportOperationSerializer, ModifySupplyOperationSerializer, ReturnDispatchOperationSerializer,
                             ReturnSupplyOperationSerializer, SupplyOperationSerializer ,
                             ExportOperationSerializer, TransferOperationSerializer)
-from rest_framework import viewsets
+import json
+import logging
+import re
+
+from rest_framework import serializers, status, viewsets
 from rest_framework.parsers import MultiPartParser, FormParser ,JSONParser
-from rest_framework.permissions import IsAuthenticated
-from core.services.mixins import UserPermissionsMixin
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from core.services import metrics
+from core.services.mixins import UserPermissionsMixin, managed_warehouse_ids
+from operations.attachments import (
+    UploadRangeError, delete_upload_file, discard_staged_attachments, upload_expiry, write_upload_range,
+)
+from operations.idempotency import IdempotentCreateMixin, idempotent_response
+from django.conf import settings
+from django.db import DatabaseError, transaction
 from django.db.models import Q
+from django.shortcuts import get_object_or_404
+
+from core.services.retry import TransactionRetriesExhausted
+
 
+logger = logging.getLogger(__name__)
 
-class SupplyOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+
+class SupplyOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing supply operations.
     
@@ -26,12 +45,12 @@ class SupplyOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
 
     serializer_class = SupplyOperationSerializer
 
-    parser_classes = [ MultiPartParser, FormParser]
+    parser_classes = [ MultiPartParser, FormParser, JSONParser]
 
 
 
 
-class ExportOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class ExportOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing Export operations.
     
@@ -44,7 +63,7 @@ class ExportOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     serializer_class = ExportOperationSerializer
 
 
-class ReturnSupplyOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class ReturnSupplyOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing returns against supply operations.
     """
@@ -54,7 +73,7 @@ class ReturnSupplyOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     serializer_class = ReturnSupplyOperationSerializer
 
 
-class ReturnDispatchOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class ReturnDispatchOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing returns against supply operations.
     """
@@ -65,7 +84,7 @@ class ReturnDispatchOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet)
     serializer_class = ReturnDispatchOperationSerializer
 
 
-class DamageOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class DamageOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing returns against supply operations.
     """
@@ -74,7 +93,7 @@ class DamageOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
     serializer_class = DamageOperationSerializer
     permission_classes  = [IsAuthenticated]
 
-class TransferOperationViewSet(UserPermissionsMixin, viewsets.ModelViewSet):
+class TransferOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     """
     API endpoint for creating and viewing transfer operations.
     Permissions are handled specially for this view to check both
@@ -95,28 +114,281 @@ class TransferOperationViewSet(UserPermissionsMixin, viewsets.ModelViewSet):
             return queryset
 
         if user.user_type == 'Employee':
-            managed_warehouses_qs = user.managed_warehouses.all()
-            if not managed_warehouses_qs.exists():
+            warehouse_ids = sorted(managed_warehouse_ids(self.request))
+            if not warehouse_ids:
                 return queryset.none()
             
             return queryset.filter(
-                Q(from_warehouse__in=managed_warehouses_qs) | 
-                Q(to_warehouse__in=managed_warehouses_qs)
+                Q(from_warehouse__in=warehouse_ids) | 
+                Q(to_warehouse__in=warehouse_ids)
             )
         
         return queryset.none()
     
 
-class ModifySupplyOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class ModifySupplyOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     queryset = ModifySupplyOperation.objects.all()
-    warehouse_field_lookup = 'original_item_line__original_operation__warehouse__in'
+    warehouse_field_lookup = 'original_item_line__operation__warehouse__in'
     serializer_class = ModifySupplyOperationSerializer
     permission_classes  = [IsAuthenticated]
 
-class ModifyExportOperationViewSet(UserPermissionsMixin,viewsets.ModelViewSet):
+class ModifyExportOperationViewSet(IdempotentCreateMixin, UserPermissionsMixin, viewsets.ModelViewSet):
     queryset = ModifyExportOperation.objects.all()
-    warehouse_field_lookup = 'original_item_line__original_operation__warehouse__in'
+    warehouse_field_lookup = 'original_item_line__operation__warehouse__in'
     serializer_class = ModifyExportOperationSerializer
     permission_classes  = [IsAuthenticated]
 
 
+class _BatchRolledBack(Exception):
+    pass
+
+
+class BulkOperationView(APIView):
+    """
+    API endpoint for creating many operations of any type in one request.
+
+    POST a JSON body such as:
+
+        {
+            "atomic": false,
+            "operations": [
+                {"type": "supply", "data": {"warehouse": 1, "supplier": 2, "items": [{"item": 3, "quantity": "10"}], ...}},
+                {"type": "export", "data": {...}}
+            ]
+        }
+
+    `type` is one of the route names under api/operations/ and `data` is the body the matching
+    endpoint expects; `items` / `returned_items` may be sent as lists instead of JSON strings.
+    Attachments are referenced by the tokens of chunked uploads in `uploaded_attachments`.
+
+    Every row is validated first. Valid rows are then written in transactions of
+    BULK_OPERATIONS_CHUNK_SIZE rows, each row inside its own savepoint, so one failing voucher
+    does not discard the rest of its chunk. With "atomic": true the whole batch is written in
+    one transaction and nothing is kept unless every row succeeds.
+
+    The response lists one result per row, in request order: {"index", "type", "id"} for
+    created rows and {"index", "type", "errors"} for rejected ones. Like the other operation
+    endpoints it honours the Idempotency-Key header.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    operation_serializers = {
+        'supply': SupplyOperationSerializer,
+        'export': ExportOperationSerializer,
+        'return_supply': ReturnSupplyOperationSerializer,
+        'return_export': ReturnDispatchOperationSerializer,
+        'damage': DamageOperationSerializer,
+        'transfer': TransferOperationSerializer,
+        'modify_supply': ModifySupplyOperationSerializer,
+        'modify_export': ModifyExportOperationSerializer,
+    }
+
+    def post(self, request, *args, **kwargs):
+        return idempotent_response(request, lambda: self.create_operations(request))
+
+    def create_operations(self, request):
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            return Response({'operations': 'Operations must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        max_rows = settings.BULK_OPERATIONS_MAX_ROWS
+        if len(operations) > max_rows:
+            return Response(
+                {'operations': f'A bulk request accepts at most {max_rows} operations.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        all_or_nothing = bool(request.data.get('atomic', False))
+
+        results = [None] * len(operations)
+        pending = []
+        for index, row in enumerate(operations):
+            serializer, errors = self.build_serializer(row)
+            if errors is None and not serializer.is_valid():
+                errors = serializer.errors
+            if errors is not None:
+                results[index] = {'index': index, 'type': self.row_type(row), 'errors': errors}
+            else:
+                pending.append((index, row['type'], serializer))
+
+        if all_or_nothing:
+            if len(pending) != len(operations):
+                return self.rejected_batch(operations, results, 'Not written, another operation in the batch is invalid.')
+            try:
+                with transaction.atomic():
+                    for index, operation_type, serializer in pending:
+                        results[index] = self.save_row(index, operation_type, serializer)
+                        if 'errors' in results[index]:
+                            raise _BatchRolledBack
+            except Exception as e:
+                # The rows saved before the failure are rolled back with their pending attachment
+                # links; the failing row has already discarded its own files.
+                for index, _, serializer in pending:
+                    if results[index] and 'id' in results[index]:
+                        discard_staged_attachments(getattr(serializer, 'staged_attachments', []))
+                if not isinstance(e, _BatchRolledBack):
+                    raise
+                return self.rejected_batch(operations, results, 'Rolled back, another operation in the batch failed.')
+        else:
+            chunk_size = settings.BULK_OPERATIONS_CHUNK_SIZE
+            for start in range(0, len(pending), chunk_size):
+                with transaction.atomic():
+                    for index, operation_type, serializer in pending[start:start + chunk_size]:
+                        results[index] = self.save_row(index, operation_type, serializer)
+
+        created = sum(1 for result in results if 'id' in result)
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {'created': created, 'failed': len(results) - created, 'results': results},
+            status=response_status,
+        )
+
+    def save_row(self, index, operation_type, serializer):
+        """
+        Saves one validated row inside its own savepoint and returns its result entry.
+        Validation, stock and database errors are reported in the row's entry.
+        """
+        save_kwargs = {}
+        if operation_type in ('modify_supply', 'modify_export'):
+            # An earlier row of the same batch may already have modified this line.
+            original_item_line = serializer.validated_data['original_item_line']
+            original_item_line.refresh_from_db(fields=['effective_quantity'])
+            save_kwargs['old_quantity'] = original_item_line.effective_quantity
+        try:
+            with transaction.atomic():
+                instance = serializer.save(**save_kwargs)
+        except serializers.ValidationError as e:
+            return {'index': index, 'type': operation_type, 'errors': e.detail}
+        except ValueError as e:
+            return {'index': index, 'type': operation_type, 'errors': {'non_field_errors': [str(e)]}}
+        except (DatabaseError, TransactionRetriesExhausted):
+            # Earlier chunks are already committed, so the row is reported rather than turning
+            # the whole response into a 500 that hides the ids created so far.
+            logger.exception("Bulk operation row %s (%s) failed.", index, operation_type)
+            discard_staged_attachments(getattr(serializer, 'staged_attachments', []))
+            return {
+                'index': index,
+                'type': operation_type,
+                'errors': {'non_field_errors': ['The operation could not be saved because of a database error. Please try again.']},
+            }
+        return {'index': index, 'type': operation_type, 'id': instance.pk}
+
+    def rejected_batch(self, operations, results, message):
+        results = [
+            result if result and 'errors' in result else
+            {'index': index, 'type': self.row_type(operations[index]), 'errors': {'non_field_errors': [message]}}
+            for index, result in enumerate(results)
+        ]
+        return Response(
+            {'created': 0, 'failed': len(results), 'results': results},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    @staticmethod
+    def row_type(row):
+        return row.get('type') if isinstance(row, dict) else None
+
+    def build_serializer(self, row):
+        """
+        Returns (serializer, None) for a well-formed row, or (None, errors) when the row
+        cannot be handed to a serializer at all.
+        """
+        if not isinstance(row, dict):
+            return None, {'non_field_errors': ['Each operation must be an object with "type" and "data".']}
+        serializer_class = self.operation_serializers.get(row.get('type'))
+        if serializer_class is None:
+            return None, {'type': [f'Unknown operation type. Expected one of: {", ".join(self.operation_serializers)}.']}
+        data = row.get('data')
+        if not isinstance(data, dict):
+            return None, {'data': ['This field must be an object.']}
+        # The single-operation endpoints receive the item lines as a JSON string inside a multipart form.
+        data = {
+            key: json.dumps(value) if isinstance(value, (list, dict)) and key != 'uploaded_attachments' else value
+            for key, value in data.items()
+        }
+        return serializer_class(data=data, context={'request': self.request, 'view': self}), None
+
+
+class OperationMetricsView(APIView):
+    """
+    API endpoint for reading the operation counters, such as how many stock
+    transactions were retried after a deadlock. Staff only.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
+
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class AttachmentUploadView(APIView):
+    """
+    API endpoint for starting a chunked attachment upload.
+
+    POST {"filename", "size"} returns a token. The file is then sent with PUT requests to
+    api/operations/uploads/<token>/, and once complete the token can be listed in
+    uploaded_attachments of any operation instead of the file itself.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = AttachmentUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user, expires_at=upload_expiry())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class AttachmentUploadDetailView(APIView):
+    """
+    API endpoint for one chunked upload of the requesting user.
+
+    PUT sends the bytes of one range as the raw request body, with a
+    "Content-Range: bytes <first>-<last>/<size>" header. Ranges must continue where the
+    upload stopped; a range that does not is answered with 409 and the offset to resume from.
+    GET returns that offset ("received") after a dropped connection, and DELETE abandons the upload.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_upload(self, request, token):
+        return get_object_or_404(AttachmentUpload, token=token, user=request.user)
+
+    def get(self, request, token, *args, **kwargs):
+        return Response(AttachmentUploadSerializer(self.get_upload(request, token)).data)
+
+    def put(self, request, token, *args, **kwargs):
+        upload = self.get_upload(request, token)
+        match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        if match is None:
+            return Response(
+                {'detail': 'A "Content-Range: bytes <first>-<last>/<size>" header is required.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        first, last, total = (int(value) for value in match.groups())
+        length = last - first + 1
+        if total != upload.size or length < 1:
+            return Response({'detail': 'The Content-Range does not match this upload.'}, status=status.HTTP_400_BAD_REQUEST)
+        if int(request.headers.get('Content-Length') or 0) != length:
+            return Response(
+                {'detail': 'The request body must hold exactly the bytes of the Content-Range.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            upload = write_upload_range(upload, first, length, request.stream)
+        except UploadRangeError as e:
+            return Response({'detail': str(e), 'received': e.offset}, status=status.HTTP_409_CONFLICT)
+        return Response(AttachmentUploadSerializer(upload).data)
+
+    def delete(self, request, token, *args, **kwargs):
+        upload = self.get_upload(request, token)
+        if upload.status == AttachmentUpload.Status.CLAIMED:
+            return Response({'detail': 'This upload is being attached to an operation.'}, status=status.HTTP_409_CONFLICT)
+        upload.delete()
+        delete_upload_file(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
@@ -0,0 +1,66 @@
+"""
+Movement totals computed in the database for the totals and by_period report modes.
+
+Every kind of operation line in operations.movements.LINE_SOURCES is grouped with one
+SELECT ... SUM(quantity), COUNT(*) ... GROUP BY item, warehouse, movement type (and
+period), and the groups are merged, so the work after the queries and the size of the
+result depend on the number of groups rather than on the number of operations.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Trunc
+
+from inventory.models import InventoryWarehouse, Item
+from core.services.warehouse_tree import warehouse_filter
+from operations.movements import LINE_SOURCES
+
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def movement_totals(subject, subject_id, date_filters, bucket=None, descendants=False):
+    """
+    Returns one dict per (period, warehouse, item, movement type) with the signed
+    quantity moved and the number of lines, ordered by period, warehouse and item.
+    `subject` is the LineSource field the report is about ('warehouse' or 'item').
+    `bucket` groups by day, week or month of the operation date; None totals the range.
+    With `descendants` a warehouse subject also covers the warehouses under it.
+    """
+    totals = {}
+    for source in LINE_SOURCES:
+        rows = source.model.objects.filter(**warehouse_filter(getattr(source, subject), subject_id, descendants))
+        if source.condition is not None:
+            rows = rows.filter(source.condition)
+        if 'start_date' in date_filters:
+            rows = rows.filter(**{f'{source.date}__gte': date_filters['start_date']})
+        if 'end_date' in date_filters:
+            rows = rows.filter(**{f'{source.date}__lte': date_filters['end_date']})
+        groups = {'total_warehouse': F(source.warehouse), 'total_item': F(source.item)}
+        if bucket:
+            groups['total_period'] = Trunc(source.date, bucket, output_field=DateField())
+        grouped = rows.values(**groups).annotate(
+            total_quantity=Sum(source.quantity), total_count=Count('pk'),
+        ).order_by()
+        for row in grouped:
+            key = (row.get('total_period'), row['total_warehouse'], row['total_item'], source.operation_type)
+            totals[key] = {
+                'period': key[0],
+                'warehouse_id': key[1],
+                'item_id': key[2],
+                'operation_type': source.operation_type,
+                'quantity': (row['total_quantity'] or Decimal('0.00')) * source.sign,
+                'count': row['total_count'],
+            }
+
+    warehouse_names = dict(
+        InventoryWarehouse.objects.filter(pk__in={key[1] for key in totals}).values_list('pk', 'name')
+    )
+    item_names = dict(Item.objects.filter(pk__in={key[2] for key in totals}).values_list('pk', 'name'))
+    result = []
+    for key in sorted(totals, key=lambda key: (key[0] or '', key[1], key[2], key[3])):
+        row = totals[key]
+        row['warehouse_name'] = warehouse_names.get(row['warehouse_id'])
+        row['item_name'] = item_names.get(row['item_id'])
+        result.append(row)
+    return result
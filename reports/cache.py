@@ -0,0 +1,99 @@
+"""
+Cache of rendered reports.
+
+An entry is keyed by the view, its normalized query parameters, the caller's
+permission scope, the output format and the data versions of the warehouses
+the report reads (see core.services.data_versions). Writes replace those
+versions, so entries are never deleted explicitly; they become unreachable
+and expire after the cache TIMEOUT.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import FileResponse, HttpResponse
+
+from core.services import data_versions, metrics
+from core.services.mixins import managed_warehouse_ids
+
+
+KEY_PREFIX = 'report:'
+
+# CSV and TSV are streamed while they are produced, so there is nothing to keep.
+CACHED_FORMATS = ('json', 'xlsx', 'pdf', 'parquet', 'arrow')
+
+# Query parameters that select the output format rather than the data.
+IGNORED_PARAMS = ('format',)
+
+
+def _cache():
+    return caches[settings.REPORT_CACHE_ALIAS]
+
+
+def permission_scope(request):
+    """
+    What the user is allowed to see, as a short string: reports rendered for one
+    scope are never served to another. Employees see the subtrees of the warehouses
+    they manage. Anonymous callers share one scope of their own.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    if user.is_superuser or getattr(user, 'user_type', None) == 'Manager':
+        return 'all'
+    warehouse_ids = sorted(managed_warehouse_ids(request))
+    return 'warehouses:' + ','.join(map(str, warehouse_ids))
+
+
+def cache_key(view, request, file_format, scopes):
+    params = sorted(
+        (name, sorted(values))
+        for name, values in request.query_params.lists()
+        if name not in IGNORED_PARAMS
+    )
+    parts = {
+        'view': f'{type(view).__module__}.{type(view).__qualname__}',
+        'params': params,
+        'scope': permission_scope(request),
+        'format': file_format,
+        'versions': data_versions.current(scopes),
+    }
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return KEY_PREFIX + digest
+
+
+def cached_response(key):
+    entry = _cache().get(key)
+    if entry is None:
+        metrics.increment(metrics.REPORT_CACHE_MISSES)
+        return None
+    metrics.increment(metrics.REPORT_CACHE_HITS)
+    content, content_type, content_disposition = entry
+    response = HttpResponse(content, content_type=content_type)
+    if content_disposition:
+        response['Content-Disposition'] = content_disposition
+    response['X-Report-Cache'] = 'hit'
+    return response
+
+
+def store_response(key, response):
+    """
+    Keeps the rendered bytes of a successful response, unless they exceed REPORT_CACHE_MAX_BYTES.
+    A FileResponse is read from its temporary file and rewound for sending.
+    """
+    if hasattr(response, 'render'):
+        # Rendering can still turn the response into an error (see PdfRenderer).
+        response.render()
+    if response.status_code != 200:
+        return
+    if isinstance(response, FileResponse):
+        file = response.file_to_stream
+        content = file.read(settings.REPORT_CACHE_MAX_BYTES + 1)
+        file.seek(0)
+    else:
+        content = response.content
+    response['X-Report-Cache'] = 'miss'
+    if len(content) > settings.REPORT_CACHE_MAX_BYTES:
+        return
+    _cache().set(key, (content, response['Content-Type'], response.get('Content-Disposition')))
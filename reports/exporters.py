@@ -0,0 +1,309 @@
+"""
+File exports of reports that are written row by row instead of from the rendered JSON.
+
+A report is a list of ReportSection. Each section's queryset is read through
+.iterator(), every operation is serialized on its own and flattened to one row per
+line, and the rows go straight to the output file, so memory does not grow with the
+date range.
+
+XLSX is written to a temporary file first, since a workbook can only be sent once it
+is finished. CSV and TSV rows are sent as they are produced, so the first bytes leave
+before the rest of the report has been read. Parquet and Arrow files get typed columns
+derived from the serializer fields and are written in compressed row groups.
+"""
+import csv
+import json
+import tempfile
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db.models import QuerySet
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl import Workbook
+from rest_framework import serializers
+
+
+# `group` nests the section under that key in the JSON output (e.g. 'returns').
+# `keyset` is the unique ordering that JSON pages follow (see reports.pagination).
+ReportSection = namedtuple(
+    'ReportSection', ['name', 'queryset', 'serializer_class', 'group', 'keyset'],
+    defaults=[None, ('operation_date', 'id')],
+)
+
+# Nested lists that are expanded to one row per entry.
+LINE_FIELDS = ('items', 'returned_items', 'movements')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def section_title(section):
+    # Excel sheet names are limited to 31 characters.
+    return section.name.title()[:31]
+
+
+def section_columns(serializer_class):
+    """
+    Returns (columns, line_field, line_columns) for a report serializer: the operation
+    fields, the nested list expanded into rows (or None), and (field, column) pairs for
+    the fields of each line. A line field that clashes with an operation field is
+    prefixed with 'line_'.
+    """
+    fields = serializer_class().fields
+    line_field = next(
+        (name for name in LINE_FIELDS if isinstance(fields.get(name), serializers.ListSerializer)),
+        None,
+    )
+    columns = [name for name in fields if name != line_field]
+    line_columns = []
+    if line_field:
+        line_columns = [
+            (name, f'line_{name}' if name in columns else name)
+            for name in fields[line_field].child.fields
+        ]
+    return columns, line_field, line_columns
+
+
+def section_fields(serializer_class):
+    """
+    The serializer fields behind the columns of section_columns(), in the same order.
+    """
+    columns, line_field, line_columns = section_columns(serializer_class)
+    fields = serializer_class().fields
+    result = [fields[column] for column in columns]
+    if line_field:
+        line_fields = fields[line_field].child.fields
+        result.extend(line_fields[name] for name, _ in line_columns)
+    return result
+
+
+def _cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+def iterate_queryset(queryset):
+    if isinstance(queryset, QuerySet):
+        return queryset.iterator(chunk_size=settings.REPORT_ITERATOR_CHUNK_SIZE)
+    return iter(queryset)
+
+
+def section_rows(section):
+    """
+    Returns the header of a section and a generator of its rows, one per operation line.
+    """
+    columns, line_field, line_columns = section_columns(section.serializer_class)
+    header = columns + [column for _, column in line_columns]
+
+    def rows():
+        serializer = section.serializer_class()
+        for instance in iterate_queryset(section.queryset):
+            record = serializer.to_representation(instance)
+            base = [_cell(record.get(column)) for column in columns]
+            lines = record.get(line_field) if line_field else None
+            if not lines:
+                yield base + [None] * len(line_columns)
+                continue
+            for line in lines:
+                yield base + [_cell(line.get(name)) for name, _ in line_columns]
+
+    return header, rows()
+
+
+def write_xlsx(sections, file):
+    """
+    Writes one sheet per section with openpyxl's write_only mode, which keeps the rows
+    in temporary files instead of building the workbook in memory.
+    """
+    workbook = Workbook(write_only=True)
+    for section in sections:
+        sheet = workbook.create_sheet(title=section_title(section))
+        header, rows = section_rows(section)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(file)
+
+
+# Rows are sent in pieces of about this many bytes.
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+class _Echo:
+    """
+    A file-like object for csv.writer that hands each written line back instead of storing it.
+    """
+    def write(self, value):
+        return value
+
+
+def _union_header(tables):
+    """
+    A report with several sections is written as one table with a leading 'section'
+    column and the union of the section headers; the rows of each section leave the
+    other columns empty.
+    """
+    header = ['section'] if len(tables) > 1 else []
+    for _, table_header, _ in tables:
+        header.extend(column for column in table_header if column not in header)
+    return header
+
+
+def _union_rows(tables, header):
+    for section, table_header, rows in tables:
+        positions = [header.index(column) for column in table_header]
+        for row in rows:
+            out = [None] * len(header)
+            if header[0] == 'section':
+                out[0] = section.name
+            for position, value in zip(positions, row):
+                out[position] = value
+            yield out
+
+
+def stream_delimited(sections, delimiter):
+    """
+    Yields the sections as one delimited table (see _union_header).
+    """
+    tables = [(section, *section_rows(section)) for section in sections]
+    header = _union_header(tables)
+
+    writer = csv.writer(_Echo(), delimiter=delimiter)
+    yield writer.writerow(header).encode('utf-8')
+    pending = []
+    pending_size = 0
+    for out in _union_rows(tables, header):
+        line = writer.writerow(out)
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= STREAM_BUFFER_SIZE:
+            yield ''.join(pending).encode('utf-8')
+            pending = []
+            pending_size = 0
+    if pending:
+        yield ''.join(pending).encode('utf-8')
+
+
+def stream_csv(sections):
+    return stream_delimited(sections, ',')
+
+
+def stream_tsv(sections):
+    return stream_delimited(sections, '\t')
+
+
+def _arrow_column(field):
+    """
+    The Arrow type of a serializer field and a function turning its serialized value back
+    into the typed value. Fields without a matching type are kept as strings.
+    """
+    if isinstance(field, (serializers.IntegerField, serializers.PrimaryKeyRelatedField)):
+        return pa.int64(), int
+    if isinstance(field, serializers.DecimalField) and field.max_digits:
+        return pa.decimal128(field.max_digits, field.decimal_places or 0), lambda value: Decimal(str(value))
+    if isinstance(field, serializers.DateTimeField):
+        # Serialized as ISO 8601 with an offset; stored as UTC instants.
+        return pa.timestamp('us', tz='UTC'), datetime.fromisoformat
+    if isinstance(field, serializers.DateField):
+        return pa.date32(), date.fromisoformat
+    if isinstance(field, serializers.BooleanField):
+        return pa.bool_(), bool
+    if isinstance(field, serializers.FloatField):
+        return pa.float64(), float
+    return pa.string(), str
+
+
+def arrow_batches(sections):
+    """
+    Returns the Arrow schema of the sections (as one table, see _union_header) and a
+    generator of record batches of REPORT_ARROW_BATCH_ROWS rows read from the querysets.
+    A column that has different types in different sections is kept as strings.
+    """
+    tables = [(section, *section_rows(section)) for section in sections]
+    header = _union_header(tables)
+    columns = {'section': (pa.string(), str)} if header[:1] == ['section'] else {}
+    for section, table_header, _ in tables:
+        for name, field in zip(table_header, section_fields(section.serializer_class)):
+            column = _arrow_column(field)
+            if name in columns and columns[name][0] != column[0]:
+                column = (pa.string(), str)
+            columns[name] = column
+    types = [columns[name] for name in header]
+    schema = pa.schema([pa.field(name, arrow_type) for name, (arrow_type, _) in zip(header, types)])
+
+    def batches():
+        pending = [[] for _ in header]
+        for row in _union_rows(tables, header):
+            for values, value, (_, convert) in zip(pending, row, types):
+                values.append(None if value is None or value == '' else convert(value))
+            if len(pending[0]) >= settings.REPORT_ARROW_BATCH_ROWS:
+                yield pa.record_batch(pending, schema=schema)
+                pending = [[] for _ in header]
+        if pending and pending[0]:
+            yield pa.record_batch(pending, schema=schema)
+
+    return schema, batches()
+
+
+def write_parquet(sections, file):
+    """
+    Writes the sections as one Parquet table, one zstd-compressed row group per batch.
+    """
+    schema, batches = arrow_batches(sections)
+    writer = pq.ParquetWriter(file, schema, compression='zstd')
+    for batch in batches:
+        writer.write_batch(batch)
+    writer.close()
+
+
+def write_arrow(sections, file):
+    """
+    Writes the sections as an Arrow IPC file with zstd-compressed record batches.
+    """
+    schema, batches = arrow_batches(sections)
+    options = pa.ipc.IpcWriteOptions(compression='zstd')
+    with pa.ipc.new_file(file, schema, options=options) as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+PARQUET_CONTENT_TYPE = 'application/vnd.apache.parquet'
+ARROW_CONTENT_TYPE = 'application/vnd.apache.arrow.file'
+
+# Formats written to a file before they are sent, and formats sent while they are produced.
+FILE_EXPORTERS = {
+    'xlsx': (write_xlsx, XLSX_CONTENT_TYPE),
+    'parquet': (write_parquet, PARQUET_CONTENT_TYPE),
+    'arrow': (write_arrow, ARROW_CONTENT_TYPE),
+}
+STREAM_EXPORTERS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'tsv': (stream_tsv, 'text/tab-separated-values; charset=utf-8'),
+}
+EXPORTERS = {**FILE_EXPORTERS, **STREAM_EXPORTERS}
+
+
+def export_response(sections, file_format, filename):
+    """
+    Returns a streaming response with the sections in `file_format`.
+    """
+    if file_format in STREAM_EXPORTERS:
+        stream, content_type = STREAM_EXPORTERS[file_format]
+        response = StreamingHttpResponse(stream(sections), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    write, content_type = FILE_EXPORTERS[file_format]
+    # Written to a temporary file, then streamed back in blocks.
+    output = tempfile.TemporaryFile()
+    try:
+        write(sections, output)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
@@ -0,0 +1,181 @@
+"""
+Background rendering of reports requested with ?async=1.
+
+A job stores the report view, its query parameters and the user. It is run by
+re-dispatching the view with those parameters outside the request: in a small
+thread pool of the web process (REPORT_JOB_WORKERS threads, which is also the
+number of reports rendered at once), or by `manage.py run_report_jobs` workers.
+Either way a job is claimed with a conditional UPDATE, so it runs only once.
+"""
+import logging
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from reports.models import ReportJob
+
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only control how the report is requested.
+JOB_PARAMS = ('async',)
+
+PENDING = (ReportJob.Status.QUEUED, ReportJob.Status.RUNNING)
+
+# Key of the advisory lock that serializes enqueue() across processes.
+QUEUE_LOCK_KEY = 0x7265706f7274  # 'report'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class ReportQueueFull(Exception):
+    """
+    Raised when REPORT_JOB_MAX_PENDING jobs are already waiting or running.
+    """
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.REPORT_JOB_WORKERS, thread_name_prefix='report-job',
+            )
+        return _executor
+
+
+def job_expiry():
+    return timezone.now() + timedelta(hours=settings.REPORT_JOB_TTL_HOURS)
+
+
+def _lock_queue():
+    """
+    Takes a transaction-scoped PostgreSQL advisory lock held by every enqueue. SQLite,
+    used in development, already lets only one transaction write at a time.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [QUEUE_LOCK_KEY])
+
+
+def enqueue(view, request, file_format):
+    """
+    Creates a job that renders `view` with the parameters of `request` and schedules it.
+    """
+    with transaction.atomic():
+        # Count and insert under one lock, so concurrent requests cannot all pass the check.
+        _lock_queue()
+        if ReportJob.objects.filter(status__in=PENDING).count() >= settings.REPORT_JOB_MAX_PENDING:
+            raise ReportQueueFull()
+        job = ReportJob.objects.create(
+            user=request.user,
+            view=f'{type(view).__module__}.{type(view).__qualname__}',
+            query_params={
+                name: values for name, values in request.query_params.lists() if name not in JOB_PARAMS
+            },
+            file_format=file_format,
+            expires_at=job_expiry(),
+        )
+    if settings.REPORT_JOB_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        # Worker threads keep their own connection; do not leave it open between jobs.
+        connection.close()
+
+
+def claim_next_job():
+    """
+    Claims the oldest queued job for this worker, or returns None when there is none.
+    """
+    for job_id in ReportJob.objects.filter(status=ReportJob.Status.QUEUED).values_list('pk', flat=True)[:10]:
+        if _claim(job_id):
+            return job_id
+    return None
+
+
+def _claim(job_id):
+    return ReportJob.objects.filter(pk=job_id, status=ReportJob.Status.QUEUED).update(
+        status=ReportJob.Status.RUNNING, started_at=timezone.now(),
+    )
+
+
+def run_job(job_id, claimed=False):
+    """
+    Renders one job and stores the file. Returns False if another worker got the job first.
+    """
+    close_old_connections()
+    if not claimed and not _claim(job_id):
+        return False
+    job = ReportJob.objects.select_related('user').get(pk=job_id)
+    try:
+        response = _render(job)
+        if response.status_code != 200:
+            body = b'' if response.streaming else response.content
+            raise ValueError(f"The report answered {response.status_code}: {body[:1000].decode('utf-8', 'replace')}")
+        _store_result(job, response)
+        job.status = ReportJob.Status.DONE
+    except Exception as e:
+        logger.exception("Report job %s failed.", job.pk)
+        job.status = ReportJob.Status.FAILED
+        job.error = str(e)
+    job.finished_at = timezone.now()
+    job.expires_at = job_expiry()
+    job.save(update_fields=['status', 'result', 'content_type', 'filename', 'error', 'finished_at', 'expires_at'])
+    return True
+
+
+def _render(job):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(mutable=True)
+    for name, values in job.query_params.items():
+        request.GET.setlist(name, values)
+    # The format may have been chosen with the Accept header, which is not stored.
+    request.GET['format'] = job.file_format
+    request.META.update({'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'})
+    # DRF authenticates a request carrying _force_auth_user as that user.
+    request._force_auth_user = job.user
+    response = import_string(job.view).as_view()(request)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+    return response
+
+
+CONTENT_DISPOSITION_FILENAME = re.compile(r'filename="([^"]+)"')
+
+
+def _store_result(job, response):
+    match = CONTENT_DISPOSITION_FILENAME.search(response.get('Content-Disposition', ''))
+    job.filename = match.group(1) if match else f'report_{job.pk}.{job.file_format}'
+    job.content_type = response['Content-Type']
+    with tempfile.TemporaryFile() as output:
+        if response.streaming:
+            for chunk in response.streaming_content:
+                output.write(chunk)
+        else:
+            output.write(response.content)
+        response.close()
+        output.seek(0)
+        job.result.save(job.filename, File(output), save=False)
+
+
+def delete_job(job):
+    if job.result:
+        job.result.delete(save=False)
+    job.delete()
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from reports.jobs import PENDING, delete_job
+from reports.models import ReportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes report jobs past their expires_at with their files, and fails jobs that have been "
+        "queued or running for too long (e.g. their worker was restarted). Run it periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-hours', type=float, default=2,
+                            help="Queued or running jobs older than this are marked as failed.")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        stale = ReportJob.objects.filter(
+            status__in=PENDING, created_at__lte=now - timedelta(hours=options['stale_hours']),
+        ).update(status=ReportJob.Status.FAILED, error="The report was not generated in time.", finished_at=now)
+
+        expired = ReportJob.objects.filter(expires_at__lte=now).exclude(status__in=PENDING)
+        deleted = 0
+        for job in expired.iterator():
+            delete_job(job)
+            deleted += 1
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired report jobs, failed {stale} stale ones."))
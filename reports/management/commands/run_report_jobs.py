@@ -0,0 +1,44 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from reports.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = (
+        "Renders queued report jobs. Set REPORT_JOB_WORKERS = 0 on the web processes to leave "
+        "all jobs to this command; otherwise it picks up jobs left behind by a restarted web process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.REPORT_JOB_WORKERS, 1),
+                            help="Number of reports rendered at once.")
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report-job') as executor:
+            done = sum(executor.map(lambda _: self.work(options), range(workers)))
+        self.stdout.write(self.style.SUCCESS(f"Rendered {done} report jobs."))
+
+    def work(self, options):
+        done = 0
+        try:
+            while True:
+                job_id = claim_next_job()
+                if job_id is None:
+                    if options['once']:
+                        return done
+                    time.sleep(options['poll_interval'])
+                    continue
+                run_job(job_id, claimed=True)
+                done += 1
+        finally:
+            connection.close()
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:09
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('view', models.CharField(help_text='Dotted path of the report view.', max_length=255)),
+                ('query_params', models.JSONField(help_text='The query parameters of the report, as lists of values.')),
+                ('file_format', models.CharField(max_length=10)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('result', models.FileField(blank=True, upload_to='report_jobs/%Y/%m/%d/')),
+                ('content_type', models.CharField(blank=True, max_length=255)),
+                ('filename', models.CharField(blank=True, max_length=255)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Report Job',
+                'verbose_name_plural': 'Report Jobs',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='report_job_queue_idx'), models.Index(fields=['expires_at'], name='report_job_expiry_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,45 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class ReportJob(models.Model):
+    """
+    A report rendered in the background. The request that created it gets the job id
+    back at once; the client polls the job and downloads `result` when it is done.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', _('Queued')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='report_jobs')
+    view = models.CharField(max_length=255, help_text=_("Dotted path of the report view."))
+    query_params = models.JSONField(help_text=_("The query parameters of the report, as lists of values."))
+    file_format = models.CharField(max_length=10)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    result = models.FileField(upload_to='report_jobs/%Y/%m/%d/', blank=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.view} ({self.status})"
 
-# Create your models here.
+    class Meta:
+        verbose_name = _("Report Job")
+        verbose_name_plural = _("Report Jobs")
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='report_job_queue_idx'),
+            models.Index(fields=['expires_at'], name='report_job_expiry_idx'),
+        ]
@@ -0,0 +1,113 @@
+"""
+Keyset pagination of the JSON output of reports.
+
+Each section is ordered by its `keyset` fields (operation_date, id by default) and a
+page holds the rows after the last key sent, read with WHERE (date, id) > (%s, %s)
+instead of OFFSET, so a deep page costs as much as the first one. A report with
+several sections pages through all of them at once; the cursor holds the last key of
+each section and is signed, so it is opaque to clients and cannot be altered.
+"""
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q, QuerySet
+from rest_framework.utils.urls import replace_query_param
+
+
+CURSOR_PARAM = 'cursor'
+PAGE_SIZE_PARAM = 'page_size'
+CURSOR_SALT = 'reports.pagination'
+
+# Marks a section whose rows have all been sent.
+DONE = 'done'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def is_paginated(request):
+    return CURSOR_PARAM in request.query_params or PAGE_SIZE_PARAM in request.query_params
+
+
+def get_page_size(request):
+    try:
+        page_size = int(request.query_params.get(PAGE_SIZE_PARAM, settings.REPORT_PAGE_SIZE))
+    except ValueError:
+        raise InvalidCursor(f"{PAGE_SIZE_PARAM} must be a number.")
+    if page_size < 1:
+        raise InvalidCursor(f"{PAGE_SIZE_PARAM} must be at least 1.")
+    return min(page_size, settings.REPORT_MAX_PAGE_SIZE)
+
+
+def decode_cursor(request):
+    cursor = request.query_params.get(CURSOR_PARAM)
+    if not cursor:
+        return {}
+    try:
+        return signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        raise InvalidCursor("The cursor is invalid.")
+
+
+def encode_cursor(positions):
+    return signing.dumps(positions, salt=CURSOR_SALT, compress=True)
+
+
+def _after(keyset, values):
+    """
+    (f1, f2, ...) > (v1, v2, ...) as a filter, which an index on the fields can serve.
+    """
+    condition = Q()
+    for index, field in enumerate(keyset):
+        equal = {keyset[previous]: values[previous] for previous in range(index)}
+        condition |= Q(**equal, **{f'{field}__gt': values[index]})
+    return condition
+
+
+def _key_of(row, keyset):
+    values = [row[field] if isinstance(row, dict) else getattr(row, field) for field in keyset]
+    return [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+
+
+def paginate_sections(sections, positions, page_size):
+    """
+    Returns the page of each section and the positions for the next page, or None
+    when every section is exhausted. Sections that are not querysets are sent whole
+    on the first page.
+    """
+    page = []
+    next_positions = {}
+    for section in sections:
+        position = positions.get(section.name)
+        if position == DONE:
+            page.append(section._replace(queryset=[]))
+            next_positions[section.name] = DONE
+            continue
+        if not isinstance(section.queryset, QuerySet):
+            page.append(section)
+            next_positions[section.name] = DONE
+            continue
+
+        queryset = section.queryset.order_by(*section.keyset)
+        if position is not None:
+            queryset = queryset.filter(_after(section.keyset, position))
+        # Prefetches run on the evaluated slice, so they only load this page's lines.
+        rows = list(queryset[:page_size + 1])
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_positions[section.name] = _key_of(rows[-1], section.keyset)
+        else:
+            next_positions[section.name] = DONE
+        page.append(section._replace(queryset=rows))
+
+    if all(position == DONE for position in next_positions.values()):
+        return page, None
+    return page, next_positions
+
+
+def next_link(request, positions):
+    if positions is None:
+        return None
+    return replace_query_param(request.build_absolute_uri(), CURSOR_PARAM, encode_cursor(positions))
@@ -0,0 +1,218 @@
+"""
+PDF rendering in a pool of long-lived worker processes.
+
+WeasyPrint spends much of a small report on setup: discovering fonts, parsing the
+stylesheets and compiling the template. Each worker does that once when it starts
+(see _warm_up) and then renders (template, context) jobs sent over a pipe, so a PDF
+costs only its layout and a web worker never runs WeasyPrint itself.
+
+PDF_RENDER_WORKERS processes are started on the first PDF. A request waits for a free
+worker only while fewer than PDF_RENDER_QUEUE_SIZE others are waiting, otherwise it is
+refused with PdfRenderBusy. A job that runs past PDF_RENDER_TIMEOUT seconds has its
+worker killed and replaced, so one pathological report cannot hold a worker forever.
+With PDF_RENDER_WORKERS = 0 PDFs are rendered in the calling process.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+from pathlib import Path
+
+from django.conf import settings
+from django.template.loader import get_template, render_to_string
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = 'reports'
+
+# Seconds a new worker may take to load fonts and templates before its first job.
+STARTUP_TIMEOUT = 120
+
+
+class PdfRenderBusy(Exception):
+    """
+    Raised when all workers are busy and the waiting queue is full.
+    """
+
+
+class PdfRenderTimeout(Exception):
+    """
+    Raised when a job did not finish within PDF_RENDER_TIMEOUT seconds.
+    """
+
+
+class PdfRenderError(Exception):
+    """
+    Raised when the worker failed to render a job; the message is the worker's error.
+    """
+
+
+def _report_templates():
+    directory = Path(__file__).resolve().parent / 'templates' / TEMPLATE_DIR
+    return sorted(f'{TEMPLATE_DIR}/{path.name}' for path in directory.glob('*.html'))
+
+
+def _font_configuration():
+    from weasyprint.text.fonts import FontConfiguration
+    return FontConfiguration()
+
+
+def _write_pdf(html_string, font_config):
+    from weasyprint import HTML
+    return HTML(string=html_string).write_pdf(font_config=font_config)
+
+
+def _warm_up():
+    """
+    Loads the fonts, compiles the report templates and lays out each of them once, which
+    leaves WeasyPrint's font and stylesheet caches filled. Returns the font configuration.
+    """
+    font_config = _font_configuration()
+    for template_name in _report_templates():
+        get_template(template_name)
+        _write_pdf(render_to_string(template_name, {'report_data': None}), font_config)
+    return font_config
+
+
+def _serve(connection):
+    """
+    The main loop of a worker process.
+    """
+    import django
+    django.setup()
+    font_config = _warm_up()
+    connection.send(('ready', None))
+    while True:
+        try:
+            template_name, context = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(('ok', _write_pdf(render_to_string(template_name, context), font_config)))
+        except Exception as e:
+            connection.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+
+    def __init__(self, context):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child_connection,), daemon=True, name='pdf-render')
+        self.process.start()
+        child_connection.close()
+        self.ready = False
+
+    def render(self, template_name, context, timeout):
+        if not self.ready:
+            # The warm-up is not counted against the job's timeout.
+            self._receive(STARTUP_TIMEOUT)
+            self.ready = True
+        try:
+            self.connection.send((template_name, context))
+        except OSError:
+            raise PdfRenderError("The PDF worker exited.") from None
+        return self._receive(timeout)
+
+    def _receive(self, timeout):
+        if not self.connection.poll(timeout):
+            raise PdfRenderTimeout(f"The PDF was not rendered within {timeout} seconds.")
+        try:
+            status, payload = self.connection.recv()
+        except EOFError:
+            raise PdfRenderError("The PDF worker exited.") from None
+        if status == 'error':
+            raise PdfRenderError(payload)
+        return payload
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def stop(self):
+        self.connection.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+
+
+class PdfWorkerPool:
+    """
+    A fixed number of worker processes handed out one job at a time.
+    """
+
+    def __init__(self, size, queue_size, timeout):
+        self.size = size
+        self.timeout = timeout
+        # A slot is held by every job that is running or waiting for a worker.
+        self._slots = threading.BoundedSemaphore(size + queue_size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        # Spawned rather than forked: the web process has threads and open connections.
+        self._context = multiprocessing.get_context('spawn')
+
+    def _start(self):
+        with self._lock:
+            if not self._started:
+                for _ in range(self.size):
+                    self._idle.put(_Worker(self._context))
+                self._started = True
+
+    def render(self, template_name, context):
+        if not self._slots.acquire(blocking=False):
+            raise PdfRenderBusy("All PDF workers are busy.")
+        try:
+            self._start()
+            try:
+                worker = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PdfRenderBusy("No PDF worker became free in time.") from None
+            try:
+                return worker.render(template_name, context, self.timeout)
+            except PdfRenderTimeout:
+                # The worker is still busy with the job; start a fresh one in its place.
+                worker = self._replace(worker)
+                raise
+            except PdfRenderError:
+                if not worker.is_alive():
+                    worker = self._replace(worker)
+                raise
+            finally:
+                self._idle.put(worker)
+        finally:
+            self._slots.release()
+
+    def _replace(self, worker):
+        logger.warning("Replacing PDF worker %s.", worker.process.pid)
+        worker.stop()
+        return _Worker(self._context)
+
+    def close(self):
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().stop()
+            self._started = False
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PdfWorkerPool(
+                settings.PDF_RENDER_WORKERS, settings.PDF_RENDER_QUEUE_SIZE, settings.PDF_RENDER_TIMEOUT,
+            )
+        return _pool
+
+
+def render_pdf(template_name, context):
+    """
+    Renders `template_name` with `context` to PDF bytes. The context is sent to another
+    process, so it may only hold picklable data.
+    """
+    if settings.PDF_RENDER_WORKERS <= 0:
+        return _write_pdf(render_to_string(template_name, context), None)
+    return get_pool().render(template_name, context)
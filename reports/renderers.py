@@ -1,60 +1,163 @@
-import pandas as pd
-from io import BytesIO
+import csv
+import json
+from io import BytesIO, StringIO
 from rest_framework.renderers import BaseRenderer
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.conf import settings
 from datetime import datetime
-import openpyxl
+from openpyxl import Workbook
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .exporters import ARROW_CONTENT_TYPE, LINE_FIELDS, PARQUET_CONTENT_TYPE, XLSX_CONTENT_TYPE
+from .pdf import PdfRenderBusy, PdfRenderTimeout, render_pdf
+
+def serialized_tables(data):
+    """
+    Yields (name, header, rows) for each non-empty list in already-serialized report data,
+    with one row per line of each record.
+    """
+    lists = [('report', data)] if isinstance(data, list) else _nested_lists(data)
+    for name, records in lists:
+        header = []
+        rows = []
+        for record in records:
+            if not isinstance(record, dict):
+                continue
+            base_row = {k: v for k, v in record.items() if k not in LINE_FIELDS}
+            lines = next((record[k] for k in LINE_FIELDS if record.get(k)), None)
+            for line in lines or [{}]:
+                row = dict(base_row, **{k: v for k, v in line.items() if k not in base_row})
+                header.extend(k for k in row if k not in header)
+                rows.append(row)
+        if rows:
+            yield name, header, [[_cell(row.get(column)) for column in header] for row in rows]
+
+
+def _nested_lists(data):
+    for name, value in data.items():
+        if isinstance(value, dict):
+            yield from _nested_lists(value)
+        elif isinstance(value, list) and value:
+            yield name, value
+
+
+def _cell(value):
+    return value if isinstance(value, (str, int, float, type(None))) else str(value)
+
 
 class ExcelRenderer(BaseRenderer):
     """
     Custom renderer for generating Excel (.xlsx) files from report data.
+
+    ReportAPIView streams its XLSX exports through reports.exporters instead; this
+    renderer covers data that has already been serialized, one sheet per list.
     """
-    media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    media_type = XLSX_CONTENT_TYPE
     format = 'xlsx'
     charset = None
 
     def render(self, data, media_type=None, renderer_context=None):
-        if not data or not isinstance(data, dict):
+        if not data or not isinstance(data, (dict, list)):
             return b''
+        workbook = Workbook(write_only=True)
+        for sheet_name, header, rows in serialized_tables(data):
+            sheet = workbook.create_sheet(title=sheet_name.title()[:31])
+            sheet.append(header)
+            for row in rows:
+                sheet.append(row)
+        if not workbook.worksheets:
+            workbook.create_sheet()
 
         output = BytesIO()
-        writer = pd.ExcelWriter(output, engine='openpyxl')
+        workbook.save(output)
+        return output.getvalue()
 
-        for sheet_name, sheet_data in data.items():
-            if not sheet_data:
-                continue
 
-            processed_rows = []
-            for record in sheet_data:
-                if not isinstance(record, dict):    
-                    continue
-                base_row = {k: v for k, v in record.items() if k != 'items' and k != 'returned_items'}
-                
-                print(f">>>>>>>>>>>>>>>>>{record}")
-                items = record.get('items') or record.get('returned_items', [])
-                print(f"<<<<<<<<<<<<<<<<<<<<<<{items}")
-                if items:
-                    for item in items:
-                        print(f"******************{item}")
-                        flat_row = base_row.copy()
-                        flat_row['item_name'] = item.get('item_name', item.get('item'))
-                        flat_row['quantity'] = item.get('quantity', item.get('quantity'))
-                        processed_rows.append(flat_row)
-                else:
-                    processed_rows.append(base_row)
-            
-            df = pd.DataFrame(processed_rows)
-            
-            df.to_excel(writer, sheet_name=sheet_name.title(), index=False)
-        writer.close()
+class CsvRenderer(BaseRenderer):
+    """
+    Renders already-serialized report data as comma-separated values, the tables one
+    after another. ReportAPIView streams its CSV exports through reports.exporters instead.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    delimiter = ','
+
+    def render(self, data, media_type=None, renderer_context=None):
+        if not data or not isinstance(data, (dict, list)):
+            return b''
+        output = StringIO()
+        writer = csv.writer(output, delimiter=self.delimiter)
+        tables = list(serialized_tables(data))
+        for _, header, rows in tables:
+            writer.writerow(header)
+            writer.writerows(rows)
+        if not tables and isinstance(data, dict):
+            # Error responses such as {"error": "..."}.
+            writer.writerows([key, _cell(value)] for key, value in data.items())
+        return output.getvalue().encode(self.charset)
+
+
+class TsvRenderer(CsvRenderer):
+    media_type = 'text/tab-separated-values'
+    format = 'tsv'
+    delimiter = '\t'
+
+
+class ParquetRenderer(BaseRenderer):
+    """
+    Renders already-serialized report data as a Parquet file with string columns, the
+    tables one after another. ReportAPIView writes its Parquet exports with typed columns
+    through reports.exporters instead; this covers error responses and other data.
+    """
+    media_type = PARQUET_CONTENT_TYPE
+    format = 'parquet'
+    charset = None
+
+    def render(self, data, media_type=None, renderer_context=None):
+        if not data or not isinstance(data, (dict, list)):
+            return b''
+        output = BytesIO()
+        self.write(self.table(data), output)
         return output.getvalue()
 
+    def table(self, data):
+        tables = list(serialized_tables(data))
+        if not tables and isinstance(data, dict):
+            # Error responses such as {"error": "..."}.
+            tables = [('error', ['key', 'value'], [[key, _cell(value)] for key, value in data.items()])]
+        header = ['section'] if len(tables) > 1 else []
+        for _, table_header, _ in tables:
+            header.extend(column for column in table_header if column not in header)
+        columns = {column: [] for column in header}
+        for name, table_header, rows in tables:
+            for row in rows:
+                values = dict(zip(table_header, row), section=name)
+                for column in header:
+                    value = values.get(column)
+                    columns[column].append(None if value is None else str(value))
+        return pa.table({column: pa.array(values, type=pa.string()) for column, values in columns.items()})
+
+    def write(self, table, output):
+        pq.write_table(table, output, compression='zstd')
+
+
+class ArrowRenderer(ParquetRenderer):
+    media_type = ARROW_CONTENT_TYPE
+    format = 'arrow'
+
+    def write(self, table, output):
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.ipc.new_file(output, table.schema, options=options) as writer:
+            writer.write_table(table)
 
 
 class PdfRenderer(BaseRenderer):
     """
     Custom renderer for generating PDF files from report data using WeasyPrint.
+
+    The PDF is rendered by the worker pool in reports.pdf. When the pool is overloaded
+    or the job times out, the response is turned into a 503 with Retry-After.
     """
     media_type = 'application/pdf'
     format = 'pdf'
@@ -64,14 +167,21 @@ class PdfRenderer(BaseRenderer):
         view = renderer_context.get('view')
         template_name = getattr(view, 'pdf_template_name', 'reports/default_pdf_template.html')
 
+        # Plain data only: the context is sent to a worker process.
         context = {
             'report_data': data,
             'current_date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-            'request': renderer_context.get('request')
         }
 
-        html_string = render_to_string(template_name, context)
-
-        pdf_file = HTML(string=html_string).write_pdf()
-        
-        return pdf_file
+        try:
+            return render_pdf(template_name, context)
+        except (PdfRenderBusy, PdfRenderTimeout) as e:
+            response = renderer_context.get('response')
+            if response is None:
+                raise
+            response.status_code = 503
+            response['Retry-After'] = str(settings.PDF_RENDER_RETRY_AFTER)
+            response['Content-Type'] = 'application/json'
+            if response.has_header('Content-Disposition'):
+                del response['Content-Disposition']
+            return json.dumps({"error": str(e)}).encode('utf-8')
@@ -1,5 +1,8 @@
+from django.urls import reverse
 from rest_framework import serializers
-from inventory.models import  InventoryWarehouseitem, Item
+from core.services.mixins import managed_warehouse_ids
+from inventory.models import  InventoryWarehouseitem, Item, StockMovement
+from reports.models import ReportJob
 from operations.models import (
     DamageOperation, ExportOperation,
     ReturnSupplyOperation,SupplyOperation ,
@@ -65,6 +68,39 @@ class ReportDamageSerializer(serializers.ModelSerializer):
         fields = ['id', 'warehouse_name', 'operation_date', 'reason', 'items']
 
 
+class ReportMovementSummarySerializer(serializers.Serializer):
+    """
+    One row of a summary-mode report: the totals of a day, warehouse, item and movement type.
+    """
+    date = serializers.DateField()
+    warehouse_id = serializers.IntegerField()
+    warehouse_name = serializers.CharField()
+    item_id = serializers.IntegerField()
+    item_name = serializers.CharField()
+    operation_type = serializers.CharField()
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=2, source='total_quantity')
+    count = serializers.IntegerField(source='line_count')
+
+
+class ReportMovementTotalsSerializer(serializers.Serializer):
+    """
+    One group of a totals or by_period report. `period` is the first day of the
+    day, week or month, and is left out of totals-mode reports.
+    """
+    period = serializers.DateField()
+    warehouse_id = serializers.IntegerField()
+    warehouse_name = serializers.CharField()
+    item_id = serializers.IntegerField()
+    item_name = serializers.CharField()
+    operation_type = serializers.CharField()
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=2)
+    count = serializers.IntegerField()
+
+
+class ReportMovementRangeTotalsSerializer(ReportMovementTotalsSerializer):
+    period = None
+
+
 class ReportTransferSerializer(serializers.ModelSerializer):
 
     items = TransferOperationItemSerializer(many=True, read_only=True)
@@ -87,6 +123,31 @@ class WarehouseItemStatusSerializer(serializers.ModelSerializer):
 
 
 
+class StockMovementSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = StockMovement
+        fields = ['id', 'timestamp', 'operation_type', 'delta', 'source_line_id']
+
+
+class WarehouseItemAsOfSerializer(serializers.Serializer):
+    """
+    Stock of a warehouse item at the end of the `as_of` day:
+    the checkpoint it starts from plus the movements recorded since.
+    """
+    id = serializers.IntegerField(read_only=True)
+    warehouse_name = serializers.CharField(read_only=True)
+    item_name = serializers.CharField(read_only=True)
+    unit_of_measure = serializers.CharField(read_only=True)
+    as_of = serializers.DateField(read_only=True)
+    checkpoint_date = serializers.DateField(read_only=True, allow_null=True)
+    checkpoint_balance = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
+    movements = StockMovementSerializer(many=True, read_only=True)
+    quantity = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
+
+
+
+
 class ReturnsSubReportSerializer(serializers.Serializer):
     supply_returns = ReportReturnSupplySerializer(many=True, read_only=True)
     dispatch_returns = ReportReturnExportSerializer(many=True,read_only=True)
@@ -107,7 +168,7 @@ class GeneralWarehouseReportSerializer(serializers.Serializer):
         if user.is_superuser or user.user_type == 'Manager':
             return value 
         if user.user_type == 'Employee':
-            if not user.managed_warehouses.filter(pk=value.pk).exists():
+            if value.pk not in managed_warehouse_ids(self.context['request']):
                 raise serializers.ValidationError(
                     "You do not have permission to perform operations on this warehouse."
                 )
@@ -123,3 +184,28 @@ class GeneralItemReportSerializer(serializers.Serializer):
     damages = ReportDamageSerializer(many=True, read_only=True)
     transfer = ReportTransferSerializer(many =True ,read_only = True )
 
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+
+    status_url = serializers.SerializerMethodField()
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'status', 'file_format', 'filename', 'error', 'created_at', 'started_at', 'finished_at',
+                  'expires_at', 'status_url', 'download_url']
+
+    def _url(self, name, obj):
+        # Built without the report's ?format=, which the job endpoints do not render.
+        url = reverse(name, kwargs={'job_id': obj.pk})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_status_url(self, obj):
+        return self._url('report-job', obj)
+
+    def get_download_url(self, obj):
+        if obj.status != ReportJob.Status.DONE:
+            return None
+        return self._url('report-job-download', obj)
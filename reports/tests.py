@@ -1,3 +1,23 @@
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from inventory.models import InventoryWarehouse
+
+
+class AnonymousReportTests(TestCase):
+    """
+    The report endpoints set no permission class, so anonymous callers get reports too.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.warehouse = InventoryWarehouse.objects.create(name='Main', phone_warehouse='1')
+
+    def test_cached_formats_render_for_anonymous_callers(self):
+        client = APIClient()
+        for file_format in ('json', 'xlsx'):
+            with self.subTest(file_format=file_format):
+                response = client.get(
+                    '/api/reports/warehouse-status/', {'warehouse_id': self.warehouse.pk, 'format': file_format},
+                )
+                self.assertEqual(response.status_code, 200)
@@ -11,4 +11,6 @@ urlpatterns = [
     path('stations-operations/', views.StationsOperationsReportView.as_view(), name='report-stations-operations'),
     path('item-status/', views.ItemStatusReportView.as_view(), name='report-stations-operations'),
     path('general-item/', views.GeneralItemOperationsReportView.as_view(), name='report-stations-operations'),
+    path('jobs/<uuid:job_id>/', views.ReportJobView.as_view(), name='report-job'),
+    path('jobs/<uuid:job_id>/download/', views.ReportJobDownloadView.as_view(), name='report-job-download'),
 ]
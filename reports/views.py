@@ -1,25 +1,194 @@
 from rest_framework.response import Response
-from rest_framework import status 
+from rest_framework import status
 from .serializers import  GeneralItemReportSerializer,  GeneralWarehouseReportSerializer
-from .renderers import ExcelRenderer , PdfRenderer
-from rest_framework.renderers import JSONRenderer  
+from .renderers import ArrowRenderer, CsvRenderer, ExcelRenderer , ParquetRenderer, PdfRenderer, TsvRenderer
+from .exporters import EXPORTERS, ReportSection, export_response
+from . import cache as report_cache
+from . import jobs as report_jobs
+from . import pagination as report_pagination
+from .aggregates import BUCKETS, movement_totals
+from .models import ReportJob
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
-from rest_framework.response import Response
+from django.http import FileResponse
 from datetime import datetime
+from django.db.models import Exists, F, OuterRef, Prefetch, Sum
 from .serializers import (
-    GeneralWarehouseReportSerializer, WarehouseItemStatusSerializer,
-    ReportSupplySerializer, ReportExportSerializer
+    ReportJobSerializer, ReportDamageSerializer, ReportReturnExportSerializer, ReportReturnSupplySerializer, ReportTransferSerializer,
+    WarehouseItemAsOfSerializer, WarehouseItemStatusSerializer,
+    ReportSupplySerializer, ReportExportSerializer, ReportMovementSummarySerializer,
+    ReportMovementRangeTotalsSerializer, ReportMovementTotalsSerializer,
 )
 from operations.models import  ReturnDispatchOperation,DamageOperation,  SupplyOperation, ExportOperation, ReturnSupplyOperation, TransferOperation
-from inventory.models import InventoryWarehouseitem
+from operations.models import (
+    DamageOperationItem, ExportOperationItem, ReturnDispatchOperationItem, ReturnSupplyOperationItem,
+    SupplyOperationItem, TransferOperationItem,
+)
+from inventory.models import DailyMovementSummary, InventoryWarehouseitem
+from core.services import data_versions, warehouse_tree
 from core.services.mixins import UserPermissionsMixin
+from core.services.stock_history import stock_as_of
+
+
+DETAIL = 'detail'
+SUMMARY = 'summary'
+TOTALS = 'totals'
+ITEM = 'item'
+BY_PERIOD = 'by_period'
+
+
+class ReportParameterError(ValueError):
+    """
+    Raised while building a report for a query parameter it cannot use; answered with 400.
+    """
 
 
 class ReportAPIView(APIView):
     """
     Basic API interface for reports with support for exporting and date search.
+
+    A subclass names its required query parameter and returns its data as a list of
+    ReportSection from get_sections(). JSON and PDF are rendered from the serialized
+    sections; the file formats in reports.exporters.EXPORTERS are written row by row
+    from the querysets and streamed.
     """
-    renderer_classes = [JSONRenderer, ExcelRenderer, PdfRenderer]
+    renderer_classes = [
+        JSONRenderer, ExcelRenderer, PdfRenderer, CsvRenderer, TsvRenderer, ParquetRenderer, ArrowRenderer,
+    ]
+
+    # The query parameter that selects the report subject, e.g. 'warehouse_id'.
+    required_param = None
+    # The start of the exported file name; the subject id and the date are appended.
+    filename_prefix = 'report'
+    # Serializes the sections as one object; None for reports made of a single list.
+    report_serializer_class = None
+    # Values accepted by ?mode=; 'detail' lists the operations.
+    modes = (DETAIL,)
+    # Modes whose sections are serialized with report_serializer_class.
+    sectioned_modes = (DETAIL,)
+    # Whether the subject is a warehouse, which ?include_descendants=1 extends to the warehouses under it.
+    warehouse_subject = False
+
+    def get(self, request, *args, **kwargs):
+        object_id = request.query_params.get(self.required_param)
+        if not object_id:
+            return Response({"error": f"{self.required_param} is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        self.mode = request.query_params.get('mode', DETAIL)
+        if self.mode not in self.modes:
+            return Response(
+                {"error": f"mode must be one of: {', '.join(self.modes)}."}, status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        file_format = request.accepted_renderer.format
+        if request.query_params.get('async') in ('1', 'true'):
+            return self.enqueue_job(request, file_format)
+        if file_format in report_cache.CACHED_FORMATS:
+            self.report_cache_key = report_cache.cache_key(
+                self, request, file_format, self.get_data_version_scopes(object_id),
+            )
+            cached = report_cache.cached_response(self.report_cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            sections = self.get_sections(object_id) if self.mode == DETAIL else self.get_mode_sections(object_id)
+        except ReportParameterError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        filename = f'{self.filename_prefix}_{object_id}_{datetime.now().strftime("%Y%m%d")}.{file_format}'
+        if file_format in EXPORTERS:
+            return export_response(sections, file_format, filename)
+
+        if file_format == 'json' and report_pagination.is_paginated(request):
+            return self.paginated_response(request, sections)
+
+        response = Response(self.serialize_sections(sections))
+        if file_format != 'json':
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    def paginated_response(self, request, sections):
+        """
+        One page of the JSON report: up to page_size rows of each section, and the
+        link to the next page (None on the last one).
+        """
+        try:
+            page_size = report_pagination.get_page_size(request)
+            positions = report_pagination.decode_cursor(request)
+        except report_pagination.InvalidCursor as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        page, next_positions = report_pagination.paginate_sections(sections, positions, page_size)
+        return Response({
+            'next': report_pagination.next_link(request, next_positions),
+            'results': self.serialize_sections(page),
+        })
+
+    def enqueue_job(self, request, file_format):
+        """
+        Answers 202 with a job that renders this report in the background.
+        """
+        if not request.user.is_authenticated:
+            raise NotAuthenticated()
+        try:
+            job = report_jobs.enqueue(self, request, file_format)
+        except report_jobs.ReportQueueFull:
+            return Response(
+                {"error": "Too many reports are being generated. Try again shortly."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '30'},
+            )
+        data = ReportJobSerializer(job, context={'request': request}).data
+        return Response(data, status=status.HTTP_202_ACCEPTED, headers={'Location': data['status_url']})
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'report_cache_key', None)
+        if key and response.get('X-Report-Cache') != 'hit':
+            report_cache.store_response(key, response)
+        return response
+
+    def get_data_version_scopes(self, object_id):
+        """
+        The data versions a cached copy of the report depends on. Reports that span
+        warehouses depend on every change; see core.services.data_versions.
+        """
+        return [data_versions.ALL]
+
+    def get_sections(self, object_id):
+        raise NotImplementedError
+
+    def includes_descendants(self):
+        return self.warehouse_subject and warehouse_tree.include_descendants(self.request)
+
+    def subject_filter(self, field, object_id):
+        """
+        Keyword arguments for .filter() matching `field` against the report subject.
+        """
+        return warehouse_tree.warehouse_filter(field, object_id, self.includes_descendants())
+
+    def warehouse_data_version_scopes(self, warehouse_id):
+        warehouse_ids = warehouse_tree.warehouse_ids(warehouse_id, self.includes_descendants())
+        return [*(data_versions.warehouse_scope(pk) for pk in sorted(map(str, warehouse_ids))), data_versions.CATALOG]
+
+    def get_mode_sections(self, object_id):
+        """
+        The sections of a mode other than 'detail', from get_<mode>_sections(); these
+        are always a single list.
+        """
+        return getattr(self, f'get_{self.mode}_sections')(object_id)
+
+    def serialize_sections(self, sections):
+        if self.report_serializer_class is None or self.mode not in self.sectioned_modes:
+            section, = sections
+            return section.serializer_class(section.queryset, many=True).data
+        instance = {}
+        for section in sections:
+            target = instance.setdefault(section.group, {}) if section.group else instance
+            target[section.name] = section.queryset
+        return self.report_serializer_class(instance=instance).data
 
     def get_date_filters(self):
         """The date filters are extracted from the request."""
@@ -32,6 +201,13 @@ class ReportAPIView(APIView):
             filters['end_date'] = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         return filters
 
+    def get_as_of(self):
+        """The optional as_of date (YYYY-MM-DD) for point-in-time stock reports."""
+        as_of_str = self.request.query_params.get('as_of')
+        if as_of_str:
+            return datetime.strptime(as_of_str, '%Y-%m-%d').date()
+        return None
+
     def add_date_filters(self, queryset, date_field_name, date_filters):
         """Date filters are applied to the QuerySet."""
         if 'start_date' in date_filters:
@@ -41,144 +217,216 @@ class ReportAPIView(APIView):
         return queryset
 
 
-class GeneralWarehouseReportView(ReportAPIView, UserPermissionsMixin):
+class MovementSummaryMixin:
     """
-    General warehouse movement report.Required: warehouse_id
-    Optional: start_date, end_date
+    Adds ?mode=summary to a report: the quantity and number of lines per day, warehouse,
+    item and movement type, read from DailyMovementSummary instead of the operations.
+    `summary_filter` is the DailyMovementSummary field matched against the report subject.
     """
-    pdf_template_name = 'reports/general_warehouse_report.html'
-    warehouse_field_lookup = 'warehouse__in'
+    modes = (DETAIL, SUMMARY)
+    summary_filter = None
+    summary_pdf_template_name = 'reports/movement_summary_report.html'
 
-    def get(self, request, *args, **kwargs):
-        warehouse_id = request.query_params.get('warehouse_id')
+    def get_summary_sections(self, object_id):
+        self.pdf_template_name = self.summary_pdf_template_name
+        date_filters = self.get_date_filters()
+        queryset = self.add_date_filters(
+            DailyMovementSummary.objects.filter(**self.subject_filter(self.summary_filter, object_id)), 'date', date_filters
+        )
+        rows = (
+            queryset.values('date', 'warehouse_id', 'item_id', 'operation_type')
+            .annotate(
+                warehouse_name=F('warehouse__name'),
+                item_name=F('item__name'),
+                total_quantity=Sum('quantity'),
+                line_count=Sum('count'),
+            )
+            .filter(line_count__gt=0)
+            .order_by('date', 'warehouse_id', 'item_id', 'operation_type')
+        )
+        return [ReportSection(
+            'summary', rows, ReportMovementSummarySerializer,
+            keyset=('date', 'warehouse_id', 'item_id', 'operation_type'),
+        )]
 
-        if not warehouse_id:
-            return Response({"error": "warehouse_id is required."}, status=status.HTTP_400_BAD_REQUEST)
 
+class MovementTotalsMixin:
+    """
+    Adds ?mode=totals (quantity and number of lines per warehouse, item and movement
+    type over the date range) and ?mode=by_period&bucket=day|week|month (the same per
+    period), computed with GROUP BY in the database; see reports.aggregates.
+    `totals_subject` is the LineSource field matched against the report subject.
+    """
+    modes = (DETAIL, TOTALS, BY_PERIOD)
+    totals_subject = None
+    totals_pdf_template_name = 'reports/movement_totals_report.html'
+
+    def get_totals_sections(self, object_id):
+        self.pdf_template_name = self.totals_pdf_template_name
+        rows = movement_totals(
+            self.totals_subject, object_id, self.get_date_filters(), descendants=self.includes_descendants(),
+        )
+        return [ReportSection('totals', rows, ReportMovementRangeTotalsSerializer)]
+
+    def get_by_period_sections(self, object_id):
+        bucket = self.request.query_params.get('bucket')
+        if bucket not in BUCKETS:
+            raise ReportParameterError(f"bucket must be one of: {', '.join(BUCKETS)}.")
+        self.pdf_template_name = self.totals_pdf_template_name
+        rows = movement_totals(
+            self.totals_subject, object_id, self.get_date_filters(), bucket, descendants=self.includes_descendants(),
+        )
+        return [ReportSection('totals', rows, ReportMovementTotalsSerializer)]
+
+
+class GeneralWarehouseReportView(MovementSummaryMixin, MovementTotalsMixin, ReportAPIView, UserPermissionsMixin):
+    """
+    General warehouse movement report.Required: warehouse_id
+    Optional: start_date, end_date, mode=summary|totals|by_period (with bucket=day|week|month),
+    include_descendants=1 to cover the warehouses under it too
+    """
+    pdf_template_name = 'reports/general_warehouse_report.html'
+    warehouse_field_lookup = 'warehouse__in'
+    required_param = 'warehouse_id'
+    filename_prefix = 'report_warehouse'
+    summary_filter = 'warehouse'
+    totals_subject = 'warehouse'
+    modes = (DETAIL, SUMMARY, TOTALS, BY_PERIOD)
+    report_serializer_class = GeneralWarehouseReportSerializer
+    warehouse_subject = True
+
+    def get_data_version_scopes(self, warehouse_id):
+        return self.warehouse_data_version_scopes(warehouse_id)
+
+    def get_sections(self, warehouse_id):
         date_filters = self.get_date_filters()
 
         supplies_qs = self.add_date_filters(
-            SupplyOperation.objects.filter(warehouse=warehouse_id), 'operation_date', date_filters
+            SupplyOperation.objects.filter(**self.subject_filter('warehouse', warehouse_id)), 'operation_date', date_filters
         )
-        print(f"supplies_qs fedr{supplies_qs.first()}")
         dispatches_qs = self.add_date_filters(
-            ExportOperation.objects.filter(warehouse=warehouse_id), 'operation_date', date_filters
+            ExportOperation.objects.filter(**self.subject_filter('warehouse', warehouse_id)), 'operation_date', date_filters
         )
         supply_returns_qs = self.add_date_filters(
-            ReturnSupplyOperation.objects.filter(original_operation__warehouse=warehouse_id), 'operation_date', date_filters
+            ReturnSupplyOperation.objects.filter(**self.subject_filter('original_operation__warehouse', warehouse_id)), 'operation_date', date_filters
         )
 
         dispatches_returns_qs = self.add_date_filters(
-            ReturnDispatchOperation.objects.filter(original_operation__warehouse = warehouse_id) , 'operation_date', date_filters
+            ReturnDispatchOperation.objects.filter(**self.subject_filter('original_operation__warehouse', warehouse_id)) , 'operation_date', date_filters
         )
         damage_qs = self.add_date_filters(
-            DamageOperation.objects.filter(warehouse = warehouse_id), 'operation_date', date_filters
+            DamageOperation.objects.filter(**self.subject_filter('warehouse', warehouse_id)), 'operation_date', date_filters
         )
 
-
-        returns = {
-            'supply_returns': supply_returns_qs.prefetch_related('returned_items__item', 'original_operation'),
-            'dispatch_returns': dispatches_returns_qs.prefetch_related('returned_items__item', 'original_operation'),
-        }
-        data = {
-            'supplies': supplies_qs.prefetch_related('items__item', 'supplier'),
-            'dispatches': dispatches_qs.prefetch_related('items__item', 'beneficiary'),
-            'returns':returns,
-            'damages': damage_qs.prefetch_related('items__item', 'warehouse'),
-        }
-
-        serializer = GeneralWarehouseReportSerializer(instance=data)
-        return Response(serializer.data)
+        return [
+            ReportSection(
+                'supplies',
+                supplies_qs.select_related('warehouse', 'supplier', 'stations').prefetch_related('items__item'),
+                ReportSupplySerializer,
+            ),
+            ReportSection(
+                'dispatches',
+                dispatches_qs.select_related('warehouse', 'beneficiary').prefetch_related('items__item'),
+                ReportExportSerializer,
+            ),
+            ReportSection(
+                'supply_returns',
+                supply_returns_qs.select_related(
+                    'original_operation__warehouse', 'original_operation__supplier', 'original_operation__stations',
+                ).prefetch_related('returned_items__item'),
+                ReportReturnSupplySerializer,
+                group='returns',
+            ),
+            ReportSection(
+                'dispatch_returns',
+                dispatches_returns_qs.select_related(
+                    'original_operation__warehouse', 'original_operation__beneficiary',
+                ).prefetch_related('returned_items__item'),
+                ReportReturnExportSerializer,
+                group='returns',
+            ),
+            ReportSection(
+                'damages',
+                damage_qs.select_related('warehouse').prefetch_related('items__item'),
+                ReportDamageSerializer,
+            ),
+        ]
 
 class WarehouseStatusReportView(ReportAPIView):
     """
         The items status report in a specific warehouse.
         Requires: warehouse_id
+        Optional: as_of (YYYY-MM-DD) for the stock at the end of that day,
+        include_descendants=1 for the stock of the warehouses under it too.
     """
 
-    pdf_template_name = 'reports//item_status_report.html' 
-    def get(self, request, *args, **kwargs):
-        warehouse_id = request.query_params.get('warehouse_id')
-        if not warehouse_id:
-            return Response({"error": "warehouse_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+    pdf_template_name = 'reports//item_status_report.html'
+    required_param = 'warehouse_id'
+    filename_prefix = 'report_status_warehouse'
+    warehouse_subject = True
+
+    def get_data_version_scopes(self, warehouse_id):
+        return self.warehouse_data_version_scopes(warehouse_id)
+
+    def get_sections(self, warehouse_id):
+        as_of = self.get_as_of()
+        if as_of:
+            rows = stock_as_of(InventoryWarehouseitem.objects.filter(**self.subject_filter('warehouse', warehouse_id)), as_of)
+            return [ReportSection('warehouse_status', rows, WarehouseItemAsOfSerializer)]
         date_filters = self.get_date_filters()
         queryset = self.add_date_filters(
-            InventoryWarehouseitem.objects.filter(warehouse_id=warehouse_id), 
-            'last_updated', 
+            InventoryWarehouseitem.objects.filter(**self.subject_filter('warehouse', warehouse_id)),
+            'last_updated',
             date_filters
-        ).prefetch_related('item', 'warehouse')
-        serializer = WarehouseItemStatusSerializer(queryset, many=True)
+        ).select_related('item', 'warehouse')
+        return [ReportSection('warehouse_status', queryset, WarehouseItemStatusSerializer, keyset=('id',))]
 
-        response = Response(serializer.data)
 
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_status_warehouse_{warehouse_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_status_warehouse_{warehouse_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-        return response
-    
-    
 
 class ItemStatusReportView(ReportAPIView):
     """
         The item status report in a all warehouse.
         Requires: item_id
+        Optional: as_of (YYYY-MM-DD) for the stock at the end of that day.
     """
-    pdf_template_name = 'reports//item_status_report.html' 
-
-    def get(self, request, *args, **kwargs):
-        item_id = request.query_params.get('item_id')
-        if not item_id:
-            return Response({"error": "item_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
+    pdf_template_name = 'reports//item_status_report.html'
+    required_param = 'item_id'
+    filename_prefix = 'report_status_item'
+
+    def get_sections(self, item_id):
+        as_of = self.get_as_of()
+        if as_of:
+            rows = stock_as_of(InventoryWarehouseitem.objects.filter(item=item_id), as_of)
+            return [ReportSection('item_status', rows, WarehouseItemAsOfSerializer)]
         date_filters = self.get_date_filters()
-
         queryset = self.add_date_filters(
-            InventoryWarehouseitem.objects.filter(item=item_id), 
-            'last_updated', 
+            InventoryWarehouseitem.objects.filter(item=item_id),
+            'last_updated',
             date_filters
-        ).prefetch_related('item', 'warehouse')
-
-        serializer = WarehouseItemStatusSerializer(queryset, many=True)
-        
-        response = Response(serializer.data)
+        ).select_related('item', 'warehouse')
+        return [ReportSection('item_status', queryset, WarehouseItemStatusSerializer, keyset=('id',))]
 
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_status_item_{item_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_status_item_{item_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-        return response
-    
 
 
-class SupplierOperationsReportView(ReportAPIView):
+class SupplierOperationsReportView(MovementSummaryMixin, ReportAPIView):
     """
         Incoming operations report for a specific supplier.
         Requires: supplier_id
+        Optional: start_date, end_date, mode=summary
     """
 
-    pdf_template_name = 'reports//supply_by_station_report.html' 
-
+    pdf_template_name = 'reports//supply_by_station_report.html'
+    required_param = 'supplier_id'
+    filename_prefix = 'report_supplier'
+    summary_filter = 'supplier'
 
-    def get(self, request, *args, **kwargs):
-        supplier_id = request.query_params.get('supplier_id')
-        if not supplier_id:
-            return Response({"error": "supplier_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
+    def get_sections(self, supplier_id):
         date_filters = self.get_date_filters()
         queryset = self.add_date_filters(
             SupplyOperation.objects.filter(supplier_id=supplier_id), 'operation_date', date_filters
-        ).prefetch_related('items__item', 'warehouse')
-        
-        serializer = ReportSupplySerializer(queryset, many=True)
-        response = Response(serializer.data)
-
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_supplier_{supplier_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_supplier_{supplier_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-        return response
-    
+        ).select_related('warehouse', 'supplier', 'stations').prefetch_related('items__item')
+        return [ReportSection('supplies', queryset, ReportSupplySerializer)]
+
 
 class BeneficiaryOperationsReportView(ReportAPIView):
     """
@@ -186,129 +434,163 @@ class BeneficiaryOperationsReportView(ReportAPIView):
         Requires: beneficiary_id
     """
 
-    pdf_template_name = 'reports//general_beneficiary_report.html' 
+    pdf_template_name = 'reports//general_beneficiary_report.html'
+    required_param = 'beneficiary_id'
+    filename_prefix = 'report_beneficiary'
 
-    def get(self, request, *args, **kwargs):
-        beneficiary_id = request.query_params.get('beneficiary_id')
-        if not beneficiary_id:
-            return Response({"error": "beneficiary_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        beneficiary_id = request.query_params.get('beneficiary_id')
-        if not beneficiary_id:
-            return Response({"error": "beneficiary_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
+    def get_sections(self, beneficiary_id):
         date_filters = self.get_date_filters()
         queryset = self.add_date_filters(
             ExportOperation.objects.filter(beneficiary=beneficiary_id), 'operation_date', date_filters
-        ).prefetch_related('items__item', 'warehouse')
-        
-        serializer = ReportExportSerializer(queryset, many=True)
-        response = Response(serializer.data)
-
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_beneficiary_{beneficiary_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_beneficiary_{beneficiary_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-        return response
-    
-class StationsOperationsReportView(ReportAPIView):
+        ).select_related('warehouse', 'beneficiary').prefetch_related('items__item')
+        return [ReportSection('dispatches', queryset, ReportExportSerializer)]
+
+class StationsOperationsReportView(MovementSummaryMixin, ReportAPIView):
     """
         Incoming operations report for a specific stations.
         Requires: stations_id
+        Optional: start_date, end_date, mode=summary
     """
 
-    pdf_template_name = 'reports//supply_by_station_report.html' 
-    def get(self, request, *args, **kwargs):
-        stations_id = request.query_params.get('stations_id')
-        if not stations_id:
-            return Response({"error": "stations_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-        
+    pdf_template_name = 'reports//supply_by_station_report.html'
+    required_param = 'stations_id'
+    filename_prefix = 'report_stations'
+    summary_filter = 'stations'
+
+    def get_sections(self, stations_id):
         date_filters = self.get_date_filters()
         queryset = self.add_date_filters(
             SupplyOperation.objects.filter(stations=stations_id), 'operation_date', date_filters
-        ).prefetch_related('items__item', 'warehouse')
-        
-        serializer = ReportSupplySerializer(queryset, many=True)
-        response = Response(serializer.data)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_stations_{stations_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_stations_{stations_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-            
-        return response
+        ).select_related('warehouse', 'supplier', 'stations').prefetch_related('items__item')
+        return [ReportSection('supplies', queryset, ReportSupplySerializer)]
 
 
-class GeneralItemOperationsReportView(ReportAPIView):
+class GeneralItemOperationsReportView(MovementTotalsMixin, ReportAPIView):
     """
     General item movement report. Requires: item_id.
-    Optional: start_date, end_date.
+    Optional: start_date, end_date, mode=item|totals|by_period (with bucket=day|week|month).
+
+    The operations holding a line of the item are listed with all their lines; with
+    mode=item only the lines of the requested item are loaded and shown.
     """
 
-    pdf_template_name = 'reports//general_items_report.html' 
+    pdf_template_name = 'reports//general_items_report.html'
+    required_param = 'item_id'
+    filename_prefix = 'report_item'
+    report_serializer_class = GeneralItemReportSerializer
+    totals_subject = 'item'
+    modes = (DETAIL, ITEM, TOTALS, BY_PERIOD)
+    sectioned_modes = (DETAIL, ITEM)
+
+    def get_item_sections(self, item_id):
+        return self.get_sections(item_id)
+
+    def operations_with_item(self, model, line_model, line_relation, item_id):
+        """
+        The operations of `model` that have a line of the item, each once. EXISTS keeps
+        the parents distinct without a join or DISTINCT over the operation columns.
+        """
+        lines = line_model.objects.filter(**{line_relation: OuterRef('pk')}, item_id=item_id)
+        return self.add_date_filters(
+            model.objects.filter(Exists(lines)), 'operation_date', self.get_date_filters()
+        )
 
-    def get(self, request, *args, **kwargs):
-        item_id = request.query_params.get('item_id')
-        if not item_id:
-            return Response({"error": "item_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+    def lines_prefetch(self, lines_field, line_model, item_id):
+        if self.mode == ITEM:
+            return Prefetch(lines_field, queryset=line_model.objects.filter(item_id=item_id).select_related('item'))
+        return f'{lines_field}__item'
 
-        date_filters = self.get_date_filters()
+    def get_sections(self, item_id):
+        supplies_qs = self.operations_with_item(SupplyOperation, SupplyOperationItem, 'operation', item_id)
+        dispatches_qs = self.operations_with_item(ExportOperation, ExportOperationItem, 'operation', item_id)
+        supply_returns_qs = self.operations_with_item(
+            ReturnSupplyOperation, ReturnSupplyOperationItem, 'return_operation', item_id
+        )
+        dispatch_returns_qs = self.operations_with_item(
+            ReturnDispatchOperation, ReturnDispatchOperationItem, 'return_operation', item_id
+        )
+        damage_qs = self.operations_with_item(DamageOperation, DamageOperationItem, 'operation', item_id)
+        transfers_qs = self.operations_with_item(TransferOperation, TransferOperationItem, 'operation', item_id)
+
+        return [
+            ReportSection(
+                'supplies',
+                supplies_qs.select_related('warehouse', 'supplier', 'stations').prefetch_related(
+                    self.lines_prefetch('items', SupplyOperationItem, item_id),
+                ),
+                ReportSupplySerializer,
+            ),
+            ReportSection(
+                'dispatches',
+                dispatches_qs.select_related('warehouse', 'beneficiary').prefetch_related(
+                    self.lines_prefetch('items', ExportOperationItem, item_id),
+                ),
+                ReportExportSerializer,
+            ),
+            ReportSection(
+                'supply_returns',
+                supply_returns_qs.select_related(
+                    'original_operation__warehouse', 'original_operation__supplier', 'original_operation__stations',
+                ).prefetch_related(self.lines_prefetch('returned_items', ReturnSupplyOperationItem, item_id)),
+                ReportReturnSupplySerializer,
+                group='returns',
+            ),
+            ReportSection(
+                'dispatch_returns',
+                dispatch_returns_qs.select_related(
+                    'original_operation__warehouse', 'original_operation__beneficiary',
+                ).prefetch_related(self.lines_prefetch('returned_items', ReturnDispatchOperationItem, item_id)),
+                ReportReturnExportSerializer,
+                group='returns',
+            ),
+            ReportSection(
+                'damages',
+                damage_qs.select_related('warehouse').prefetch_related(
+                    self.lines_prefetch('items', DamageOperationItem, item_id),
+                ),
+                ReportDamageSerializer,
+            ),
+            # Named after the 'transfer' field of GeneralItemReportSerializer.
+            ReportSection(
+                'transfer',
+                transfers_qs.select_related('from_warehouse', 'to_warehouse').prefetch_related(
+                    self.lines_prefetch('items', TransferOperationItem, item_id),
+                ),
+                ReportTransferSerializer,
+            ),
+        ]
+
+
+class ReportJobView(APIView):
+    """
+    Status of a report requested with ?async=1. When `status` is "done",
+    `download_url` serves the file until `expires_at`. DELETE discards the job.
+    """
+    permission_classes = [IsAuthenticated]
 
+    def get_job(self, request, job_id):
+        return get_object_or_404(ReportJob, pk=job_id, user=request.user)
 
-        supplies_qs = self.add_date_filters(
-            SupplyOperation.objects.filter(items__item_id=item_id),
-            'operation_date',
-            date_filters
-        )
+    def get(self, request, job_id, *args, **kwargs):
+        return Response(ReportJobSerializer(self.get_job(request, job_id), context={'request': request}).data)
 
-        dispatches_qs = self.add_date_filters(
-            ExportOperation.objects.filter(items__item_id=item_id),
-            'operation_date',
-            date_filters
-        )
+    def delete(self, request, job_id, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        if job.status == ReportJob.Status.RUNNING:
+            return Response({"error": "The report is being generated."}, status=status.HTTP_409_CONFLICT)
+        report_jobs.delete_job(job)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
-        supply_returns_qs = self.add_date_filters(
-            ReturnSupplyOperation.objects.filter(returned_items__item_id=item_id),
-            'operation_date',
-            date_filters
-        )
-        
-        dispatch_returns_qs = self.add_date_filters(
-            ReturnDispatchOperation.objects.filter(returned_items__item_id=item_id),
-            'operation_date',
-            date_filters
-        )
 
-        damage_qs = self.add_date_filters(
-            DamageOperation.objects.filter(items__item_id=item_id),
-            'operation_date',
-            date_filters
-        )
+class ReportJobDownloadView(ReportJobView):
+    """
+    The file of a finished report job.
+    """
 
-        transfers_from_qs = self.add_date_filters(
-            TransferOperation.objects.filter(items__item_id=item_id),
-            'operation_date',
-            date_filters
+    def get(self, request, job_id, *args, **kwargs):
+        job = self.get_job(request, job_id)
+        if job.status != ReportJob.Status.DONE:
+            return Response({"error": f"The report is {job.status}."}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(
+            job.result.open('rb'), as_attachment=True, filename=job.filename, content_type=job.content_type,
         )
-        
-        returns = {
-            'supply_returns': supply_returns_qs.prefetch_related('returned_items__item', 'original_operation__warehouse'),
-            'dispatch_returns': dispatch_returns_qs.prefetch_related('returned_items__item', 'original_operation__warehouse'),
-        }
-
-        data = {
-            'supplies': supplies_qs.prefetch_related('items__item', 'supplier', 'warehouse'),
-            'dispatches': dispatches_qs.prefetch_related('items__item', 'beneficiary', 'warehouse'),
-            'returns':returns,
-            'damages': damage_qs.prefetch_related('items__item', 'warehouse'),
-            'transfers_from': transfers_from_qs.prefetch_related('items__item', 'from_warehouse', 'to_warehouse'),
-        }
-
-        serializer = GeneralItemReportSerializer(instance=data)
-        
-        response = Response(serializer.data)
-        if request.accepted_renderer.format == 'xlsx':
-            response['Content-Disposition'] = f'attachment; filename="report_item_{item_id}_{datetime.now().strftime("%Y%m%d")}.xlsx"'
-        if request.accepted_renderer.format == 'pdf':
-            response['Content-Disposition'] = f'attachment; filename="report_item_{item_id}_{datetime.now().strftime("%Y%m%d")}.pdf"'
-            
-        return response
-